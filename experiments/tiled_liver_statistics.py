@@ -50,7 +50,6 @@ import misc
 import qmisc
 from io3d import datareader
 import matplotlib.pyplot as plt
-from lisa import experiments
 import texture_features as tfeat
 
 
@@ -161,35 +160,128 @@ def get_features_in_tiles(
         data3d_seg,
         tile_shape,
         feature_fcn,
-        feature_fcn_params):
+        feature_fcn_params,
+        skip_empty=False,
+        n_jobs=1):
     """
     Computes features for small blocks of image data (tiles).
 
+    Tiles are strided views into input data (no copy is made).
+
+    skip_empty: features are not computed for tiles without segmentation.
+    Rows of these tiles are filled with zeros.
+    n_jobs: number of processes used for feature computation
+
     cindexes: indexes of tiles
-    features_t: numpy array of features
+    features_t: float32 numpy array with shape (n_tiles, n_features)
     segmentation_cover: np array with coverages of tiles with segmentation
     (float 0 by 1)
 
     """
     cindexes = cutter_indexes(data3d_orig.shape, tile_shape)
-# create empty list of defined length
-    features_t = [None] * len(cindexes)
-    seg_cover_t = [None] * len(cindexes)
+    seg_cover_t = tiles_coverage(data3d_seg, tile_shape)
     logger.debug(
         " ##    get fv" + str(len(cindexes)) + " dsh " +
         str(data3d_orig.shape) + 'tile_shape ' + str(tile_shape))
-    for i in range(0, len(cindexes)):
-        cindex = cindexes[i]
-        tile_orig = experiments.getArea(data3d_orig, cindex, tile_shape)
-        tile_seg = experiments.getArea(data3d_seg, cindex, tile_shape)
-        tf = get_features(tile_orig, tile_seg, feature_fcn, feature_fcn_params,
-                          visualization=False)
-        sc = np.sum(tile_seg > 0).astype(np.float) / np.prod(tile_shape)
-        features_t[i] = tf
-        seg_cover_t[i] = sc
+
+    if skip_empty:
+        tile_ids = np.nonzero(seg_cover_t > 0)[0]
+    else:
+        tile_ids = np.arange(len(cindexes))
+
+    initargs = (data3d_orig, data3d_seg, tile_shape, feature_fcn,
+                feature_fcn_params)
+    if n_jobs == 1 or len(tile_ids) < 2:
+        _init_tile_worker(*initargs)
+        features_list = [_tile_features(i) for i in tile_ids]
+    else:
+        import multiprocessing
+        # input data are passed to workers once. With fork they are shared
+        # with parent process without copy.
+        pool = multiprocessing.Pool(
+            processes=n_jobs,
+            initializer=_init_tile_worker,
+            initargs=initargs)
+        try:
+            chunksize = max(1, len(tile_ids) // (4 * pool._processes))
+            features_list = pool.map(_tile_features, tile_ids,
+                                     chunksize=chunksize)
+        finally:
+            pool.close()
+            pool.join()
+    _init_tile_worker(None, None, None, None, None)
+
+    n_features = len(features_list[0]) if len(features_list) > 0 else 0
+    features_t = np.zeros([len(cindexes), n_features], dtype=np.float32)
+    if len(features_list) > 0:
+        features_t[tile_ids] = features_list
     return cindexes, features_t, seg_cover_t
-    # if (tile_seg == 1).all():
-    #    pass
+
+
+# data shared by tile workers, set by _init_tile_worker()
+_tile_worker_data = {}
+
+
+def _init_tile_worker(data3d_orig, data3d_seg, tile_shape, feature_fcn,
+                      feature_fcn_params):
+    if data3d_orig is None:
+        _tile_worker_data.clear()
+        return
+    _tile_worker_data['orig'] = tile_views(data3d_orig, tile_shape)
+    _tile_worker_data['seg'] = tile_views(data3d_seg, tile_shape)
+    _tile_worker_data['feature_fcn'] = feature_fcn
+    _tile_worker_data['feature_fcn_params'] = feature_fcn_params
+
+
+def _tile_features(i):
+    orig = _tile_worker_data['orig']
+    seg = _tile_worker_data['seg']
+    tile_index = np.unravel_index(i, orig.shape[:3])
+    tf = get_features(
+        orig[tile_index], seg[tile_index],
+        _tile_worker_data['feature_fcn'],
+        _tile_worker_data['feature_fcn_params'],
+        visualization=False)
+    return np.asarray(tf, dtype=np.float32).ravel()
+
+
+def tiles_grid_shape(shape, tile_shape):
+    """
+    Number of tiles in every axis. It is consistent with cutter_indexes().
+    """
+    return tuple(
+        max(len(range(0, shape[i], tile_shape[i])) - 1, 0)
+        for i in range(3)
+    )
+
+
+def tile_views(data3d, tile_shape):
+    """
+    Make 6D view of data. First three axes are tile indexes, other three are
+    indexes inside tile. Data are not copied.
+
+    tiles = tile_views(data3d, tile_shape)
+    tiles[1, 2, 0] is same as cut_tile(data3d, [1 * tile_shape[0],
+    2 * tile_shape[1], 0], tile_shape)
+    """
+    grid_shape = tiles_grid_shape(data3d.shape, tile_shape)
+    strides = tuple(
+        np.asarray(data3d.strides) * np.asarray(tile_shape)
+    ) + data3d.strides
+    return np.lib.stride_tricks.as_strided(
+        data3d,
+        shape=tuple(grid_shape) + tuple(tile_shape),
+        strides=strides)
+
+
+def tiles_coverage(data3d_seg, tile_shape):
+    """
+    Coverages of tiles with segmentation (float 0 by 1) in cutter_indexes()
+    order.
+    """
+    tiles = tile_views(data3d_seg, tile_shape)
+    counts = np.sum(tiles > 0, axis=(3, 4, 5))
+    return counts.ravel().astype(float) / np.prod(tile_shape)
 
 
 def cutter_indexes(shape, tile_shape):
@@ -228,12 +320,16 @@ def cut_tile(data3d, cindex, tile_shape):
 def arrange_to_tiled_data(cindexes, tile_shape, data3d_shape, labels_lin):
     """ Creates 3D image with values of labels.  """
 
-    labels = np.zeros(data3d_shape, dtype=type(labels_lin[0]))
-    for i in range(0, len(cindexes)):
-        cindex = cindexes[i]
-
-# TODO labels shape
-        labels = experiments.setArea(labels, cindex, tile_shape, labels_lin[i])
+    labels_lin = np.asarray(labels_lin)
+    labels = np.zeros(data3d_shape, dtype=labels_lin.dtype)
+    if len(cindexes) == 0:
+        return labels
+    grid = np.zeros(tiles_grid_shape(data3d_shape, tile_shape),
+                    dtype=labels_lin.dtype)
+    tile_ids = np.asarray(cindexes) // np.asarray(tile_shape)
+    grid[tuple(tile_ids.T)] = labels_lin
+    tiles = tile_views(labels, tile_shape)
+    tiles[...] = grid[:, :, :, np.newaxis, np.newaxis, np.newaxis]
     return labels
 
 
@@ -424,7 +520,8 @@ def one_exp_set_training(inputdata, tile_shape,
                          classif_fcn_plus_params,
                          use_voxelsize_norm=False,
                          working_voxelsize_mm=[1, 1, 1],
-                         visualization=False):
+                         visualization=False,
+                         n_jobs=1):
     """
     Training of experiment.
     """
@@ -452,14 +549,16 @@ def one_exp_set_training(inputdata, tile_shape,
         logger.debug('data shape ' + str(data3d_orig.shape))
         fv_t = get_features_in_tiles(data3d_orig, data3d_seg, tile_shape,
                                      feature_fcn_plus_params[0],
-                                     feature_fcn_plus_params[1])
+                                     feature_fcn_plus_params[1],
+                                     n_jobs=n_jobs)
         cidxs, features_t, seg_cover_t = fv_t
         labels_train_lin_float = np.array(seg_cover_t)
         labels_train_lin = (
             labels_train_lin_float > 0.5).astype(np.int8).tolist()
 
-        features_t_all = features_t_all + features_t
+        features_t_all.append(features_t)
         labels_train_lin_all = labels_train_lin_all + labels_train_lin
+    features_t_all = np.concatenate(features_t_all, axis=0)
 
     # if there are named variables use dict unpacking
     if isinstance(classif_fcn_params, dict):
@@ -499,7 +598,8 @@ def one_exp_set_testing(
         classif_fcn_plus_params,
         use_voxelsize_norm=False,
         working_voxelsize_mm=[1, 1, 1],
-        visualization=False):
+        visualization=False,
+        n_jobs=1):
     indata_len = len(inputdata['data'])
     # indata_len = 3
     feature_fcn, feature_fcn_params = feature_fcn_plus_params
@@ -522,7 +622,8 @@ def one_exp_set_testing(
 
         fv_t = get_features_in_tiles(data3d_orig, data3d_seg, tile_shape,
                                      feature_fcn,
-                                     feature_fcn_params)
+                                     feature_fcn_params,
+                                     n_jobs=n_jobs)
         cidxs, features_t, seg_cover_t = fv_t
         # we are ignoring seg_cover_t which gives us information about
         # segmentation
@@ -567,7 +668,8 @@ def one_exp_set_for_whole_dataset(
         train,
         use_voxelsize_norm,
         working_voxelsize_mm,
-        visualization=False):
+        visualization=False,
+        n_jobs=1):
     fvall = []
     # fv_tiles = []
     print("classif_fcn ", classif_fcn_plus_params)
@@ -578,7 +680,8 @@ def one_exp_set_for_whole_dataset(
         classif_fcn_plus_params,
         use_voxelsize_norm,
         working_voxelsize_mm,
-        visualization=False)
+        visualization=False,
+        n_jobs=n_jobs)
 
     logger.info('run testing')
     one_exp_set_testing(testing_yaml, tile_shape,
@@ -586,7 +689,8 @@ def one_exp_set_for_whole_dataset(
                         classif_fcn_plus_params,
                         use_voxelsize_norm,
                         working_voxelsize_mm,
-                        visualization=visualization)
+                        visualization=visualization,
+                        n_jobs=n_jobs)
 
 # @TODO vracet něco inteligentního, fvall je prázdný
     return fvall
@@ -603,7 +707,7 @@ def experiment(training_yaml_path, testing_yaml_path,  featers_plus_classifs,
                tile_shape,
                use_voxelsize_norm,
                working_voxelsize_mm,
-               visualization=False, train=False):
+               visualization=False, train=False, n_jobs=1):
 
     training_yaml = misc.obj_from_file(training_yaml_path, filetype='yaml')
     testing_yaml = misc.obj_from_file(testing_yaml_path, filetype='yaml')
@@ -622,7 +726,8 @@ def experiment(training_yaml_path, testing_yaml_path,  featers_plus_classifs,
             train,
             use_voxelsize_norm,
             working_voxelsize_mm,
-            visualization)
+            visualization,
+            n_jobs=n_jobs)
 
         result = {'params': str(fpc), 'fvall': fvall}
         results.append(result)
@@ -731,6 +836,10 @@ def main():
         help='features by string: "hist", or "glcm", ...',
         nargs='+', type=str, default=['hist']
     )
+    parser.add_argument(
+        '-j', '--n_jobs', type=int, default=1,
+        help='number of processes used for feature computation'
+    )
     args = parser.parse_args()
 
     if args.sampleInput:
@@ -764,7 +873,8 @@ def main():
                         featrs_plus_classifs, tile_shape=tile_shape,
                         use_voxelsize_norm=True,
                         working_voxelsize_mm=[1, 1, 1],
-                        visualization=args.visualization, train=args.train)
+                        visualization=args.visualization, train=args.train,
+                        n_jobs=args.n_jobs)
 
 # Ukládání výsledku do souboru
     output_file = os.path.join(path_to_script, args.output)
@@ -0,0 +1,327 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+# vim:fenc=utf-8
+#
+# Distributed under terms of the MIT license.
+
+"""
+Batch segmentation service.
+
+Imports, config and trained models are loaded only once and many jobs are
+processed by pool of worker processes. Every job is processed by
+OrganSegmentation.make_run() (the same as `lisa -ni`).
+
+Job is dict:
+
+    {
+        "datapath": "~/data/case001.pklz",
+        "output_path": "~/lisa_data/case001-out.pklz",
+        "config": {"working_voxelsize_mm": 2.0}
+    }
+
+Jobs are read from JSON file (list of jobs) or from file with one JSON job
+per line:
+
+    python -m lisa --batch jobs.jsonl -j 4 --report report.jsonl
+
+With --watch the service waits for new "*.json" job files in spool
+directory. Processed job file is renamed to "*.json.done" and report is
+written next to it into "*.json.report". Job file which cannot be read is
+renamed to "*.json.failed" and the error is written into its report.
+
+    python -m lisa --batch --watch ~/lisa_data/spool -j 4
+"""
+
+import logging
+logger = logging.getLogger(__name__)
+import argparse
+import os
+import os.path as op
+import time
+import glob
+import json
+import traceback
+import multiprocessing
+
+from . import organ_segmentation
+from . import config
+from . import model_registry
+
+_worker_params = {}
+
+
+def default_params():
+    """
+    OrganSegmentation parameters from default and user config.
+    """
+    cfg = organ_segmentation.lisa_config_init()
+    oseg_keys = config.get_function_keys(
+        organ_segmentation.OrganSegmentation.__init__)
+    params = dict([(key, cfg[key]) for key in oseg_keys if key in cfg])
+    return params
+
+
+def preload_models(
+        filenames=[
+            "~/lisa_data/liver_intensity.Model.p",
+            "~/lisa_data/liver.ol.p"
+        ]):
+    """
+    Load trained models into model_registry before workers are forked.
+    Missing files are skipped.
+    """
+    loaders = {
+        ".ol.p": model_registry.get_organ_localizator,
+        ".Model.p": model_registry.get_intensity_model,
+    }
+    for filename in filenames:
+        if not op.exists(op.expanduser(filename)):
+            continue
+        for suffix, loader in loaders.items():
+            if filename.endswith(suffix):
+                try:
+                    loader(filename)
+                except Exception:
+                    logger.warning("model preload failed: " + filename)
+                    logger.debug(traceback.format_exc())
+
+
+def run_job(job, params=None):
+    """
+    Process one job with OrganSegmentation.make_run().
+
+    :param job: dict with "datapath", "output_path" and optional "config"
+    :param params: OrganSegmentation parameters, default config is used if
+    None
+    :return: report dict with status and timing
+    """
+    if params is None:
+        params = _worker_params if _worker_params else default_params()
+    report = {
+        "datapath": None,
+        "output_path": None,
+        "status": "failed",
+        "error": None,
+        "load_time_s": None,
+        "run_time_s": None,
+        "total_time_s": None,
+        "pid": os.getpid(),
+    }
+    t0 = time.time()
+    try:
+        if not isinstance(job, dict):
+            raise TypeError("Job should be dict, not " + repr(job))
+        report["datapath"] = job.get("datapath")
+        report["output_path"] = job.get("output_path")
+        oseg_params = dict(params)
+        oseg_params.update(job.get("config", {}))
+        oseg_params["datapath"] = op.expanduser(job["datapath"])
+        oseg = organ_segmentation.OrganSegmentation(**oseg_params)
+        t1 = time.time()
+        report["load_time_s"] = t1 - t0
+        output_path = job.get("output_path")
+        if output_path is not None:
+            output_path = op.expanduser(output_path)
+        oseg.make_run(output_path)
+        report["run_time_s"] = time.time() - t1
+        report["status"] = "ok"
+    except Exception as e:
+        report["error"] = traceback.format_exc()
+        logger.error("job failed: " + str(report["datapath"]) + " " + str(e))
+    report["total_time_s"] = time.time() - t0
+    return report
+
+
+def _init_worker(params):
+    _worker_params.clear()
+    _worker_params.update(params)
+
+
+class BatchSegmentation():
+    """
+    Service keeping imports, config and models warm for many jobs.
+    """
+    def __init__(self, n_jobs=1, params=None, preload=True):
+        """
+        :param n_jobs: number of worker processes, 1 means processing in
+        this process
+        :param params: OrganSegmentation parameters, default and user config
+        is used if None
+        :param preload: load trained models before workers are started
+        """
+        self.n_jobs = n_jobs
+        if params is None:
+            params = default_params()
+        self.params = params
+        if preload:
+            preload_models()
+        self._pool = None
+
+    def _get_pool(self):
+        if self._pool is None and self.n_jobs > 1:
+            self._pool = multiprocessing.Pool(
+                self.n_jobs, initializer=_init_worker,
+                initargs=(self.params,))
+        return self._pool
+
+    def run(self, jobs, callback=None):
+        """
+        Process jobs.
+
+        :param jobs: list of job dicts
+        :param callback: function called with report of every finished job
+        :return: list of reports in the order of jobs
+        """
+        pool = self._get_pool()
+        if pool is None:
+            results = (run_job(job, self.params) for job in jobs)
+        else:
+            results = pool.imap(run_job, jobs)
+        reports = []
+        for report in results:
+            logger.info("%s %s %.1f s" % (
+                report["status"], report["datapath"], report["total_time_s"]))
+            if callback is not None:
+                callback(report)
+            reports.append(report)
+        return reports
+
+    def serve(self, spool_dir, poll_interval=5.0, max_polls=None):
+        """
+        Process job files appearing in spool directory.
+
+        :param max_polls: stop after given number of polls, run forever if
+        None
+        """
+        spool_dir = op.expanduser(spool_dir)
+        n_polls = 0
+        while max_polls is None or n_polls < max_polls:
+            job_files = sorted(glob.glob(op.join(spool_dir, "*.json")))
+            if len(job_files) > 0:
+                jobs = []
+                for fn in job_files:
+                    try:
+                        jobs.append((fn, read_jobs(fn)))
+                    except Exception:
+                        _job_file_failed(fn)
+                flat_jobs = [
+                    job for fn, file_jobs in jobs for job in file_jobs]
+                reports = self.run(flat_jobs)
+                i = 0
+                for fn, file_jobs in jobs:
+                    file_reports = reports[i:i + len(file_jobs)]
+                    i += len(file_jobs)
+                    try:
+                        write_reports(file_reports, fn + ".report")
+                        os.rename(fn, fn + ".done")
+                    except Exception:
+                        _job_file_failed(fn)
+            n_polls += 1
+            if len(job_files) == 0 and \
+                    (max_polls is None or n_polls < max_polls):
+                time.sleep(poll_interval)
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.close()
+            self._pool.join()
+            self._pool = None
+
+
+def _job_file_failed(filename):
+    """
+    Write report with current exception and rename job file to "*.failed".
+    It is called in except block.
+    """
+    error = traceback.format_exc()
+    logger.error("job file failed: " + filename)
+    logger.debug(error)
+    try:
+        write_reports(
+            [{"job_file": filename, "status": "failed", "error": error}],
+            filename + ".report")
+        os.rename(filename, filename + ".failed")
+    except Exception:
+        logger.error("job file cannot be moved: " + filename)
+        logger.debug(traceback.format_exc())
+
+
+def read_jobs(filename):
+    """
+    Read jobs from JSON file with list of jobs, one job or one job per line.
+    """
+    with open(op.expanduser(filename)) as f:
+        text = f.read()
+    try:
+        jobs = json.loads(text)
+    except ValueError:
+        jobs = [json.loads(line) for line in text.splitlines()
+                if len(line.strip()) > 0]
+    if isinstance(jobs, dict):
+        jobs = [jobs]
+    if not isinstance(jobs, list):
+        raise ValueError("Job file should contain job or list of jobs: " +
+                         filename)
+    return jobs
+
+
+def write_reports(reports, filename):
+    """
+    Write one JSON report per line.
+    """
+    with open(op.expanduser(filename), "w") as f:
+        for report in reports:
+            f.write(json.dumps(report) + "\n")
+
+
+def main(argv=None):
+    logger = logging.getLogger()
+
+    logger.setLevel(logging.INFO)
+    ch = logging.StreamHandler()
+    logger.addHandler(ch)
+
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument(
+        'jobs', nargs='?', default=None,
+        help='JSON file with jobs')
+    parser.add_argument(
+        '-j', '--n_jobs', type=int, default=1,
+        help='number of worker processes')
+    parser.add_argument(
+        '-r', '--report', default=None,
+        help='output file with one JSON report per job')
+    parser.add_argument(
+        '-w', '--watch', default=None,
+        help='spool directory with job files, run as service')
+    parser.add_argument(
+        '--poll_interval', type=float, default=5.0,
+        help='seconds between checks of spool directory')
+    parser.add_argument(
+        '-d', '--debug', action='store_true',
+        help='Debug mode')
+    args = parser.parse_args(argv)
+
+    if args.debug:
+        logger.setLevel(logging.DEBUG)
+
+    service = BatchSegmentation(n_jobs=args.n_jobs)
+    try:
+        if args.watch is not None:
+            service.serve(args.watch, poll_interval=args.poll_interval)
+        elif args.jobs is not None:
+            reports = service.run(read_jobs(args.jobs))
+            if args.report is not None:
+                write_reports(reports, args.report)
+            n_ok = len([r for r in reports if r["status"] == "ok"])
+            print("%i of %i jobs finished" % (n_ok, len(reports)))
+        else:
+            parser.print_help()
+    finally:
+        service.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -23,11 +23,20 @@ logger = logging.getLogger(__name__)
 import numpy as np
 import scipy
 import scipy.ndimage
-from imtools import misc, qmisc
+import io3d
+import io3d.misc
 
 
 # ----------------- my scripts --------
 class BodyNavigation:
+    """
+    Anatomical features based on body, spine, lungs and diaphragm.
+
+    Intermediate results (gaussian filtrations, masks, distance maps) are
+    computed lazily at working resolution and they are memoized. Distance
+    maps are stored as float32 and they are resized to original shape only
+    when it is requested (default).
+    """
 
     def __init__(self, data3d, voxelsize_mm):
         self.voxelsize_mm = np.asarray(voxelsize_mm)
@@ -42,27 +51,56 @@ class BodyNavigation:
         self.orig_shape = data3d.shape
         self.diaphragm_mask = None
         self.angle = None
+        self._gaussians = {}
+        self._distances = {}
 
+    def _gaussian(self, sigma):
+        """
+        Memoized gaussian filtration of working data. Output has the dtype of
+        working data as scipy.ndimage.filters.gaussian_filter() output.
+        """
+        sigma = tuple(np.asarray(sigma, dtype=np.double) * np.ones(3))
+        if sigma not in self._gaussians:
+            self._gaussians[sigma] = scipy.ndimage.filters.gaussian_filter(
+                self.data3dr, sigma=sigma)
+        return self._gaussians[sigma]
+
+    def _resize(self, data, resize=True):
+        if resize:
+            return io3d.misc.resize_to_shape(data, self.orig_shape)
+        return data
+
+    def _distance(self, name, function):
+        """
+        Memoized distance map in working resolution stored as float32.
+        """
+        if name not in self._distances:
+            self._distances[name] = function().astype(np.float32)
+        return self._distances[name]
 
-    def get_spine(self):
+    def get_spine(self, resize=True):
+        if self.spine is None:
+            spine = self._gaussian([20, 5, 5]) > 200
+            self.spine = spine
 
-        spine = scipy.ndimage.filters.gaussian_filter(self.data3dr, sigma=[20, 5, 5]) > 200
-        self.spine = spine
+            self.spine_center = np.mean(np.nonzero(self.spine), 1)
+            # self.center2 = np.mean(np.nonzero(self.spine), 2)
+        return self._resize(self.spine, resize)
 
-        self.spine_center = np.mean(np.nonzero(self.spine), 1)
-        # self.center2 = np.mean(np.nonzero(self.spine), 2)
-        return io3d.misc.resize_to_shape(spine, self.orig_shape)
+    def get_body(self, resize=True):
+        if self.body is None:
+            body = self._gaussian(2) > -150
+            body[0, :, :] = 1
+            body[-1, :, :] = 1
 
-    def get_body(self):
-        body = scipy.ndimage.filters.gaussian_filter(self.data3dr, sigma=2) > -150
-        body[0, :, :] = 1
-        body[-1, :, :] = 1
+            self.body = scipy.ndimage.morphology.binary_fill_holes(body)
+        return self._resize(self.body, resize)
 
-        self.body = scipy.ndimage.morphology.binary_fill_holes(body)
-        return io3d.misc.resize_to_shape(self.body, self.orig_shape)
+    def get_lungs(self, resize=True):
+        if self.lungs is not None:
+            return self._resize(self.lungs, resize)
 
-    def get_lungs(self):
-        lungs = scipy.ndimage.filters.gaussian_filter(self.data3dr, sigma=[4, 2, 2]) > -150
+        lungs = self._gaussian([4, 2, 2]) > -150
         lungs[0, :, :] = 1
 
         lungs = scipy.ndimage.morphology.binary_fill_holes(lungs)
@@ -79,41 +117,39 @@ class BodyNavigation:
             ]
 
         lb = np.median(cornerlab)
-        labs[labs==lb] = 0
-
-        labs[labs==labs[0,0,0]] = 0
-        labs[labs==labs[0,0,-1]] = 0
-        labs[labs==labs[0,-1,0]] = 0
-        labs[labs==labs[0,-1,-1]] = 0
-        labs[labs==labs[-1,0,0]] = 0
-        labs[labs==labs[-1,0,-1]] = 0
-        labs[labs==labs[-1,-1,0]] = 0
-        labs[labs==labs[-1,-1,-1]] = 0
-
-        lungs = labs > 0
+        # remove median corner label and all corner labels in one pass
+        background_labels = np.unique(cornerlab + [lb])
+        background_labels = background_labels[background_labels == np.round(background_labels)]
+        lut = np.ones(n + 1, dtype=bool)
+        lut[0] = False
+        lut[background_labels.astype(int)] = False
+
+        lungs = lut[labs]
         self.lungs = lungs
         #self.body = (labs == 80)
-        return misc.resize_to_shape(lungs, self.orig_shape)
-
-    def dist_to_surface(self):
-        if self.body is None:
-            self.get_body()
-        ld = scipy.ndimage.morphology.distance_transform_edt(self.body)
-
-        return misc.resize_to_shape(ld, self.orig_shape)
-
-    def dist_to_lungs(self):
-        if self.lungs is None:
-            self.get_lungs()
-
-        ld = scipy.ndimage.morphology.distance_transform_edt(1 - self.lungs)
-        return misc.resize_to_shape(ld, self.orig_shape)
-
-    def dist_to_spine(self):
-        if self.spine is None:
-            self.get_spine()
-        ld = scipy.ndimage.morphology.distance_transform_edt(1 - self.spine)
-        return misc.resize_to_shape(ld, self.orig_shape)
+        return self._resize(lungs, resize)
+
+    def dist_to_surface(self, resize=True):
+        ld = self._distance(
+            'surface',
+            lambda: scipy.ndimage.morphology.distance_transform_edt(
+                self.get_body(resize=False)))
+
+        return self._resize(ld, resize)
+
+    def dist_to_lungs(self, resize=True):
+        ld = self._distance(
+            'lungs',
+            lambda: scipy.ndimage.morphology.distance_transform_edt(
+                ~self.get_lungs(resize=False)))
+        return self._resize(ld, resize)
+
+    def dist_to_spine(self, resize=True):
+        ld = self._distance(
+            'spine',
+            lambda: scipy.ndimage.morphology.distance_transform_edt(
+                ~self.get_spine(resize=False)))
+        return self._resize(ld, resize)
 
     def find_symmetry(self, degrad=5, return_img=False):
         img = np.sum(self.data3dr > 430, axis=0)
@@ -125,28 +161,30 @@ class BodyNavigation:
 
 
     def dist_sagittal(self, degrad=5):
+        """
+        Signed distance from sagittal plane. Output is read-only view of one
+        2D slice broadcasted to the original shape.
+        """
         if self.angle is None:
             self.find_symmetry()
-        rldst = np.ones(self.orig_shape, dtype=np.int16)
         symmetry_point_orig_res = self.symmetry_point * self.working_vs[1:] / self.voxelsize_mm[1:].astype(np.double)
 
         z = split_with_line(symmetry_point_orig_res, self.angle , self.orig_shape[1:])
         # print 'z  ', np.max(z), np.min(z)
 
-        for i in range(self.orig_shape[0]):
-            rldst[i ,: ,:] = z
-
         # rldst = scipy.ndimage.morphology.distance_transform_edt(rldst) - int(spine_mean[2])
         # return misc.resize_to_shape(rldst, self.orig_shape)
-        return rldst
+        return np.broadcast_to(z.astype(np.int16), self.orig_shape)
 
     def dist_coronal(self):
-        if self.spine is None:
-            self.get_spine()
+        """
+        Signed distance from coronal plane. Output is read-only view of one
+        2D slice broadcasted to the original shape.
+        """
+        self.get_spine(resize=False)
         if self.angle is None:
             self.find_symmetry()
         spine_mean = np.mean(np.nonzero(self.spine), 1)
-        rldst = np.ones(self.orig_shape, dtype=np.int16)
         # rldst = np.ones(self.data3dr.shape, dtype=np.int16)
         # rldst[:, 0, :] = 0
 
@@ -155,34 +193,66 @@ class BodyNavigation:
         # rldst = scipy.ndimage.morphology.distance_transform_edt(rldst) - int(spine_mean[1])
 
         z = split_with_line(spine_center[1:], self.angle + 90 , self.orig_shape[1:])
-        for i in range(self.orig_shape[0]):
-            rldst[i ,: ,:] = z
 
-        return rldst
+        return np.broadcast_to(z.astype(np.int16), self.orig_shape)
 
-    def dist_axial(self):
+    def dist_axial(self, resize=True):
+        """
+        Distance from axial plane given by diaphragm level. Only one profile
+        along the first axis is computed. Output is read-only view broadcasted
+        to the output shape.
+        """
         if self.diaphragm_mask is None:
-            self.get_diaphragm_mask()
-        axdst = np.ones(self.data3dr.shape, dtype=np.int16)
-        axdst[0 ,: ,:] = 0
-        iz, ix, iy = np.nonzero(self.diaphragm_mask)
-        # print 'dia level ', self.diaphragm_mask_level
-
-        axdst = scipy.ndimage.morphology.distance_transform_edt(axdst) - int(self.diaphragm_mask_level)
-        return misc.resize_to_shape(axdst, self.orig_shape)
-
-
+            self.get_diaphragm_mask(resize=False)
+        # distance from first slice minus diaphragm level
+        axdst = (
+            np.arange(self.data3dr.shape[0], dtype=np.float32) -
+            int(self.diaphragm_mask_level)
+        ).reshape(-1, 1, 1)
+        if resize:
+            axdst = io3d.misc.resize_to_shape(axdst, [self.orig_shape[0], 1, 1])
+            shape = self.orig_shape
+        else:
+            shape = self.data3dr.shape
+        return np.broadcast_to(axdst, shape)
 
-    def dist_diaphragm(self):
+    def dist_diaphragm(self, resize=True):
         if self.diaphragm_mask is None:
-            self.get_diaphragm_mask()
-        dst = (scipy.ndimage.morphology.distance_transform_edt(
-                self.diaphragm_mask)
-               -
-               scipy.ndimage.morphology.distance_transform_edt(
-                1 - self.diaphragm_mask)
-              )
-        return io3d.misc.resize_to_shape(dst, self.orig_shape)
+            self.get_diaphragm_mask(resize=False)
+        dst = self._distance(
+            'diaphragm',
+            lambda: (
+                scipy.ndimage.morphology.distance_transform_edt(
+                    self.diaphragm_mask)
+                -
+                scipy.ndimage.morphology.distance_transform_edt(
+                    ~self.diaphragm_mask)
+            ))
+        return self._resize(dst, resize)
+
+    def get_features(self, names=None, dtype=np.float32):
+        """
+        Feature matrix with one row per voxel of original data. Each column
+        is resized and written separately, so only one full size feature is
+        allocated at time.
+
+        :param names: list of method names, default are all dist_* features
+        :return: array with shape [n_voxels, len(names)]
+        """
+        if names is None:
+            names = [
+                'dist_to_lungs',
+                'dist_to_spine',
+                'dist_sagittal',
+                'dist_coronal',
+                'dist_axial',
+                'dist_to_surface',
+                'dist_diaphragm',
+            ]
+        fv = np.empty([int(np.prod(self.orig_shape)), len(names)], dtype=dtype)
+        for i, name in enumerate(names):
+            fv[:, i] = getattr(self, name)().reshape(-1)
+        return fv
 
     def _get_ia_ib_ic(self, axis):
         """
@@ -217,10 +287,8 @@ class BodyNavigation:
         return profile
 
     def get_diaphragm_profile_image_with_empty_areas(self, axis=0):
-        if self.lungs is None:
-            self.get_lungs()
-        if self.spine is None:
-            self.get_spine()
+        self.get_lungs(resize=False)
+        self.get_spine(resize=False)
         if self.angle is None:
             self.find_symmetry()
         axis = 0
@@ -424,34 +492,30 @@ class BodyNavigation:
         return profile_w
         # plt.imshow(profile_w, cmap='jet')
 
-    def get_diaphragm_mask(self, axis=0):
-        if self.lungs is None:
-            self.get_lungs()
+    def get_diaphragm_mask(self, axis=0, resize=True):
+        self.get_lungs(resize=False)
         ia, ib, ic = self._get_ia_ib_ic(axis)
         data = self.lungs
         ou = self.get_diaphragm_profile_image(axis=axis)
         # reconstruction mask array
-        mask = np.zeros(data.shape)
-        for i in range(mask.shape[ia]):
-            if ia == 0:
-                mask[i,:,:] = ou > i
-            elif ia == 1:
-                mask[:,i,:] = ou > i
-            elif ia == 2:
-                mask[:,:,i] = ou > i
+        index_shape = [1, 1, 1]
+        index_shape[ia] = -1
+        index = np.arange(data.shape[ia]).reshape(index_shape)
+        mask = np.expand_dims(ou, ia) > index
 
         self.diaphragm_mask = mask
+        self._distances.pop('diaphragm', None)
 
         # maximal point is used for axial ze
         # ro plane
         self.diaphragm_mask_level = np.median(ou)
         self.center0 = self.diaphragm_mask_level * self.working_vs[0]
 
-        return misc.resize_to_shape(self.diaphragm_mask, self.orig_shape)
+        return self._resize(self.diaphragm_mask, resize)
 
     def get_center(self):
-        self.get_diaphragm_mask()
-        self.get_spine()
+        self.get_diaphragm_mask(resize=False)
+        self.get_spine(resize=False)
 
         self.center = np.array([self.diaphragm_mask_level, self.spine_center[0], self.spine_center[1]])
         self.center_mm = self.center * self.working_vs
@@ -512,27 +576,99 @@ def find_symmetry_parameters(imin0, trax, tray, angles):
     return trax[am[0]], tray[am[1]], angles[am[2]]
 
 def find_symmetry(img, degrad=5):
-    imin0r = scipy.misc.imresize(img, np.asarray(img.shape)/degrad)
+    """
+    Find axis of symmetry in 2D image.
 
-    angles = range(-180,180,15)
-    trax = range(1, imin0r.shape[0],10)
-    tray = range(1, imin0r.shape[1],10)
+    Line orientations are tested coarse to fine. For every orientation the
+    image is reflected once and all positions of symmetry line are evaluated
+    together by FFT cross-correlation of the image with its reflection.
 
+    :param img: 2D image
+    :param degrad: image is downscaled by this factor before the search
+    :return: tr0, tr1, angle - point on symmetry line and its orientation in
+        degrees. Output can be used in split_with_line().
+    """
+    img = np.asarray(img, dtype=np.double)
+    if degrad > 1:
+        imin0r = scipy.ndimage.zoom(img, 1.0 / degrad, order=1)
+    else:
+        imin0r = img
 
+    pivot, angle = find_symmetry_fft(imin0r)
 
-    tr0, tr1, ang = find_symmetry_parameters(imin0r, trax, tray, angles)
+    return pivot[0] * degrad, pivot[1] * degrad, angle
 
 
-    # fine measurement
-    angles = range(ang-20,ang+20, 3)
-    trax = range(np.max([tr0-20, 1]), tr0+20, 3)
-    tray = range(np.max([tr1-20, 1]), tr1+20, 3)
+def find_symmetry_fft(img, angle_steps=(7.5, 1.5, 0.5)):
+    """
+    Find the line of mirror symmetry of 2D image.
+
+    :param img: 2D image
+    :param angle_steps: angle steps in degrees. First step is used on the
+        whole range of orientations, next steps are used around the best
+        angle found in the previous step.
+    :return: pivot, angle - point on symmetry line nearest to the image center
+        and orientation of line in degrees (see split_with_line())
+    """
+    img = np.asarray(img, dtype=np.double)
+    fft_shape = [2 * sh for sh in img.shape]
+    img_fft = np.conj(np.fft.rfftn(img, fft_shape))
+
+    best = None
+    angles = np.arange(0, 180, angle_steps[0])
+    for i in range(len(angle_steps)):
+        for angle in angles:
+            val, delta = _symmetry_correlation(img, img_fft, fft_shape, angle)
+            if best is None or val > best[0]:
+                best = (val, delta, angle)
+        if i + 1 < len(angle_steps):
+            step = angle_steps[i + 1]
+            angles = best[2] + np.arange(
+                -angle_steps[i], angle_steps[i] + step, step)
+
+    val, delta, angle = best
+    center = (np.asarray(img.shape) - 1) / 2.0
+    pivot = center + delta * _line_normal(angle)
+    return pivot, angle % 180
+
+
+def _line_normal(angle):
+    """
+    Normal vector of line with orientation given in degrees.
+    Line direction is [sin(angle), cos(angle)] like in split_with_line().
+    """
+    angle = np.radians(angle)
+    return np.array([np.cos(angle), -np.sin(angle)])
 
-    tr0, tr1, ang = find_symmetry_parameters(imin0r, trax, tray, angles)
 
-    angle = 90-ang/2.0
+def _symmetry_correlation(img, img_fft, fft_shape, angle):
+    """
+    Correlation of image with its reflection over line with given orientation
+    for the best position of line.
 
-    return tr0*degrad, tr1*degrad, angle
+    :return: maximal correlation and signed distance of line from image center
+    """
+    normal = _line_normal(angle)
+    center = (np.asarray(img.shape) - 1) / 2.0
+    # reflection over line trough the image center
+    reflection = np.eye(2) - 2 * np.outer(normal, normal)
+    reflected = scipy.ndimage.affine_transform(
+        img, reflection, offset=center - reflection.dot(center), order=1)
+
+    # corr[s] = sum(img[u] * reflected[u + s]) for all shifts s
+    corr = np.fft.irfftn(img_fft * np.fft.rfftn(reflected, fft_shape), fft_shape)
+    corr = np.fft.fftshift(corr)
+
+    # line shifted by delta along normal corresponds to shift -2 * delta
+    max_delta = np.linalg.norm(img.shape) / 2.0
+    deltas = np.arange(-max_delta, max_delta, 0.5)
+    coords = (
+        np.asarray(fft_shape).reshape(2, 1) // 2
+        - 2 * normal.reshape(2, 1) * deltas.reshape(1, -1)
+    )
+    vals = scipy.ndimage.map_coordinates(corr, coords, order=1, cval=0)
+    ind = np.argmax(vals)
+    return vals[ind], deltas[ind]
 
 
 # Rozděl obraz na půl
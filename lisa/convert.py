@@ -18,9 +18,9 @@ import argparse
 import vtk
 
 import numpy as np
-from dicom2fem import seg2fem
 # import misc
 import viewer
+import seg2mesh
 import io3d
 import dicom2fem
 from imtools.image_manipulation import select_labels
@@ -53,13 +53,16 @@ def seg2stl(
 
     # import pdb; pdb.set_trace()
     if smoothing:
-        mesh_data = seg2fem.gen_mesh_from_voxels(segmentation, voxelsize_mm*degrad*1e-3, etype='t', mtype='s')
-        mesh_data.coors = dicom2fem.seg2fem.smooth_mesh(mesh_data)
+        # surface mesh is generated by chunks and written directly to stl
+        coors, elems, etype = seg2mesh.gen_mesh_from_voxels(
+            segmentation, voxelsize_mm * degrad * 1e-3, etype='t', mtype='s')
+        coors = seg2mesh.smooth_mesh(coors, elems, etype)
+        seg2mesh.write_stl(coors, elems, outputfile)
     else:
         mesh_data = dicom2fem.seg2fem.gen_mesh_from_voxels_mc(segmentation, voxelsize_mm * degrad * 1.0e-2)
         # mesh_data.coors +=
-    mesh_data.write(tempfile)
-    dicom2fem.vtk2stl.vtk2stl(tempfile, outputfile)
+        mesh_data.write(tempfile)
+        dicom2fem.vtk2stl.vtk2stl(tempfile, outputfile)
     # QApplication(sys.argv)
     # view = viewer.QVTKViewer(vtk_file)
     # view.exec_()
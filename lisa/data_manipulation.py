@@ -46,33 +46,31 @@ def unbiased_brick_filter(binary_data, crinfo):
     :param crinfo: crinfo 
     http://www.stereology.info/the-optical-disector-and-the-unbiased-brick/
     """
-    binary_data = binary_data.copy()
     crinfo = qmisc.fix_crinfo(crinfo)
 
     imlab, num_features = scipy.ndimage.measurements.label(binary_data)
 
-    brick_neg_mask = np.zeros(binary_data.shape, dtype=np.uint8)
-    brick_neg_mask[
-            crinfo[0][0]:crinfo[0][1],
-            crinfo[1][0]:crinfo[1][1],
-            crinfo[2][0]:crinfo[2][1]
-        ] = 1
-
-    exclude_mask = np.zeros(binary_data.shape, dtype=np.uint8)
-    exclude_mask[:,:, crinfo[2][1]:] = 1
-    exclude_mask[:,crinfo[1][1]:, crinfo[2][0]:] = 1
-    exclude_mask[:crinfo[0][0],crinfo[1][0]:, crinfo[2][0]:] = 1
-
-    # remove what is not in touch with brick
-    imlab = keep_what_is_in_touch_with_mask(
-            imlab, brick_neg_mask, max_label=num_features)
+    brick = (
+        slice(crinfo[0][0], crinfo[0][1]),
+        slice(crinfo[1][0], crinfo[1][1]),
+        slice(crinfo[2][0], crinfo[2][1]),
+    )
+    exclude = [
+        (slice(None), slice(None), slice(crinfo[2][1], None)),
+        (slice(None), slice(crinfo[1][1], None), slice(crinfo[2][0], None)),
+        (slice(None, crinfo[0][0]), slice(crinfo[1][0], None),
+         slice(crinfo[2][0], None)),
+    ]
+
+    # keep what is in touch with brick
+    lut = labels_in_touch_with_mask(imlab[brick], nlabels=num_features)
     # remove what is in touch with exclude
-    imlab = remove_what_is_in_touch_with_mask(imlab, exclude_mask)
-
-
-
+    for sl in exclude:
+        lut[labels_in_touch_with_mask(imlab[sl], nlabels=num_features)] = \
+            False
+    lut[0] = False
 
-    return (imlab > 0).astype(binary_data.dtype)
+    return lut[imlab].astype(binary_data.dtype)
     
 
 
@@ -82,20 +80,142 @@ def unbiased_brick_filter(binary_data, crinfo):
     #     __int_or_none(crinfo[2][0]):__int_or_none(crinfo[2][1])
     #     ]
 
-def keep_what_is_in_touch_with_mask(imlab, keep_mask, max_label):
-    datatmp = imlab * keep_mask
-    nz = np.nonzero(datatmp)
-    labels_to_keep = imlab[nz[0], nz[1], nz[2]]
-    labels_to_keep = np.unique(labels_to_keep)
 
-    for lab in range(0, max_label):
-        if lab in labels_to_keep:
-            pass
-        else:
-            imlab[imlab == lab] = 0
+def labels_in_touch_with_mask(imlab, mask=None, nlabels=None):
+    """
+    Find labels which are in touch with mask.
+
+    :param imlab: labeled image
+    :param mask: binary mask with same shape as imlab. If it is None, all
+    labels in imlab are used.
+    :param nlabels: maximal label, it is computed from imlab if None
+    :return: boolean array with length nlabels + 1. Value is True for labels
+    in touch with mask.
+    """
+    if nlabels is None:
+        nlabels = imlab.max() if imlab.size > 0 else 0
+    if mask is None:
+        labels = imlab.ravel()
+    else:
+        labels = imlab[mask > 0]
+    counts = np.bincount(labels, minlength=nlabels + 1)
+    return counts[:nlabels + 1] > 0
+
 
+def apply_label_lut(imlab, lut):
+    """
+    Relabel image in place with lookup table. New label of voxel with label
+    i is lut[i].
+
+    :param imlab: labeled image, it is changed
+    :param lut: lookup table with length imlab.max() + 1
+    :return: imlab
+    """
+    lut = np.asarray(lut).astype(imlab.dtype)
+    np.take(lut, imlab, out=imlab, mode='clip')
     return imlab
 
+
+def write_labels(segmentation, label_image, lut):
+    """
+    Write new labels into segmentation in one pass. Voxels with value i in
+    label_image get label lut[i]. Negative value in lut means no change.
+    Only bounding box of nonzero label_image is processed.
+
+    :param segmentation: labeled image, it is changed
+    :param label_image: nonnegative integer image with same shape as
+    segmentation
+    :param lut: lookup table with length label_image.max() + 1
+    :return: segmentation
+    """
+    if label_image.dtype.kind == "i" and label_image.min() < 0:
+        # negative index would wrap to the end of lut
+        raise ValueError("Negative values in label_image are not supported")
+    lut = np.asarray(lut)
+    if np.all(lut[1:] < 0) and lut[0] < 0:
+        return segmentation
+    if lut[0] >= 0:
+        # background is changed too
+        sl = tuple([slice(None)] * segmentation.ndim)
+    else:
+        sl = bbox_slices(label_image > 0)
+    seg = segmentation[sl]
+    new_labels = lut[label_image[sl]]
+    change = new_labels >= 0
+    seg[change] = new_labels[change]
+    return segmentation
+
+
+def keep_what_is_in_touch_with_mask(imlab, keep_mask, max_label=None):
+    """
+    Set to zero all labels which are not in touch with keep_mask. Image is
+    changed in place.
+
+    :param max_label: maximal label in imlab, it is computed if None
+    """
+    if max_label is None or max_label < imlab.max():
+        max_label = imlab.max()
+    keep = labels_in_touch_with_mask(imlab, keep_mask, nlabels=max_label)
+    lut = np.where(keep, np.arange(len(keep)), 0)
+    return apply_label_lut(imlab, lut)
+
+def resize_indexes(shape, new_shape):
+    """
+    Indexes for nearest neighbor resize of data with shape to new_shape.
+    Same indexes can be used for more arrays with the same shape.
+
+    data[np.ix_(*resize_indexes(data.shape, new_shape))]
+
+    :return: list with index array for every axis
+    """
+    indexes = []
+    for size, new_size in zip(shape, new_shape):
+        idx = np.floor(
+            (np.arange(new_size) + 0.5) * size / float(new_size)
+        ).astype(int)
+        indexes.append(np.clip(idx, 0, size - 1))
+    return indexes
+
+
+def resize_linear(data, new_shape):
+    """
+    Linear interpolation of data to new_shape. Voxel centers are aligned in
+    the same way as in resize_indexes() so both functions can be used
+    together for data and its labels.
+    """
+    import scipy.ndimage
+    scale = np.asarray(data.shape, dtype=float) / np.asarray(new_shape)
+    return scipy.ndimage.affine_transform(
+        data,
+        scale,
+        offset=0.5 * scale - 0.5,
+        output_shape=tuple(new_shape),
+        order=1,
+        mode='nearest',
+    )
+
+
+def bbox_slices(mask, margin=0):
+    """
+    Slices of bounding box of nonzero voxels enlarged by margin. Full
+    volume is used if mask is empty.
+
+    :param margin: margin in voxels, one number or one per axis
+    :return: tuple of slices
+    """
+    margin = np.broadcast_to(np.asarray(margin, dtype=int), [mask.ndim])
+    slices = []
+    for axis in range(mask.ndim):
+        other_axes = tuple(i for i in range(mask.ndim) if i != axis)
+        nz = np.nonzero(np.any(mask, axis=other_axes))[0]
+        if len(nz) == 0:
+            return tuple([slice(None)] * mask.ndim)
+        start = max(nz[0] - margin[axis], 0)
+        stop = min(nz[-1] + margin[axis] + 1, mask.shape[axis])
+        slices.append(slice(start, stop))
+    return tuple(slices)
+
+
 # Rozděl obraz na půl
 def split_with_plane(point, orientation, imshape):
     """
@@ -125,17 +245,13 @@ def split_with_plane(point, orientation, imshape):
     return z
 
 def remove_what_is_in_touch_with_mask(imlab, exclude_mask):
-    datatmp = imlab * exclude_mask
-    nz = np.nonzero(datatmp)
-    labels_to_exclude = imlab[nz[0], nz[1], nz[2]]
-    labels_to_exclude = np.unique(labels_to_exclude)
-
-
-    for lab in labels_to_exclude:
-        imlab[imlab == lab] = 0
-
-    return imlab
-
+    """
+    Set to zero all labels which are in touch with exclude_mask. Image is
+    changed in place.
+    """
+    exclude = labels_in_touch_with_mask(imlab, exclude_mask)
+    lut = np.where(exclude, 0, np.arange(len(exclude)))
+    return apply_label_lut(imlab, lut)
 
 
 def add_seeds_mm(data_seeds, voxelsize_mm, z_mm, x_mm, y_mm, label, radius, width=1):
@@ -160,48 +276,99 @@ def add_seeds_mm(data_seeds, voxelsize_mm, z_mm, x_mm, y_mm, label, radius, widt
     #     x_mm = [y_mm]
     # if type(z_mm) is not list:
     #     z_mm = [z_mm]
-    z_mm = np.asarray(z_mm)
-    # z_mm = z_mm.squeeze()
-    for z_mm_j in z_mm:
-        z_mm_j = np.asarray([z_mm_j])
+    voxelsize_mm = np.asarray(voxelsize_mm, dtype=float).reshape(-1)
+    z_mm = np.asarray(z_mm, dtype=float).reshape(-1)
+    x_mm = np.asarray(x_mm, dtype=float).reshape(-1)
+    y_mm = np.asarray(y_mm, dtype=float).reshape(-1)
     # repeat circle every milimiter
-        for i in range(0, width + 1):
-            data_seeds = _add_seeds_mm_in_one_slice(data_seeds, voxelsize_mm, z_mm_j + i, x_mm, y_mm, label, radius)
-    return data_seeds
+    z_mm = (z_mm[:, np.newaxis] + np.arange(0, width + 1)).reshape(-1)
+
+    # every circle in every slice
+    slicen = (z_mm / voxelsize_mm[0]).astype(int)
+    centers_px = np.zeros([len(slicen), len(x_mm), 3])
+    centers_px[:, :, 0] = slicen[:, np.newaxis]
+    centers_px[:, :, 1] = x_mm / voxelsize_mm[1]
+    centers_px[:, :, 2] = y_mm / voxelsize_mm[2]
+    centers_px = centers_px.reshape(-1, 3)
+
+    # radius is used in voxels
+    return stamp_seeds(data_seeds, centers_px, radius, label,
+                       scale=[1, 1, 1], sphere=False)
+
+
+def stamp_seeds_mm(data_seeds, voxelsize_mm, z_mm, x_mm, y_mm, radius_mm,
+                   label, sphere=False):
+    """
+    Put discs or spheres into seeds. All parameters may be arrays with one
+    value per seed.
+
+    :param z_mm, x_mm, y_mm: centers of seeds in mm
+    :param radius_mm: radius in mm
+    :param label: label of seed. If seeds overlap, the last one is used.
+    :param sphere: 3D spheres are used if True, otherwise discs in slice
+        with center are used.
+    """
+    voxelsize_mm = np.asarray(voxelsize_mm, dtype=float).reshape(-1)
+    z_mm, x_mm, y_mm = np.broadcast_arrays(
+        np.asarray(z_mm, dtype=float).reshape(-1),
+        np.asarray(x_mm, dtype=float).reshape(-1),
+        np.asarray(y_mm, dtype=float).reshape(-1),
+    )
+    centers_px = np.array([z_mm, x_mm, y_mm]).T / voxelsize_mm
+    if not sphere:
+        centers_px[:, 0] = np.floor(centers_px[:, 0])
+    return stamp_seeds(data_seeds, centers_px, radius_mm, label,
+                       scale=voxelsize_mm, sphere=sphere)
 
-def _add_seeds_mm_in_one_slice(data_seeds, voxelsize_mm, z_mm, x_mm, y_mm, label, radius):
-    x_mm = np.asarray(x_mm)
-    y_mm = np.asarray(y_mm)
-    z_mm = np.asarray(z_mm)
-    if len(z_mm) > 1:
-        logger.error("Expected single value for z-axis")
-
-    for i in range(0, len(x_mm)):
-
-        # xx and yy are 200x200 tables containing the x and y coordinates
-        # values. mgrid is a mesh creation helper
-        xx, yy = np.mgrid[
-                 :data_seeds.shape[1],
-                 :data_seeds.shape[2]
-                 ]
-        # circles contains the squared distance to the (100, 100) point
-        # we are just using the circle equation learnt at school
-        circle = (
-                     (xx - x_mm[i] / voxelsize_mm[1]) ** 2 +
-                     (yy - y_mm[i] / voxelsize_mm[2]) ** 2
-                 ) ** (0.5)
-        # donuts contains 1's and 0's organized in a donut shape
-        # you apply 2 thresholds on circle to define the shape
-        # slice jen s jednim kruhem
-        slicecircle = circle < radius
-        slicen = int(z_mm / voxelsize_mm[0])
-        # slice s tim co už je v něm nastaveno
-        slicetmp = data_seeds[slicen, :, :]
-        # mport pdb; pdb.set_trace()
-
-        slicetmp[slicecircle == 1] = label
-
-        data_seeds[slicen, :, :] = slicetmp
+
+def stamp_seeds(data_seeds, centers_px, radius, label, scale=[1, 1, 1],
+                sphere=False, max_chunk_size=2**22):
+    """
+    Put discs or spheres into seeds. Only bounding boxes of seeds are
+    processed. All seeds are rasterized together.
+
+    :param centers_px: array (n, 3) with centers of seeds in voxels. For
+        discs the first coordinate is slice index.
+    :param radius: radius, one number or array with one value per seed.
+        It has units given by scale.
+    :param label: label, one number or one value per seed. If seeds
+        overlap, the last one is used.
+    :param scale: size of voxel in units of radius
+    :param sphere: 3D spheres are used if True, otherwise discs
+    :param max_chunk_size: maximal number of processed voxels at once
+    """
+    centers_px = np.asarray(centers_px, dtype=float).reshape(-1, 3)
+    n = centers_px.shape[0]
+    if n == 0:
+        return data_seeds
+    scale = np.asarray(scale, dtype=float).reshape(-1)
+    radius = np.broadcast_to(np.asarray(radius, dtype=float), [n])
+    label = np.broadcast_to(np.asarray(label), [n])
+
+    # half size of bounding box in voxels
+    half = radius[:, np.newaxis] / scale
+    if not sphere:
+        half[:, 0] = 0
+    start = np.floor(centers_px - half).astype(int)
+    box_shape = np.ceil(2 * np.max(half, axis=0)).astype(int) + 2
+    if not sphere:
+        box_shape[0] = 1
+    offsets = np.indices(box_shape).reshape(3, -1).T
+    shape = np.asarray(data_seeds.shape)
+
+    chunk = max(1, max_chunk_size // len(offsets))
+    for i in range(0, n, chunk):
+        sl = slice(i, i + chunk)
+        # voxel coordinates, shape (seeds, box_voxels, 3)
+        points = start[sl, np.newaxis, :] + offsets[np.newaxis, :, :]
+        diff = (points - centers_px[sl, np.newaxis, :]) * scale
+        if not sphere:
+            diff[:, :, 0] = 0
+        inside = np.sum(diff ** 2, axis=2) < radius[sl, np.newaxis] ** 2
+        inside &= np.all((points >= 0) & (points < shape), axis=2)
+        labels = np.broadcast_to(label[sl, np.newaxis], inside.shape)
+        points = points[inside]
+        data_seeds[points[:, 0], points[:, 1], points[:, 2]] = labels[inside]
     return data_seeds
 
 
@@ -161,11 +161,14 @@ class RunAndMakeReport:
             output_paths=self.pklz_dirs,
             dry_run=False)
 
-    def evaluation(self, special_evaluation_function=None):
+    def evaluation(self, special_evaluation_function=None, n_jobs=1,
+                   cache_dir=None):
         """
         :param special_evaluation_function: is pointer to function with
         fallowing signature:
             eval_dict = special_evaluation_function(volume1, volume2)
+        :param n_jobs: number of evaluation processes
+        :param cache_dir: per-case evaluation cache directory
         """
         sliver_eval_all_to_yamls(
             self.yaml_files,
@@ -173,7 +176,9 @@ class RunAndMakeReport:
             self.sliver_dir,
             self.eval_files,
             recalculateThis=None,
-            special_evaluation_function=special_evaluation_function
+            special_evaluation_function=special_evaluation_function,
+            n_jobs=n_jobs,
+            cache_dir=cache_dir
         )
 
     def report(self):
@@ -539,7 +544,8 @@ def recalculate_suggestion(eval_files):
 
 def sliver_eval_all_to_yamls(yaml_files, pklz_dirs, sliver_dir, eval_files,
                              recalculateThis=None,
-                             special_evaluation_function=None):
+                             special_evaluation_function=None,
+                             n_jobs=1, cache_dir=None):
     """
     This is time consuming.
     It can be specified which should be evaluated with recalculateThis=[2,5]
@@ -547,27 +553,44 @@ def sliver_eval_all_to_yamls(yaml_files, pklz_dirs, sliver_dir, eval_files,
     :param yaml_files: is list of paths to output yaml files which will be created in this function
     :param special_evaluation_function: evaluation function like fallowing:
         eval_dict = special_evaluation_function(volume1, volume2, voxelsize_mm)
+    :param n_jobs: number of processes. All (experiment dir, case) couples
+        are evaluated in one process pool.
+    :param cache_dir: directory for per-case evaluation cache. Only new or
+        changed cases are evaluated on rerun.
     """
     if recalculateThis is None:
         recalculateThis = recalculate_suggestion(eval_files)
     logger.debug('eval files ' + str(eval_files))
 
+    records = []
+    experiment_indexes = []
     for i in recalculateThis:
-        logger.info("Performing evaluation on: " + str(pklz_dirs[i]))
-        a, data = volumetry_evaluation.evaluate_and_write_to_file(
-            yaml_files[i],
-            pklz_dirs[i],
+        logger.info("Preparing evaluation of: " + str(pklz_dirs[i]))
+        inputdata = volumetry_evaluation.generate_input_yaml(
             sliver_dir,
-            eval_files[i],
-            visualization=False,
-            return_dir_lists=True,
-            special_evaluation_function=special_evaluation_function,
-            return_all_data=True
-
+            pklz_dirs[i],
+            yaml_filename=None
         )
-        logger.debug(str(a))
-        # print data
+        misc.obj_to_file(inputdata, yaml_files[i], filetype='yaml')
+        for record in inputdata['data']:
+            records.append((inputdata['basedir'], record))
+            experiment_indexes.append(i)
+
+    evaluation_list = volumetry_evaluation.eval_records(
+        records,
+        special_evaluation_function=special_evaluation_function,
+        n_jobs=n_jobs,
+        cache_dir=cache_dir
+    )
 
+    for i in recalculateThis:
+        logger.info("Writing evaluation of: " + str(pklz_dirs[i]))
+        evaluation_all = volumetry_evaluation.merge_evaluations([
+            evaluation_one
+            for evaluation_one, ind in zip(evaluation_list, experiment_indexes)
+            if ind == i
+        ])
+        volumetry_evaluation.write_evaluation(evaluation_all, eval_files[i])
 
 
 def plotone(data, expn, keyword, ind, marker, legend):
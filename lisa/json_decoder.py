@@ -1,102 +1,201 @@
 import json
 import numpy as np
 import random
-from scipy.spatial import Delaunay
+import scipy.ndimage
 from skimage import morphology
+import skimage.draw
+import skimage.measure
 from collections import OrderedDict
 
 description = {}
 
-def get_segdata(json_data, data, labels=None):
-    Z = len(data["segmentation"])
-    X = len(data["segmentation"][0])
-    Y = len(data["segmentation"][0][0])
 
-    for slice in range(0, Z):
-        nbr_drawings = json_data['drawings'][slice][0]['length']
+def _find_line_attrs(node):
+    """
+    Attributes of first Line shape in parsed dwv drawing.
+    """
+    if node.get("className") == "Line":
+        return node.get("attrs", {})
+    for child in node.get("children", []):
+        attrs = _find_line_attrs(child)
+        if attrs is not None:
+            return attrs
+    return None
+
+
+def parse_drawing(draw_info):
+    """
+    Get points and stroke color from dwv drawing string.
+
+    :param draw_info: JSON string with dwv freeHand group
+    :return: points as array [[row, col], ...] and stroke color string
+    """
+    try:
+        attrs = _find_line_attrs(json.loads(draw_info))
+    except ValueError:
+        attrs = None
+    if attrs is not None:
+        points = np.asarray(attrs.get("points", []), dtype=np.float64)
+        stroke = attrs.get("stroke", "")
+    else:
+        # riznuti jsonu u souradnic krajnich bodu
+        start = draw_info.find("points")
+        end = draw_info.find("stroke")
+        points = np.asarray(
+            draw_info[start + 9: end - 3].split(','), dtype=np.float64)
+        i_color = draw_info.find('#')
+        stroke = draw_info[i_color:(i_color + 7)] if i_color >= 0 else ""
+    # dwv uklada x, y => radek je y, sloupec x
+    points = np.round(points[:(len(points) // 2) * 2]).astype(int)
+    points = points.reshape(-1, 2)[:, ::-1]
+    return points, stroke
+
+
+def parse_color(stroke):
+    """
+    Get (r, g, b) from "#rrggbb" or "rgba(r,g,b,a)" string.
+    """
+    if stroke.startswith("#") and len(stroke) >= 7:
+        return tuple(int(stroke[i:(i + 2)], 16) for i in (1, 3, 5))
+    if stroke.startswith("rgb"):
+        values = stroke[stroke.find("(") + 1:stroke.find(")")].split(",")
+        return tuple(int(float(v)) for v in values[:3])
+    return 150, 150, 150
+
+
+def read_drawings(json_data, labels=None):
+    """
+    Parse all drawings from dwv json.
+
+    :param labels: list of processed labels, all are processed if None
+    :return: list of dicts with "slice", "key", "long_text", "points" and
+    "stroke"
+    """
+    drawings = []
+    for slice, (slice_drawings, slice_details) in enumerate(
+            zip(json_data['drawings'], json_data['drawingsDetails'])):
+        nbr_drawings = slice_drawings[0]['length']
         for draw in range(0, nbr_drawings):
-            # zpracovavany label
-            dict_key = json_data['drawingsDetails'][slice][0][draw]['textExpr']
-            if labels != None and dict_key not in labels: # zpracovavani jen nekterych objektu
+            details = slice_details[0][draw]
+            dict_key = details['textExpr']
+            if labels is not None and dict_key not in labels:
                 continue
+            points, stroke = parse_drawing(slice_drawings[0][str(draw)])
+            drawings.append({
+                "slice": slice,
+                "key": dict_key,
+                "long_text": details['longText'],
+                "points": points,
+                "stroke": stroke,
+            })
+    return drawings
 
-            # riznuti jsonu u souradnic krajnich bodu
-            draw_info = json_data['drawings'][slice][0][str(draw)]
-            start = draw_info.find("points")
-            end = draw_info.find("stroke")
-            points_data = draw_info[start + 9: end - 3].split(',')     
 
-            # prepsani souradnic do pole
-            len_array = int(len(points_data) / 2)
-            points = np.empty((len_array, 2))
-            i = 0
-            for j in range(0, len_array):
-                points[j] = [int(points_data[i + 1]), int(points_data[i])]
-                i += 2
-
-            # vyplneni nakresleneho obrazce
-            # pri spatnem nakresleni krivky muze zde padnout
-            hull = Delaunay(points)
-            x, y = np.mgrid[0:X, 0:Y]
-            grid = np.vstack([x.ravel(), y.ravel()]).T
-            simplex = hull.find_simplex(grid)
-            fill = grid[simplex >= 0, :]
-
-            # vlozeni markeru do dat
-            # pokud je label ve slovniku, pouzije se hodnota z nej, neprepise se na novou!
-            # pokud label neni ve slovniku, priradi se mu nahodna hodnota v rozmezi 100 - 254, 
-            # jestlize neobsahuje v popisu vlastni hodnotu
-            # pokud neni uveden label, ale pouze hodnota, vytvori se label se strukturou "lbl_" + hodnota
-            # jestlize neni uveden ani label, ani hodnota, nic se neprovede
-            dict_value = 0
-            dict_description = json_data['drawingsDetails'][slice][0][draw]['longText'].replace("'", '"')
-            if dict_description == '':
-                if dict_key == '':
-                    print("Drawing is not defined at slice", slice)
-                    continue
-                else:
-                    if dict_key in data["slab"].keys():
-                        dict_value = data["slab"][dict_key]
-                    else:
-                        dict_value = random.randint(100, 254)
-                        data["slab"][dict_key] = dict_value
+def polygon_outline(points):
+    """
+    Pixels on closed polyline. All segments are sampled at once.
+
+    :param points: array [[row, col], ...]
+    :return: rows, cols
+    """
+    closed = np.vstack([points, points[:1]])
+    diff = np.diff(closed, axis=0)
+    nbr_steps = np.max(np.abs(diff), axis=1) + 1
+    segment = np.repeat(np.arange(len(diff)), nbr_steps)
+    step = np.arange(len(segment)) - np.repeat(
+        np.cumsum(nbr_steps) - nbr_steps, nbr_steps)
+    frac = step / np.maximum(nbr_steps - 1, 1).astype(np.float64)[segment]
+    rr = np.round(closed[segment, 0] + frac * diff[segment, 0]).astype(int)
+    cc = np.round(closed[segment, 1] + frac * diff[segment, 1]).astype(int)
+    return rr, cc
+
+
+def fill_polygon(image2d, points, value):
+    """
+    Write value into polygon given by points and on its outline. Only
+    bounding box of polygon is processed.
+
+    :param image2d: 2D ndarray, it is modified in place
+    :param points: array [[row, col], ...]
+    """
+    if len(points) == 0:
+        return
+    rr, cc = skimage.draw.polygon(points[:, 0], points[:, 1], image2d.shape)
+    image2d[rr, cc] = value
+    rr, cc = polygon_outline(points)
+    inside = (rr >= 0) & (rr < image2d.shape[0]) & \
+        (cc >= 0) & (cc < image2d.shape[1])
+    image2d[rr[inside], cc[inside]] = value
+
+
+def get_segdata(json_data, data, labels=None, output_key="segmentation"):
+    """
+    Fill drawings from dwv json into data.
+
+    :param labels: list of processed labels, all are processed if None
+    :param output_key: key of data with 3D ndarray where labels are written
+    """
+    Z = len(data[output_key])
+
+    for drawing in read_drawings(json_data, labels):
+        slice = drawing["slice"]
+        dict_key = drawing["key"]
+
+        # vlozeni markeru do dat
+        # pokud je label ve slovniku, pouzije se hodnota z nej, neprepise se na novou!
+        # pokud label neni ve slovniku, priradi se mu nahodna hodnota v rozmezi 100 - 254, 
+        # jestlize neobsahuje v popisu vlastni hodnotu
+        # pokud neni uveden label, ale pouze hodnota, vytvori se label se strukturou "lbl_" + hodnota
+        # jestlize neni uveden ani label, ani hodnota, nic se neprovede
+        dict_value = 0
+        dict_description = drawing["long_text"].replace("'", '"')
+        if dict_description == '':
+            if dict_key == '':
+                print("Drawing is not defined at slice", slice)
+                continue
             else:
-                dict_description = json.loads(dict_description)
-                if dict_key != '' and dict_key in data["slab"].keys():
+                if dict_key in data["slab"].keys():
                     dict_value = data["slab"][dict_key]
-                elif "value" in dict_description.keys():
-                    dict_value = dict_description["value"]
-                    if dict_key != '':
-                        data["slab"][dict_key] = dict_value
-                    else:
-                        dict_key = "lbl_" + str(dict_value)
-                        data["slab"][dict_key] = dict_value
-                elif dict_key != '':
+                else:
                     dict_value = random.randint(100, 254)
                     data["slab"][dict_key] = dict_value
+        else:
+            dict_description = json.loads(dict_description)
+            if dict_key != '' and dict_key in data["slab"].keys():
+                dict_value = data["slab"][dict_key]
+            elif "value" in dict_description.keys():
+                dict_value = dict_description["value"]
+                if dict_key != '':
+                    data["slab"][dict_key] = dict_value
                 else:
-                    print("Drawing is not defined at slice", slice)
-                    continue
-
-            for i,j in fill:
-                data["segmentation"][Z - 1 - slice][i][j] = dict_value
-        
-            # ziskani zbytku popisu
-            if dict_key not in description.keys():
-                description[dict_key] = {}
-                i_color = draw_info.find('#') + 1
-                description[dict_key]["r"] = int(draw_info[i_color:(i_color + 2)], 16)
-                description[dict_key]["g"] = int(draw_info[(i_color + 2):(i_color + 4)], 16)
-                description[dict_key]["b"] = int(draw_info[(i_color + 4):(i_color + 6)], 16)
-                description[dict_key]["value"] = dict_value
-
-            if dict_description != '':
-                if "threshold" in dict_description.keys():
-                    description[dict_key]["threshold"] = dict_description["threshold"] # nastavit kolem 100 - 120
-                if "two" in dict_description.keys():
-                    description[dict_key]["two"] = dict_description["two"]
-                if "three" in dict_description.keys():
-                    description[dict_key]["three"] = dict_description["three"]
+                    dict_key = "lbl_" + str(dict_value)
+                    data["slab"][dict_key] = dict_value
+            elif dict_key != '':
+                dict_value = random.randint(100, 254)
+                data["slab"][dict_key] = dict_value
+            else:
+                print("Drawing is not defined at slice", slice)
+                continue
+
+        fill_polygon(
+            data[output_key][Z - 1 - slice], drawing["points"], dict_value)
+
+        # ziskani zbytku popisu
+        if dict_key not in description.keys():
+            description[dict_key] = {}
+            r, g, b = parse_color(drawing["stroke"])
+            description[dict_key]["r"] = r
+            description[dict_key]["g"] = g
+            description[dict_key]["b"] = b
+            description[dict_key]["value"] = dict_value
+
+        if dict_description != '':
+            if "threshold" in dict_description.keys():
+                description[dict_key]["threshold"] = dict_description["threshold"] # nastavit kolem 100 - 120
+            if "two" in dict_description.keys():
+                description[dict_key]["two"] = dict_description["two"]
+            if "three" in dict_description.keys():
+                description[dict_key]["three"] = dict_description["three"]
 
 def get_vesselPoint(json_data, label=None):
     Z = len(json_data['drawings'])
@@ -112,78 +211,116 @@ def get_vesselPoint(json_data, label=None):
             if dict_key != label:
                 continue
 
-            # riznuti jsonu u souradnic krajnich bodu
-            draw_info = json_data['drawings'][slice][0][str(draw)]
-            start = draw_info.find("points")
-            end = draw_info.find("stroke")
-            points_data = draw_info[start + 9: end - 3].split(',')     
+            points, stroke = parse_drawing(json_data['drawings'][slice][0][str(draw)])
 
             # prepsani souradnic do pole
             z = np.array([(Z - 1 - slice)], dtype=np.dtype('int64'))
-            x = np.array([int(points_data[1])], dtype=np.dtype('int64'))
-            y = np.array([int(points_data[0])], dtype=np.dtype('int64'))
+            x = np.array([points[0, 0]], dtype=np.dtype('int64'))
+            y = np.array([points[0, 1]], dtype=np.dtype('int64'))
             return [z, x, y]
 
 def get_seeds(data, label):
     return ((data["segmentation"] != 0).astype('int8') * 2 - 
            (data["segmentation"] == data["slab"][label]).astype('int8'))
 
-def write_to_json(data, json_data=None, output_name="json_data.json"):
-    Z = len(data["segmentation"])
-    X = len(data["segmentation"][0])
-    Y = len(data["segmentation"][0][0])
+def trace_contour(mask, tolerance=0.5):
+    """
+    Outline of one component as polygon going through centers of its border
+    pixels.
+
+    :param mask: 2D bool ndarray with one component
+    :param tolerance: maximal distance of simplified polygon from contour in
+    pixels, no simplification if 0
+    :return: array [[row, col], ...]
+    """
+    padded = np.pad(mask, 1, mode="constant").astype(np.float64)
+    # izolinie tesne pod jednickou vede pres stredy okrajovych pixelu
+    contours = skimage.measure.find_contours(padded, 1 - 1e-3)
+    if len(contours) == 0:
+        return np.argwhere(mask)[:1]
+    contour = max(contours, key=len)
+    if tolerance > 0:
+        contour = skimage.measure.approximate_polygon(contour, tolerance)
+    return np.round(contour).astype(int) - 1
+
+
+def slice_drawings(slice2d, tolerance=0.5):
+    """
+    Contours of all components in one slice. Components are 4-connected,
+    pixels touching only diagonally would be lost by one contour.
+
+    :return: list of (label value, points [[row, col], ...])
+    """
+    # rozdeleni objektu, sousedni objekty s ruznym labelem jsou oddeleny
+    divided = morphology.label(slice2d, background=0, connectivity=1)
+    component_labels = np.zeros(np.max(divided) + 1, dtype=slice2d.dtype)
+    component_labels[divided.ravel()] = slice2d.ravel()
+    drawings = []
+    for i, sl in enumerate(scipy.ndimage.find_objects(divided)):
+        if sl is None:
+            continue
+        points = trace_contour(divided[sl] == i + 1, tolerance)
+        points = points + [sl[0].start, sl[1].start]
+        drawings.append((component_labels[i + 1], points))
+    return drawings
+
+
+def write_to_json(data, json_data=None, output_name="json_data.json",
+                  tolerance=0.5):
+    """
+    Write contours of segmentation into dwv json. Every component in every
+    slice is one freeHand drawing. Drawings are written into file slice by
+    slice. Input json_data is not modified.
+
+    :param json_data: existing annotation, new drawings are appended
+    :param tolerance: simplification of contours in pixels
+    """
+    segmentation = data["segmentation"]
+    Z = len(segmentation)
 
     if json_data==None:
         json_data = initJson(Z) # prohazuje poradi => dwv nefunguje na 100 % (nelze pak stahnout json)
 
-    for slice in range(0, Z):
-        label_array = np.unique(data["segmentation"][Z - 1 - slice]).tolist()
-        label_array.remove(0) # pole vyskytovanych labelu bez 0
-
-        divided = morphology.label(data["segmentation"][Z - 1 - slice], background=0) # rozdeleni objektu
-        nbr_divided = np.unique(divided).tolist() 
-        nbr_divided.remove(0) # pole rozdelenych objektu bez 0
-        print(slice, label_array, nbr_divided)
-
-        if len(label_array) < len(nbr_divided): # nesedi pocet vyskytovanych labelu s poctem objektu
-            new_array = []
-            for i in range(0, max(nbr_divided)):
-                for j in range(0, len(label_array)):
-                    a = ((data["segmentation"] == label_array[j]) * (divided == i)).astype('int8')
-                    if 1 in a:
-                        new_array.append(label_array[j])
-                        break
-            label_array = new_array
-        if len(label_array) > 0:
-            nbr_drawings = json_data['drawings'][slice][0]['length']
-            for lbl in range(0, len(label_array)):
-                str_points = ""
-                nbr_points = 0
-                last_y = 0
-                last_x = 0
-                for key, value in data["slab"].items(): # neni osetreno, kdyby se nenachazel label ve slovniku
-                    if value != 0 and value == label_array[lbl]:
-                        for x in range(0, X):
-                            for y in range(0, Y):
-                                if divided[x][y] == lbl + 1:
-                                    str_points += ("," if len(str_points) != 0 else "") + str(y) + "," + str(x)
-                                    last_y = y
-                                    last_x = x
-                                    nbr_points += 1
-                        break
-                if nbr_points <= 1: # osetreni, aby DWV nezamrzl (nesmi byt predan 1 stejny bod)
-                    str_points += "," + str(last_y + 1) + "," + str(last_x)
-                if key not in description.keys():
-                    initDescription(key, b=0)
-
-                rgba = "rgba(" + str(description[key]["r"])
-                rgba += "," + str(description[key]["g"]) + ","
-                rgba += str(description[key]["b"]) + ",0.5)"
-                json_data["drawings"][slice][0][str(lbl + nbr_drawings)] = get_str_drawings(key + str(lbl), key, str_points, rgba, [150, 10 + lbl * 12])
-                json_data["drawingsDetails"][slice][0].append({"id":key + str(lbl), "textExpr":key, "longText":"{\"value\":" + str(value) + "}", "quant":None})
-            json_data["drawings"][slice][0]["length"] = len(label_array) + nbr_drawings
+    keys = {}
+    for key, value in data["slab"].items():
+        if value != 0 and value not in keys:
+            keys[value] = key
+    nonzero_slices = np.any(segmentation, axis=tuple(range(1, segmentation.ndim)))
+
+    details = []
     with open(output_name, 'w') as file:
-        json.dump(json_data, file)
+        file.write("{")
+        for key, value in json_data.items():
+            if key not in ("drawings", "drawingsDetails"):
+                file.write(json.dumps(key) + ": " + json.dumps(value) + ", ")
+        file.write("\"drawings\": [")
+        for slice in range(0, Z):
+            drawings = OrderedDict(json_data["drawings"][slice][0])
+            slice_details = list(json_data["drawingsDetails"][slice][0])
+            if nonzero_slices[Z - 1 - slice]:
+                nbr_drawings = drawings["length"]
+                components = slice_drawings(segmentation[Z - 1 - slice], tolerance)
+                for lbl, (value, points) in enumerate(components):
+                    key = keys.get(value, "lbl_" + str(value))
+                    if len(points) <= 1:
+                        # osetreni, aby DWV nezamrzl (nesmi byt predan 1 stejny bod)
+                        points = np.asarray([points[0], points[0] + [0, 1]])
+                    str_points = ",".join(
+                        [str(y) + "," + str(x) for x, y in points])
+                    if key not in description.keys():
+                        initDescription(key, b=0)
+
+                    rgba = "rgba(" + str(description[key]["r"])
+                    rgba += "," + str(description[key]["g"]) + ","
+                    rgba += str(description[key]["b"]) + ",0.5)"
+                    drawings[str(lbl + nbr_drawings)] = get_str_drawings(key + str(lbl), key, str_points, rgba, [150, 10 + lbl * 12])
+                    slice_details.append({"id":key + str(lbl), "textExpr":key, "longText":"{\"value\":" + str(value) + "}", "quant":None})
+                drawings["length"] = len(components) + nbr_drawings
+            file.write((", " if slice > 0 else "") + json.dumps([drawings]))
+            details.append([slice_details])
+        file.write("], \"drawingsDetails\": ")
+        json.dump(details, file)
+        file.write("}")
 
 def initJson(nbr_slices, window_center=50, window_width=350, y=0, x=0, z=0, scale=1):
     json_data = OrderedDict()
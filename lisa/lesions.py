@@ -175,17 +175,13 @@ class Lesions:
         """
         labels, nlabels = self.get_objects(objects)
         labeled_objs = self.segmentation == label
-        not_vessel_objects = np.zeros_like(self.segmentation)
-
-        # iterates through all founded objects
-        for l in range(1, nlabels+1):
-            obj = labels == l
-            # count number of voxels that are also labeled ass vessels
-            same_voxs = np.logical_and(labeled_objs, obj).sum()
-            # if there are no vessel voxels, then this object is taken into
-            # account
-            if same_voxs == 0:
-                not_vessel_objects += obj
+
+        # labels of objects with at least one voxel labeled as vessel
+        touching = np.unique(labels[labeled_objs])
+        lut = np.ones(nlabels + 1, dtype=self.segmentation.dtype)
+        lut[0] = 0
+        lut[touching] = 0
+        not_vessel_objects = lut[labels]
 
         return not_vessel_objects
 
@@ -206,20 +202,14 @@ class Lesions:
 # ---------------------------------------------------------------------------
 # ---------------------------------------------------------------------------
     def get_features(self, labels, nlabels):
+        """
+        Size and compactness of all objects. See get_region_properties().
+        """
+        props = get_region_properties(labels, nlabels)
         features = np.zeros((nlabels, 2))
-        for lab in range(1, nlabels+1):
-            obj = labels == lab
-            size = obj.sum()
-            strel = np.ones((3, 3, 3), dtype=np.bool)
-            # obj =scimorph.binary_closing(obj, generate_binary_structure(3,3))
-            obj = scimorph.binary_closing(obj, strel)
-            compactness = self.get_zunics_compatness(obj)
-            features[lab-1, 0] = size
-            features[lab-1, 1] = compactness
-
-            print('size = %i' % sizeú)
-            print('compactness = %.3f' % compactness)
-            # sed3.sed3(self.data3d, contour=(labels==lab)).show() # noqa
+        features[:, 0] = props['size']
+        features[:, 1] = props['compactness']
+        logger.debug('sizes = ' + str(features[:, 0]))
         print(features[:, 1])
         return features
 
@@ -259,9 +249,9 @@ class Lesions:
         print('    before: nlabels = %i' % n_labels)
         # filtering objects with respect to their features
         features_ok = features[:, 1] >= min_comp
-        objs_ok = np.zeros_like(objects)
-        for i in np.argwhere(features_ok > 0):
-            objs_ok += labels == (i + 1)
+        lut = np.zeros(n_labels + 1, dtype=objects.dtype)
+        lut[1:] = features_ok
+        objs_ok = lut[labels]
         print('\tafter: nlabels = %i' % features_ok.sum())
 
         return objs_ok
@@ -276,37 +266,15 @@ class Lesions:
 # ---------------------------------------------------------------------------
 # ---------------------------------------------------------------------------
     def get_moment(self, obj, p, q, r):
-        elems = np.argwhere(obj)
-        mom = 0
-        for el in elems:
-            mom += el[0]**p + el[1]**q + el[2]**r
-        return mom
+        elems = np.nonzero(obj)
+        return _moment(elems, p, q, r)
 
 # ---------------------------------------------------------------------------
 # ---------------------------------------------------------------------------
     def get_central_moment(self, obj, p, q, r):
-        elems = np.argwhere(obj)
-        m000 = obj.sum()
-        m100 = (elems[:, 0]).sum()
-        m010 = (elems[:, 1]).sum()
-        m001 = (elems[:, 2]).sum()
-        xc = m100 / m000
-        yc = m010 / m000
-        zc = m001 / m000
+        elems = np.nonzero(obj)
+        return _moment(elems, p, q, r, central=True)
 
-        mom = 0
-        for el in elems:
-            mom += (el[0] - xc)**p + (el[1] - yc)**q + (el[2] - zc)**r
-
-        # mxyz = elems.sum(axis=0)
-        # cent = mxyz / m000
-        # mom = 0
-        # for el in elems:
-        #     mom += (el[0] - cent[0])**p + (el[1] - cent[1])**q +
-        #                                    (el[2] - cent[2])**r
-        return mom
-
-# ---------------------------------------------------------------------------
 # ---------------------------------------------------------------------------
     def get_zunics_compatness(self, obj):
         m000 = obj.sum()
@@ -485,6 +453,93 @@ class Lesions:
         plt.show()
 
 
+# ---------------------------------------------------------------------------
+# ---------------------------------------------------------------------------
+REGION_PROPERTIES_DTYPE = [
+    ('label', np.int64),
+    ('size', np.int64),
+    ('compactness', np.float64),
+    ('centroid', np.float64, (3,)),
+    ('central_moments', np.float64, (3,)),
+    ('bbox', np.int64, (3, 2)),
+]
+
+
+def get_region_properties(labels, nlabels=None, closing=True):
+    """
+    Compute shape features of all labeled objects in one pass.
+
+    Every object is processed only in its bounding box given by
+    scipy.ndimage.find_objects(). Moments are computed with vectorized sums
+    over voxel coordinates.
+
+    :param labels: labeled image, f.e. from scipy.ndimage.label()
+    :param nlabels: number of labels. Max of labels is used if it is None.
+    :param closing: object is closed with 3x3x3 structure before computation
+        of moments and compactness. Size is measured on original object.
+    :return: structured array with one row per label with fields label, size,
+        compactness, centroid, central_moments (mu200, mu020, mu002) and
+        bbox (in voxel coordinates of labels)
+    """
+    if nlabels is None:
+        nlabels = int(np.max(labels))
+    props = np.zeros(nlabels, dtype=REGION_PROPERTIES_DTYPE)
+    props['label'] = np.arange(1, nlabels + 1)
+    strel = np.ones((3, 3, 3), dtype=bool)
+    # closing can extend the object outside of its bounding box
+    margin = 2 if closing else 0
+
+    objects = scipy.ndimage.find_objects(labels, nlabels)
+    for i, slices in enumerate(objects):
+        if slices is None:
+            continue
+        props['bbox'][i] = [[sl.start, sl.stop] for sl in slices]
+        slices = tuple(
+            slice(max(sl.start - margin, 0), min(sl.stop + margin, shp))
+            for sl, shp in zip(slices, labels.shape)
+        )
+        obj = labels[slices] == (i + 1)
+        props['size'][i] = np.sum(obj)
+        if closing:
+            obj = scimorph.binary_closing(obj, strel)
+
+        elems = np.nonzero(obj)
+        m000 = float(len(elems[0]))
+        if m000 == 0:
+            continue
+        offset = [sl.start for sl in slices]
+        props['centroid'][i] = [
+            np.mean(el) + off for el, off in zip(elems, offset)]
+        props['central_moments'][i] = [
+            _moment(elems, 2, 0, 0, central=True),
+            _moment(elems, 0, 2, 0, central=True),
+            _moment(elems, 0, 0, 2, central=True),
+        ]
+        props['compactness'][i] = _zunics_compactness(
+            m000, np.sum(props['central_moments'][i]))
+
+    return props
+
+
+def _moment(elems, p, q, r, central=False):
+    """
+    Raw or central moment of object given by its voxel coordinates
+    (output of np.nonzero()).
+    """
+    coords = [np.asarray(el, dtype=np.float64) for el in elems]
+    if central:
+        coords = [c - np.mean(c) for c in coords]
+    return np.sum(coords[0] ** p * coords[1] ** q * coords[2] ** r)
+
+
+def _zunics_compactness(m000, sum_of_second_moments):
+    term_1 = (3**(5./3)) / (5 * (4*np.pi)**(2./3))
+    if sum_of_second_moments == 0:
+        return 0.0
+    term_2 = m000**(5./3) / sum_of_second_moments
+    return term_1 * term_2
+
+
 # ---------------------------------------------------------------------------
 # ---------------------------------------------------------------------------
 def main():
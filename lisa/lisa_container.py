@@ -0,0 +1,417 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+# vim:fenc=utf-8
+#
+# Distributed under terms of the MIT license.
+
+"""
+Native LISA container for dataplus.
+
+Container is a directory (usually with ".lisa" extension). Volumetric
+arrays (data3d, segmentation, seeds, ...) are stored separately in chunks.
+Every chunk is one file, optionally compressed with zlib. Chunks with
+zeros only are not stored at all. All other items of dataplus are pickled
+into small metadata file.
+
+    container.lisa/
+        header.json
+        metadata.pkl
+        data3d/array.json
+        data3d/0.0.0
+        data3d/0.0.1
+        ...
+
+Arrays can be opened lazily. Only chunks touched by indexing are read and
+uncompressed chunks are memory-mapped. Uncompressed array is stored by
+default in one chunk, so np.asarray() gives memory-mapped array without
+reading the data. Writing into existing container rewrites only changed
+chunks.
+
+    import lisa.lisa_container
+    lisa.lisa_container.write(datap, "case.lisa")
+    datap = lisa.lisa_container.read("case.lisa", lazy=True)
+    slice_seg = datap["segmentation"][50]
+"""
+
+import logging
+logger = logging.getLogger(__name__)
+import argparse
+import os
+import os.path as op
+import shutil
+import json
+import zlib
+import itertools
+import numpy as np
+
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+format_name = "lisa-container"
+format_version = [1, 0, 0]
+header_filename = "header.json"
+metadata_filename = "metadata.pkl"
+array_header_filename = "array.json"
+
+
+def is_container(path):
+    """
+    Check if path is LISA container.
+    """
+    return op.isfile(op.join(path, header_filename))
+
+
+def default_chunks(shape, itemsize, chunk_bytes=2 ** 20):
+    """
+    Chunk shape with whole slices where possible and about chunk_bytes bytes.
+    """
+    chunks = list(shape)
+    for axis in range(len(shape)):
+        other = int(np.prod(chunks[axis + 1:])) * itemsize
+        if other == 0:
+            break
+        chunks[axis] = int(min(max(chunk_bytes // other, 1), shape[axis]))
+        if chunks[axis] < shape[axis]:
+            break
+    return tuple(chunks)
+
+
+def _chunk_name(index):
+    return ".".join([str(i) for i in index])
+
+
+def _chunk_grid(shape, chunks):
+    return [int(np.ceil(float(sh) / ch)) if sh > 0 else 0
+            for sh, ch in zip(shape, chunks)]
+
+
+def _chunk_slices(index, shape, chunks):
+    return tuple([
+        slice(i * ch, min((i + 1) * ch, sh))
+        for i, ch, sh in zip(index, chunks, shape)
+    ])
+
+
+def _read_json(path):
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+def _write_json(obj, path):
+    with open(path, "w") as f:
+        json.dump(obj, f, indent=1)
+
+
+class ChunkedArray(object):
+    """
+    Lazy view on array stored in container. Indexing with ints and slices
+    reads only the chunks needed. np.asarray() reads whole array.
+    """
+    def __init__(self, path):
+        self.path = path
+        header = _read_json(op.join(path, array_header_filename))
+        self.shape = tuple(header["shape"])
+        self.dtype = np.dtype(header["dtype"])
+        self.chunks = tuple(header["chunks"])
+        self.compression = header["compression"]
+
+    @property
+    def ndim(self):
+        return len(self.shape)
+
+    @property
+    def size(self):
+        return int(np.prod(self.shape))
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __repr__(self):
+        return "ChunkedArray(%s, shape=%s, dtype=%s)" % (
+            self.path, str(self.shape), str(self.dtype))
+
+    def __array__(self, dtype=None, copy=None):
+        if self.compression is None and \
+                _chunk_grid(self.shape, self.chunks) == [1] * self.ndim:
+            # one uncompressed chunk, whole array is memory-mapped
+            data = self.read_chunk([0] * self.ndim)
+        else:
+            data = self.read_region([0] * self.ndim, self.shape)
+        if dtype is not None:
+            data = data.astype(dtype)
+        return data
+
+    def read_chunk(self, index):
+        """
+        Read one chunk. Chunk which is not stored is full of zeros.
+        Uncompressed chunk is memory-mapped in copy-on-write mode, changes
+        are not written into the file.
+        """
+        sl = _chunk_slices(index, self.shape, self.chunks)
+        chunk_shape = tuple([s.stop - s.start for s in sl])
+        fn = op.join(self.path, _chunk_name(index))
+        if not op.exists(fn):
+            return np.zeros(chunk_shape, dtype=self.dtype)
+        if self.compression is None:
+            return np.memmap(fn, dtype=self.dtype, mode="c", shape=chunk_shape)
+        with open(fn, "rb") as f:
+            buf = zlib.decompress(f.read())
+        return np.frombuffer(buf, dtype=self.dtype).reshape(chunk_shape)
+
+    def read_region(self, start, stop):
+        """
+        Read box given by start and stop indexes.
+        """
+        start = np.asarray(start, dtype=int)
+        stop = np.asarray(stop, dtype=int)
+        out = np.zeros(np.maximum(stop - start, 0), dtype=self.dtype)
+        if out.size == 0:
+            return out
+        chunks = np.asarray(self.chunks)
+        first = start // chunks
+        last = (stop - 1) // chunks
+        for index in itertools.product(*[
+                range(f, l + 1) for f, l in zip(first, last)]):
+            sl = _chunk_slices(index, self.shape, self.chunks)
+            lo = np.maximum([s.start for s in sl], start)
+            hi = np.minimum([s.stop for s in sl], stop)
+            chunk = self.read_chunk(index)
+            chunk_sl = tuple([
+                slice(l - s.start, h - s.start) for l, h, s in zip(lo, hi, sl)])
+            out_sl = tuple([slice(l - s, h - s) for l, h, s in zip(lo, hi, start)])
+            out[out_sl] = chunk[chunk_sl]
+        return out
+
+    def __getitem__(self, key):
+        if not isinstance(key, tuple):
+            key = (key,)
+        if Ellipsis in key:
+            i = key.index(Ellipsis)
+            key = key[:i] + (slice(None),) * (self.ndim - len(key) + 1) + \
+                key[i + 1:]
+        key = key + (slice(None),) * (self.ndim - len(key))
+        if len(key) != self.ndim:
+            raise IndexError("too many indices for array")
+
+        start = []
+        stop = []
+        local_key = []
+        for k, sh in zip(key, self.shape):
+            if isinstance(k, (int, np.integer)):
+                k = int(k)
+                if k < 0:
+                    k += sh
+                if k < 0 or k >= sh:
+                    raise IndexError("index out of bounds")
+                start.append(k)
+                stop.append(k + 1)
+                local_key.append(0)
+            elif isinstance(k, slice):
+                first, last, step = k.indices(sh)
+                if step > 0:
+                    lo = first
+                    hi = max(last, first)
+                    local_key.append(slice(0, hi - lo, step))
+                else:
+                    # negative step is rare, read whole axis
+                    lo = 0
+                    hi = sh
+                    local_key.append(k)
+                start.append(lo)
+                stop.append(hi)
+            else:
+                # fancy indexing
+                return np.asarray(self)[key]
+        return self.read_region(start, stop)[tuple(local_key)]
+
+
+def write_array(path, data, chunks=None, compression="zlib", level=1):
+    """
+    Write array into directory. If the same array is already stored there,
+    only changed chunks are rewritten.
+
+    :param compression: "zlib" or None. Uncompressed chunks can be
+    memory-mapped.
+    :param chunks: chunk shape, default is about 1MB for compressed array and
+    whole array for uncompressed one
+    :return: number of written or removed chunk files
+    """
+    data = np.asarray(data)
+    if chunks is None:
+        if compression is None:
+            chunks = data.shape
+        else:
+            chunks = default_chunks(data.shape, data.dtype.itemsize)
+    chunks = tuple([int(ch) for ch in chunks])
+    header = {
+        "shape": list(data.shape),
+        "dtype": data.dtype.str,
+        "chunks": list(chunks),
+        "compression": compression,
+    }
+
+    header_path = op.join(path, array_header_filename)
+    crcs = {}
+    if op.exists(header_path):
+        old_header = _read_json(header_path)
+        crcs = old_header.pop("crc32", {})
+        if old_header != header:
+            # different layout, everything is written again
+            shutil.rmtree(path)
+            crcs = {}
+    if not op.exists(path):
+        os.makedirs(path)
+
+    n_written = 0
+    new_crcs = {}
+    for index in itertools.product(*[
+            range(n) for n in _chunk_grid(data.shape, chunks)]):
+        name = _chunk_name(index)
+        fn = op.join(path, name)
+        chunk = data[_chunk_slices(index, data.shape, chunks)]
+        if not np.any(chunk):
+            if name in crcs:
+                os.remove(fn)
+                n_written += 1
+            continue
+        buf = np.ascontiguousarray(chunk).tobytes()
+        crc = zlib.crc32(buf) & 0xffffffff
+        new_crcs[name] = crc
+        if crcs.get(name) == crc and op.exists(fn):
+            continue
+        if compression == "zlib":
+            buf = zlib.compress(buf, level)
+        elif compression is not None:
+            raise ValueError("Unknown compression: " + str(compression))
+        # old file can be still memory-mapped, it is replaced not rewritten
+        with open(fn + ".tmp", "wb") as f:
+            f.write(buf)
+        if op.exists(fn):
+            os.remove(fn)
+        os.rename(fn + ".tmp", fn)
+        n_written += 1
+
+    header["crc32"] = new_crcs
+    _write_json(header, header_path)
+    return n_written
+
+
+def _is_volumetric(value):
+    return isinstance(value, np.ndarray) and value.ndim >= 3 and \
+        value.dtype.kind in "biuf"
+
+
+def _split_arrays(data, prefix=()):
+    """
+    Copy of nested dicts without volumetric arrays and list of
+    (key path, array).
+    """
+    meta = {}
+    arrays = []
+    for key, value in data.items():
+        if _is_volumetric(value):
+            arrays.append((prefix + (key,), value))
+            meta[key] = None
+        elif isinstance(value, dict):
+            meta[key], sub_arrays = _split_arrays(value, prefix + (key,))
+            arrays.extend(sub_arrays)
+        else:
+            meta[key] = value
+    return meta, arrays
+
+
+def write(data, path, compression="zlib", chunks=None):
+    """
+    Write dataplus into container. If container exists, only changed chunks
+    are rewritten.
+
+    :param data: dict, volumetric arrays can be also in nested dicts
+    :param compression: "zlib" or None for memory-mappable chunks
+    :param chunks: chunk shape, default is computed for every array, see
+    write_array()
+    :return: number of written or removed chunk files
+    """
+    if op.exists(path) and not op.isdir(path):
+        raise IOError("File exists and it is not LISA container: " + path)
+    old_names = []
+    if is_container(path):
+        old_names = [arr["name"] for arr in
+                     _read_json(op.join(path, header_filename))["arrays"]]
+    elif not op.exists(path):
+        os.makedirs(path)
+
+    meta, arrays = _split_arrays(data)
+    header = {
+        "format": format_name,
+        "version": format_version,
+        "arrays": [],
+    }
+    n_written = 0
+    for key, value in arrays:
+        name = ".".join([str(k) for k in key])
+        header["arrays"].append({"key": list(key), "name": name})
+        n_written += write_array(
+            op.join(path, name), value, chunks=chunks, compression=compression)
+
+    names = [arr["name"] for arr in header["arrays"]]
+    for name in old_names:
+        if name not in names:
+            shutil.rmtree(op.join(path, name))
+
+    with open(op.join(path, metadata_filename), "wb") as f:
+        pickle.dump(meta, f, protocol=2)
+    _write_json(header, op.join(path, header_filename))
+    logger.debug("%i chunks written to %s" % (n_written, path))
+    return n_written
+
+
+def read(path, lazy=False):
+    """
+    Read dataplus from container.
+
+    :param lazy: volumetric arrays are returned as ChunkedArray which reads
+    data on indexing
+    :return: dict
+    """
+    if not is_container(path):
+        raise IOError("Not a LISA container: " + path)
+    header = _read_json(op.join(path, header_filename))
+    with open(op.join(path, metadata_filename), "rb") as f:
+        data = pickle.load(f)
+    for arr in header["arrays"]:
+        value = ChunkedArray(op.join(path, arr["name"]))
+        if not lazy:
+            value = np.asarray(value)
+        dct = data
+        for key in arr["key"][:-1]:
+            dct = dct[key]
+        dct[arr["key"][-1]] = value
+    return data
+
+
+def main():
+    logger = logging.getLogger()
+
+    logger.setLevel(logging.DEBUG)
+    ch = logging.StreamHandler()
+    logger.addHandler(ch)
+
+    parser = argparse.ArgumentParser(
+        description="Convert data into LISA container")
+    parser.add_argument('inputfile', help='input file (pklz, dicom dir, ...)')
+    parser.add_argument('outputfile', help='output container')
+    parser.add_argument(
+        '--no-compression', action='store_true',
+        help='store memory-mappable chunks without compression')
+    args = parser.parse_args()
+
+    import io3d
+    datap = io3d.read(args.inputfile, dataplus_format=True)
+    compression = None if args.no_compression else "zlib"
+    write(datap, args.outputfile, compression=compression)
+
+
+if __name__ == "__main__":
+    main()
@@ -33,12 +33,18 @@ def lisa_main():
     parser.add_argument(
         '-ni', '--no_interactivity', action='store_true',
         help='run in no interactivity mode, seeds must be defined')
+    parser.add_argument(
+        '--batch', action='store_true',
+        help='run batch segmentation service, see lisa/batch.py')
     # Read alternative config file. First is loaded default config. Then user
     # config in lisa_data directory. After that is readed config defined by
     # --configfile parameter
     knownargs, unknownargs = parser.parse_known_args()
 
-    if knownargs.no_interactivity:
+    if knownargs.batch:
+        from . import batch
+        batch.main(unknownargs)
+    elif knownargs.no_interactivity:
         import organ_segmentation
         organ_segmentation.main()
     else:
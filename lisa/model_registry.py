@@ -0,0 +1,168 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+# vim:fenc=utf-8
+#
+# Distributed under terms of the MIT license.
+
+"""
+Registry of trained models stored in files.
+
+Every file is unpickled only once per process. Key of the cache is the
+path together with modification time and size of the file, so retrained
+model is loaded again. Loaded models are shared by all OrganSegmentation
+instances. Call preload() before worker processes are forked and the
+workers get the models without loading.
+
+Time spent by loading and by inference is collected and can be read with
+get_stats().
+
+    from lisa import model_registry
+    mdl = model_registry.get_intensity_model(
+        "~/lisa_data/liver_intensity.Model.p", fv_extern=fv_function)
+    with model_registry.measure("~/lisa_data/liver_intensity.Model.p"):
+        lik = mdl.likelihood_from_image(data3d, voxelsize_mm, 1)
+"""
+
+import logging
+logger = logging.getLogger(__name__)
+import os
+import os.path as op
+import time
+import contextlib
+
+_models = {}
+_stats = {}
+
+
+def _file_key(filename, kind):
+    filename = op.abspath(op.expanduser(filename))
+    st = os.stat(filename)
+    return (kind, filename, st.st_mtime, st.st_size)
+
+
+def _record(filename, name, seconds):
+    filename = op.abspath(op.expanduser(filename))
+    stats = _stats.setdefault(filename, {
+        "n_loads": 0,
+        "load_time_s": 0.0,
+        "n_requests": 0,
+        "n_inferences": 0,
+        "inference_time_s": 0.0,
+    })
+    if name == "load":
+        stats["n_loads"] += 1
+        stats["load_time_s"] += seconds
+    elif name == "request":
+        stats["n_requests"] += 1
+    elif name == "inference":
+        stats["n_inferences"] += 1
+        stats["inference_time_s"] += seconds
+
+
+def get(filename, loader, kind=None):
+    """
+    Get object loaded from file by loader function. File is loaded only once
+    until it is modified.
+
+    :param filename: path to stored model
+    :param loader: function which gets expanded filename and returns object
+    :param kind: identifier of loader, the same file can be loaded by more
+    loaders. Name of loader function is used by default.
+    :return: loaded object
+    """
+    if kind is None:
+        kind = loader.__name__
+    key = _file_key(filename, kind)
+    _record(filename, "request", 0)
+    if key not in _models:
+        # older versions of the same file are not needed
+        for old_key in list(_models.keys()):
+            if old_key[:2] == key[:2]:
+                del _models[old_key]
+        t0 = time.time()
+        _models[key] = loader(key[1])
+        _record(filename, "load", time.time() - t0)
+        logger.debug("model loaded from " + key[1])
+    return _models[key]
+
+
+def preload(filenames_and_loaders):
+    """
+    Load models before worker processes are forked.
+
+    :param filenames_and_loaders: list of (filename, loader) tuples
+    """
+    for filename, loader in filenames_and_loaders:
+        get(filename, loader)
+
+
+def clear():
+    """
+    Forget all loaded models and statistics.
+    """
+    _models.clear()
+    _stats.clear()
+
+
+def get_stats():
+    """
+    Loading and inference statistics per file.
+
+    :return: dict {filename: {n_loads, load_time_s, n_requests,
+    n_inferences, inference_time_s}}
+    """
+    return dict([(key, dict(value)) for key, value in _stats.items()])
+
+
+@contextlib.contextmanager
+def measure(filename):
+    """
+    Measure inference time of model stored in file.
+    """
+    t0 = time.time()
+    try:
+        yield
+    finally:
+        _record(filename, "inference", time.time() - t0)
+
+
+def _load_organ_localizator(filename):
+    try:
+        from lisa import organ_localizator
+    except:
+        import organ_localizator
+    ol = organ_localizator.OrganLocalizator()
+    ol.load(filename)
+    return ol
+
+
+def get_organ_localizator(filename="~/lisa_data/liver.ol.p"):
+    """
+    Organ localizator shared by all callers.
+    """
+    return get(filename, _load_organ_localizator)
+
+
+def _load_dill(filename):
+    import dill
+    with open(filename, "rb") as f:
+        return dill.load(f)
+
+
+def get_intensity_model(
+        filename="~/lisa_data/liver_intensity.Model.p", fv_extern=None):
+    """
+    New imcut Model with trained classifiers loaded from file. The
+    classifiers are shared by all models created from the same file and they
+    should not be refitted.
+    """
+    from imcut import pycut
+    modelparams = {}
+    if fv_extern is not None:
+        modelparams["fv_extern"] = fv_extern
+    mdl = pycut.Model(modelparams)
+    sv = get(filename, _load_dill)
+    mdl.mdl = sv["mdl"]
+    mdl.modelparams["mdl_stored_file"] = filename
+    mdl.modelparams.update(sv["modelparams"])
+    return mdl
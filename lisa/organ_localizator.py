@@ -45,27 +45,21 @@ def localization_fv(data3d, voxelsize_mm):        # scale
         # position asdfas
         import body_navigation as bn
         ss = bn.BodyNavigation(data3d, voxelsize_mm)
-        fd1 = ss.dist_to_lungs().reshape(-1, 1)
-        fd2 = ss.dist_to_spine().reshape(-1, 1)
-        fd3 = ss.dist_sagittal().reshape(-1, 1)
-        fd4 = ss.dist_coronal().reshape(-1, 1)
-        fd5 = ss.dist_axial().reshape(-1, 1)
-        fd6 = ss.dist_to_surface().reshape(-1, 1)
-        fd7 = ss.dist_diaphragm().reshape(-1, 1)
 
         # f6 = scipy.ndimage.filters.gaussian_filter(data3d, sigma=[20, 1, 1]).reshape(-1, 1) - f0
         # f7 = scipy.ndimage.filters.gaussian_filter(data3d, sigma=[1, 20, 1]).reshape(-1, 1) - f0
         # f8 = scipy.ndimage.filters.gaussian_filter(data3d, sigma=[1, 1, 20]).reshape(-1, 1) - f0
 
-
-        # print "fv shapes ", f0.shape, fd2.shape, fd3.shape
-        fv = np.concatenate([
-                # f0,
-#                 f1, f2, f3, f4,
-                fd1, fd2, fd3, fd4, fd5, fd6, fd7,
-                #f6, f7, f8
-            ], 1)
-
+        # columns are written into preallocated float32 matrix
+        fv = ss.get_features([
+            'dist_to_lungs',
+            'dist_to_spine',
+            'dist_sagittal',
+            'dist_coronal',
+            'dist_axial',
+            'dist_to_surface',
+            'dist_diaphragm',
+        ])
 
         return fv
 
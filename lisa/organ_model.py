@@ -20,6 +20,7 @@ import sys
 import os.path as op
 sys.path.append(op.join(op.dirname(os.path.abspath(__file__)), "../../imcut/"))
 import argparse
+import contextlib
 import glob
 import traceback
 import numpy as np
@@ -68,6 +69,235 @@ def with_ribs_fv(data3dr, voxelsize_mm, seeds=None, unique_cls=None):        # s
     """
     pass
 
+class FeatureVectorPipeline():
+    """
+    Feature vectors for fv_extern functions with cached gaussian filtrations.
+
+    Filtrations and localizator features of the current volume are stored
+    and reused by following calls with the same volume. Pipeline keeps only a
+    reference to the volume, the volume should not be modified while the
+    pipeline is used. Features are the same as computed by the original
+    fv_extern functions. They are written as float32 columns into
+    preallocated matrix.
+
+    Use feature_cache() to share one pipeline by all fv_extern calls in a
+    block of code. The cached data are released at the end of the block.
+    """
+    def __init__(self, localizator_file="~/lisa_data/liver.ol.p"):
+        self.localizator_file = localizator_file
+        self.dtype = np.float32
+        self._organ_localizator = None
+        self.clear()
+
+    def clear(self):
+        """
+        Forget cached data of the current volume.
+        """
+        self._data = None
+        self._voxelsize_mm = None
+        self._gaussians = {}
+        self._localization = None
+        self._localizator_features = None
+        self._middle_organ_median = None
+
+    def _set_volume(self, data3dr, voxelsize_mm):
+        voxelsize_mm = tuple(np.asarray(voxelsize_mm, dtype=np.double).reshape(-1))
+        # the reference is held, so the identity of object cannot be reused
+        if data3dr is not self._data or voxelsize_mm != self._voxelsize_mm:
+            self.clear()
+            self._data = data3dr
+            self._voxelsize_mm = voxelsize_mm
+
+    def gaussian(self, data3dr, voxelsize_mm, sigma):
+        """
+        Gaussian filtration of data3dr. Output is cached. It has the dtype of
+        input data as scipy.ndimage.filters.gaussian_filter() output.
+        """
+        import scipy.ndimage
+
+        self._set_volume(data3dr, voxelsize_mm)
+        sigma = tuple(np.asarray(sigma, dtype=np.double) * np.ones(data3dr.ndim))
+        if sigma not in self._gaussians:
+            self._gaussians[sigma] = scipy.ndimage.filters.gaussian_filter(
+                data3dr, sigma=sigma)
+        return self._gaussians[sigma]
+
+    def get_organ_localizator(self):
+        if self._organ_localizator is None:
+            self._organ_localizator = load_organ_localizator(self.localizator_file)
+        return self._organ_localizator
+
+    def localization_features(self, data3dr, voxelsize_mm):
+        """
+        Features from organ_localizator.localization_fv(). Output is cached.
+        """
+        try:
+            from lisa import organ_localizator
+        except:
+            import organ_localizator
+
+        self._set_volume(data3dr, voxelsize_mm)
+        if self._localization is None:
+            self._localization = organ_localizator.localization_fv(
+                data3dr, voxelsize_mm)
+        return self._localization
+
+    def localizator_features(self, data3dr, voxelsize_mm):
+        """
+        Features from feature function of organ localizator. Output is
+        cached.
+        """
+        self._set_volume(data3dr, voxelsize_mm)
+        if self._localizator_features is None:
+            ol = self.get_organ_localizator()
+            self._localizator_features = ol.feature_function(data3dr, voxelsize_mm)
+        return self._localizator_features
+
+    def middle_organ_median(self, data3dr, voxelsize_mm, weight=0.85):
+        """
+        Median intensity in the middle of organ predicted by organ
+        localizator with ol.predict_w().
+        """
+        self._set_volume(data3dr, voxelsize_mm)
+        if self._middle_organ_median is None:
+            ol = self.get_organ_localizator()
+            if np.allclose(ol.working_voxelsize_mm, voxelsize_mm):
+                # predict_w() would not resize the data, cached features
+                # are used
+                scores = ol.cl.scores(self.localizator_features(data3dr, voxelsize_mm))
+                middle_organ = (scores[1] > (weight * scores[0])).reshape(data3dr.shape)
+            else:
+                middle_organ = ol.predict_w(data3dr, voxelsize_mm, weight)
+            self._middle_organ_median = np.median(data3dr[middle_organ == 1])
+        return self._middle_organ_median
+
+    def intensity_localization_fv(self, data3dr, voxelsize_mm, seeds=None, unique_cls=None):
+        columns = [
+            self.gaussian(data3dr, voxelsize_mm, 0.5),
+            self.gaussian(data3dr, voxelsize_mm, 3),
+        ]
+        columns.extend(_matrix_columns(
+            self.localization_features(data3dr, voxelsize_mm)))
+        return self._fill_feature_matrix(columns, seeds, unique_cls)
+
+    def near_blur_intensity_localization_fv(self, data3dr, voxelsize_mm, seeds=None, unique_cls=None):
+        f0 = self.gaussian(data3dr, voxelsize_mm, 0.5)
+        f1 = self.gaussian(data3dr, voxelsize_mm, 3)
+        fdall = self.localizator_features(data3dr, voxelsize_mm)
+        mn = self.middle_organ_median(data3dr, voxelsize_mm)
+        columns = [f0, f1] + _matrix_columns(fdall) + [
+            _Difference(self.gaussian(data3dr, voxelsize_mm, [20, 1, 1]), f1),
+            _Difference(self.gaussian(data3dr, voxelsize_mm, [1, 20, 1]), f1),
+            _Difference(self.gaussian(data3dr, voxelsize_mm, [1, 1, 20]), f1),
+            mn,
+        ]
+        return self._fill_feature_matrix(columns, seeds, unique_cls)
+
+    def intensity_localization_2steps_fv(self, data3dr, voxelsize_mm, seeds=None, unique_cls=None):
+        f0 = self.gaussian(data3dr, voxelsize_mm, 0.5)
+        f1 = self.gaussian(data3dr, voxelsize_mm, 3)
+        fdall = self.localizator_features(data3dr, voxelsize_mm)
+        mn = self.middle_organ_median(data3dr, voxelsize_mm)
+        columns = [f0, f1] + _matrix_columns(fdall) + [mn]
+        return self._fill_feature_matrix(columns, seeds, unique_cls)
+
+    def _fill_feature_matrix(self, columns, seeds=None, unique_cls=None):
+        """
+        Write columns into preallocated matrix. If seeds are given, only
+        the rows with seeds from unique_cls are computed.
+
+        :param columns: list of arrays with one value per voxel, _Difference
+            objects or scalars
+        """
+        n = self._data.size
+        selection = None
+        if seeds is not None:
+            sd = seeds.reshape(-1, 1)
+            selection = np.isin(sd.reshape(-1), unique_cls)
+            sd = sd[selection]
+            n = int(np.sum(selection))
+
+        fv = np.empty([n, len(columns)], dtype=self.dtype)
+        for i, column in enumerate(columns):
+            if np.isscalar(column):
+                fv[:, i] = column
+            elif isinstance(column, _Difference):
+                # difference in dtype of filtrations as in original features
+                fv[:, i] = _select(column.minuend, selection) - \
+                    _select(column.subtrahend, selection)
+            else:
+                fv[:, i] = _select(column, selection)
+
+        if seeds is not None:
+            return fv, sd
+        return fv
+
+
+class _Difference():
+    """
+    Lazy difference of two columns. It is evaluated directly in feature matrix.
+    """
+    def __init__(self, minuend, subtrahend):
+        self.minuend = minuend
+        self.subtrahend = subtrahend
+
+
+def _select(column, selection):
+    column = column.reshape(-1)
+    if selection is None:
+        return column
+    return column[selection]
+
+
+def _matrix_columns(matrix):
+    return [matrix[:, i] for i in range(matrix.shape[1])]
+
+
+def load_organ_localizator(filename="~/lisa_data/liver.ol.p"):
+    """
+    Load organ localizator from file. Each file is loaded only once, until it
+    is modified. See model_registry.
+    """
+    try:
+        from lisa import model_registry
+    except:
+        import model_registry
+
+    return model_registry.get_organ_localizator(filename)
+
+
+_active_pipelines = []
+
+
+@contextlib.contextmanager
+def feature_cache(pipeline=None):
+    """
+    All fv_extern calls in the block share one FeatureVectorPipeline. Cached
+    filtrations are released at the end of the block.
+
+        with organ_model.feature_cache():
+            igc.run()
+    """
+    if pipeline is None:
+        pipeline = FeatureVectorPipeline()
+    _active_pipelines.append(pipeline)
+    try:
+        yield pipeline
+    finally:
+        _active_pipelines.pop()
+        pipeline.clear()
+
+
+def get_feature_vector_pipeline():
+    """
+    Pipeline of the innermost feature_cache() block. New pipeline (nothing
+    cached between calls) is returned outside of the block.
+    """
+    if len(_active_pipelines) > 0:
+        return _active_pipelines[-1]
+    return FeatureVectorPipeline()
+
+
 def near_blur_intensity_localization_fv(data3dr, voxelsize_mm, seeds=None, unique_cls=None):        # scale
     """
     Use organ_localizator features plus intensity features
@@ -78,70 +308,8 @@ def near_blur_intensity_localization_fv(data3dr, voxelsize_mm, seeds=None, uniqu
     :param unique_cls:
     :return:
     """
-    import scipy
-    import numpy as np
-    import os.path as op
-    try:
-        from lisa import organ_localizator
-    except:
-        import organ_localizator
-
-    #         print "po importech"
-    fv = []
-    f0 = scipy.ndimage.filters.gaussian_filter(data3dr, sigma=0.5).reshape(-1, 1)
-    f1 = scipy.ndimage.filters.gaussian_filter(data3dr, sigma=3).reshape(-1, 1)
-    #f2 = scipy.ndimage.filters.gaussian_filter(data3dr, sigma=5).reshape(-1, 1) - f0
-    #f3 = scipy.ndimage.filters.gaussian_filter(data3dr, sigma=10).reshape(-1, 1) - f0
-    #f4 = scipy.ndimage.filters.gaussian_filter(data3dr, sigma=20).reshape(-1, 1) - f0
-    # position
-    #ss = lisa.body_navigation.BodyNavigation(data3dr, voxelsize_mm)
-    #ss.feature_function(data3d, voxelsize_mm)
-    #fd1 = ss.dist_to_lungs().reshape(-1, 1)
-    #fd2 = ss.dist_to_spine().reshape(-1, 1)
-    #fd3 = ss.dist_sagittal().reshape(-1, 1)
-    #fd4 = ss.dist_coronal().reshape(-1, 1)
-    #fd5 = ss.dist_to_surface().reshape(-1, 1)
-    #fd6 = ss.dist_diaphragm().reshape(-1, 1)
-
-    #         print "pred f6"
-    f6 = scipy.ndimage.filters.gaussian_filter(data3dr, sigma=[20, 1, 1]).reshape(-1, 1) - f1
-    f7 = scipy.ndimage.filters.gaussian_filter(data3dr, sigma=[1, 20, 1]).reshape(-1, 1) - f1
-    f8 = scipy.ndimage.filters.gaussian_filter(data3dr, sigma=[1, 1, 20]).reshape(-1, 1) - f1
-
-    #         print "pred organ_localizator"
-    ol = organ_localizator.OrganLocalizator()
-    ol.load(op.expanduser("~/lisa_data/liver.ol.p"))
-
-    fdall = ol.feature_function(data3dr, voxelsize_mm)
-
-
-    middle_liver = ol.predict_w(data3dr, voxelsize_mm, 0.85)
-    mn = np.median(data3dr[middle_liver==1])
-    fdn = np.ones(f0.shape) * mn
-
-
-    # print "fv shapes ", f0.shape, fd2.shape, fd3.shape
-    fv = np.concatenate([
-        f0,
-        f1,
-        #                 f2, f3, f4,
-        #                 fd1, fd2, fd3, fd4, fd5, fd6,
-        fdall,
-        f6, f7, f8,
-        fdn,
-
-    ], 1)
-    if seeds is not None:
-        #             logger.debug("seeds " + str(seeds))
-        #             print "seeds ", seeds
-        sd = seeds.reshape(-1,1)
-        selection = np.in1d(sd, unique_cls)
-        fv = fv[selection]
-        sd = sd[selection]
-        # sd = sd[]
-        return fv, sd
-
-    return fv
+    return get_feature_vector_pipeline().near_blur_intensity_localization_fv(
+        data3dr, voxelsize_mm, seeds=seeds, unique_cls=unique_cls)
 
 def localization_fv(data3dr, voxelsize_mm, seeds=None, unique_cls=None):        # scale
     import scipy
@@ -198,40 +366,9 @@ def intensity_localization_fv(data3dr, voxelsize_mm, seeds=None, unique_cls=None
     :param unique_cls:
     :return:
     """
-    import scipy
-    import numpy as np
-    import os.path as op
-    try:
-        from lisa import organ_localizator
-    except:
-        import organ_localizator
-
-    f0 = scipy.ndimage.filters.gaussian_filter(data3dr, sigma=0.5).reshape(-1, 1)
-    f1 = scipy.ndimage.filters.gaussian_filter(data3dr, sigma=3).reshape(-1, 1)
-    import organ_localizator
-    fvall = organ_localizator.localization_fv(data3dr, voxelsize_mm)
-    # fvall = organ_localizator.localization_intensity_fv(data3dr, voxelsize_mm)
-
+    return get_feature_vector_pipeline().intensity_localization_fv(
+        data3dr, voxelsize_mm, seeds=seeds, unique_cls=unique_cls)
 
-    fv = np.concatenate([
-        f0,
-        f1,
-        # f2, f3, # f4,
-        #                 fd1, fd2, fd3, fd4, fd5, fd6,
-        fvall,
-        # f6, f7, f8,
-    ], 1)
-    if seeds is not None:
-        #             logger.debug("seeds " + str(seeds))
-        #             print "seeds ", seeds
-        sd = seeds.reshape(-1,1)
-        selection = np.in1d(sd, unique_cls)
-        fv = fv[selection]
-        sd = sd[selection]
-        # sd = sd[]
-        return fv, sd
-
-    return fv
 
 def intensity_localization_2steps_fv(data3dr, voxelsize_mm, seeds=None, unique_cls=None):        # scale
     """
@@ -243,70 +380,8 @@ def intensity_localization_2steps_fv(data3dr, voxelsize_mm, seeds=None, unique_c
     :param unique_cls:
     :return:
     """
-    import scipy
-    import numpy as np
-    import os.path as op
-    try:
-        from lisa import organ_localizator
-    except:
-        import organ_localizator
-
-#         print "po importech"
-    fv = []
-    f0 = scipy.ndimage.filters.gaussian_filter(data3dr, sigma=0.5).reshape(-1, 1)
-    f1 = scipy.ndimage.filters.gaussian_filter(data3dr, sigma=3).reshape(-1, 1)
-    # f2 = scipy.ndimage.filters.gaussian_filter(data3dr, sigma=5).reshape(-1, 1) - f0
-    # f3 = scipy.ndimage.filters.gaussian_filter(data3dr, sigma=10).reshape(-1, 1) - f0
-    # f4 = scipy.ndimage.filters.gaussian_filter(data3dr, sigma=20).reshape(-1, 1) - f0
-    # position
-    #ss = lisa.body_navigation.BodyNavigation(data3dr, voxelsize_mm)
-    #ss.feature_function(data3d, voxelsize_mm)
-    #fd1 = ss.dist_to_lungs().reshape(-1, 1)
-    #fd2 = ss.dist_to_spine().reshape(-1, 1)
-    #fd3 = ss.dist_sagittal().reshape(-1, 1)
-    #fd4 = ss.dist_coronal().reshape(-1, 1)
-    #fd5 = ss.dist_to_surface().reshape(-1, 1)
-    #fd6 = ss.dist_diaphragm().reshape(-1, 1)
-
-#         print "pred f6"
-#     f6 = scipy.ndimage.filters.gaussian_filter(data3dr, sigma=[10, 1, 1]).reshape(-1, 1) - f1
-#     f7 = scipy.ndimage.filters.gaussian_filter(data3dr, sigma=[1, 10, 1]).reshape(-1, 1) - f1
-#     f8 = scipy.ndimage.filters.gaussian_filter(data3dr, sigma=[1, 1, 10]).reshape(-1, 1) - f1
-
-#         print "pred organ_localizator"
-    ol = organ_localizator.OrganLocalizator()
-    ol.load(op.expanduser("~/lisa_data/liver.ol.p"))
-
-    fdall = ol.feature_function(data3dr, voxelsize_mm)
-
-
-    middle_liver = ol.predict_w(data3dr, voxelsize_mm, 0.85)
-    mn = np.median(data3dr[middle_liver==1])
-    fdn = np.ones(f0.shape) * mn
-
-
-    # print "fv shapes ", f0.shape, fd2.shape, fd3.shape
-    fv = np.concatenate([
-            f0,
-            f1,
-                # f2, f3, # f4,
-#                 fd1, fd2, fd3, fd4, fd5, fd6,
-            fdall,
-            # f6, f7, f8,
-            fdn,
-
-        ], 1)
-    if seeds is not None:
-#             logger.debug("seeds " + str(seeds))
-#             print "seeds ", seeds
-        sd = seeds.reshape(-1,1)
-        selection = np.in1d(sd, unique_cls)
-        fv = fv[selection]
-        sd = sd[selection]
-        # sd = sd[]
-        return fv, sd
-
-    return fv
+    return get_feature_vector_pipeline().intensity_localization_2steps_fv(
+        data3dr, voxelsize_mm, seeds=seeds, unique_cls=unique_cls)
 
 class ModelTrainer():
     def __init__(self, feature_function=None, modelparams={}):
@@ -365,7 +440,7 @@ class ModelTrainer():
 
     def predict(self, data3d, voxelsize_mm):
         data3dr = io3d.misc.resize_to_mm(data3d, voxelsize_mm, self.working_voxelsize_mm)
-        fv = self._fv(data3dr)
+        fv = self._fv(data3dr, self.working_voxelsize_mm)
 #         print "shape predict ", fv.shape,
         pred = self.cl.predict(fv)
 #         print "predict ", pred.shape,
@@ -373,7 +448,7 @@ class ModelTrainer():
 
     def scores(self, data3d, voxelsize_mm):
         data3dr = io3d.misc.resize_to_mm(data3d, voxelsize_mm, self.working_voxelsize_mm)
-        fv = self._fv(data3dr)
+        fv = self._fv(data3dr, self.working_voxelsize_mm)
 #         print "shape predict ", fv.shape,
         scoreslin = self.cl.scores(fv)
         scores = {}
@@ -20,6 +20,7 @@ import scipy
 import imtools
 
 from . import organ_model
+from . import model_registry
 from . import data_manipulation
 
 
@@ -30,16 +31,18 @@ def automatic_liver_seeds(
         fn_mdl='~/lisa_data/liver_intensity.Model.p',
         return_likelihood_difference=True,
         gaussian_sigma_mm=[20,20,20]):
-    from imcut import pycut
     # fn_mdl = op.expanduser(fn_mdl)
-    mdl = pycut.Model({'mdl_stored_file':fn_mdl, 'fv_extern': organ_model.intensity_localization_fv})
+    # model file is loaded only once per process
+    mdl = model_registry.get_intensity_model(
+        fn_mdl, fv_extern=organ_model.intensity_localization_fv)
     working_voxelsize_mm = np.asarray([1.5, 1.5, 1.5])
     gaussian_sigma_mm = np.asarray(gaussian_sigma_mm)
 
     data3dr = imtools.resize_to_mm(data3d, voxelsize_mm, working_voxelsize_mm)
 
-    lik1 = mdl.likelihood_from_image(data3dr, working_voxelsize_mm, 0)
-    lik2 = mdl.likelihood_from_image(data3dr, working_voxelsize_mm, 1)
+    with model_registry.measure(fn_mdl):
+        lik1, lik2 = likelihoods_from_image(
+            mdl, data3dr, working_voxelsize_mm, [0, 1])
 
     dl = lik2 - lik1
 
@@ -91,6 +94,18 @@ def automatic_liver_seeds(
         return seeds
 
 
+def likelihoods_from_image(mdl, data3d, voxelsize_mm, classes):
+    """
+    Compute likelihoods of all classes. Feature vector is computed only once.
+
+    :param mdl: trained pycut.Model
+    :param classes: list of class indexes
+    :return: list of likelihood images with same shape as data3d
+    """
+    fv = mdl.features_from_image(data3d, voxelsize_mm)
+    return [mdl.likelihood(fv, cl).reshape(data3d.shape) for cl in classes]
+
+
 def add_negative_notrain_seeds(seeds,lik1, lik2, alpha=1.3):
     """
 
@@ -125,40 +140,55 @@ def add_negative_train_seeds_blobs(
         mask_voxelsize_mm,
         seeds_voxelsize_mm,
         seed1z_mm, n_seed_blob=1):
-    dll = mask_working
+    """
+    Add n_seed_blob circle seeds into slice seed1z_mm. Seeds are placed into
+    the most distant points from mask border.
+
+    Distance transform is computed only on selected slice. After every blob
+    the distance map is updated with distance from the new blob center.
+    Distances are measured in pixels of mask_working.
+    """
+    mask_voxelsize_mm = np.asarray(mask_voxelsize_mm)
+    # na nasem rezu
+    seed1z_px_mask = int(seed1z_mm / mask_voxelsize_mm[0])
 
+    dll = mask_working[seed1z_px_mask, :, :].copy()
     # aby se pocitalo i od okraju obrazku
-    dll[0,:,:] = 0
-    dll[:,0,:] = 0
-    dll[:,:,0] = 0
-    dll[-1,:,:] = 0
-    dll[:,-1,:] = 0
-    dll[:,:,-1] = 0
+    if seed1z_px_mask in (0, mask_working.shape[0] - 1):
+        dll[:, :] = 0
+    dll[0, :] = 0
+    dll[:, 0] = 0
+    dll[-1, :] = 0
+    dll[:, -1] = 0
+
+    dstslice = scipy.ndimage.morphology.distance_transform_edt(dll)
+    grid = np.mgrid[:dll.shape[0], :dll.shape[1]]
+    seeds2_mm = []
     for i in range(0, n_seed_blob):
-
-        dst = scipy.ndimage.morphology.distance_transform_edt(dll)
-        # na nasem rezu
-        seed1z_px_mask = int(seed1z_mm/ mask_voxelsize_mm[0])
-        seed1z_px_seeds= int(seed1z_mm/ seeds_voxelsize_mm[0])
-
-        dstslice = dst[seed1z_px_mask, :, :]
         seed2xy = np.unravel_index(np.argmax(dstslice), dstslice.shape)
         # import PyQt4; PyQt4.QtCore.pyqtRemoveInputHook()
         # import ipdb; ipdb.set_trace()
         seed2 = np.array([seed1z_px_mask, seed2xy[0], seed2xy[1]])
-        seed2_mm = seed2 * mask_voxelsize_mm
-
-        seeds = data_manipulation.add_seeds_mm(
-                seeds, seeds_voxelsize_mm,
-                [seed2_mm[0]],
-                [seed2_mm[1]],
-                [seed2_mm[2]],
-                label=2,
-                radius=20,
-                width=1
-        )
+        seeds2_mm.append(seed2 * mask_voxelsize_mm)
+
         # for next iteration add hole where this blob is
-        dll[seed1z_px_mask, seed2xy[0], seed2xy[1]] = 0
+        dist_to_blob = np.sqrt(
+            (grid[0] - seed2xy[0]) ** 2 + (grid[1] - seed2xy[1]) ** 2)
+        dstslice = np.minimum(dstslice, dist_to_blob)
+
+    # all blobs are in one slice
+    seeds2_mm = np.asarray(seeds2_mm).reshape(-1, 3)
+    seeds = data_manipulation.add_seeds_mm(
+            seeds, seeds_voxelsize_mm,
+            seeds2_mm[:1, 0],
+            seeds2_mm[:, 1],
+            seeds2_mm[:, 2],
+            label=2,
+            radius=20,
+            width=1
+    )
+    return seeds
+
 
 def main():
     logger = logging.getLogger()
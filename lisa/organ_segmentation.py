@@ -66,6 +66,7 @@ from . import support_structure_segmentation as sss
 from . import config_default
 from . import organ_seeds
 from . import lisa_data
+from . import lisa_container
 from . import data_manipulation
 from . import qmisc
 from . import misc
@@ -122,6 +123,31 @@ def printTotals(transferred, toBeTransferred):
     print("Transferred: {0}\tOut of: {1}".format(transferred, toBeTransferred))
 
 
+def read_dataplus(datapath):
+    """
+    Read dataplus from LISA container or from any format known by io3d.
+    Arrays from container are opened lazily, they are read (or
+    memory-mapped if stored uncompressed) in import_dataplus().
+    """
+    if lisa_container.is_container(datapath):
+        return lisa_container.read(datapath, lazy=True)
+    reader = datareader.DataReader()
+    return reader.Get3DData(datapath, dataplus_format=True)
+
+
+def _label_to_number(slab, label):
+    """
+    Numeric value of label. Labels which are not in slab are added as in
+    OrganSegmentation.nlabels().
+    """
+    if not isinstance(label, str):
+        label = int(label)
+    nlabel = ima.get_nlabels(slab, label)
+    if nlabel < 0:
+        raise ValueError("Negative label is not supported: " + str(label))
+    return nlabel
+
+
 class OrganSegmentation():
     """
     Main object of Lisa user interface.
@@ -166,6 +192,7 @@ class OrganSegmentation():
             lisa_operator_identifier='',
             volume_unit='ml',
             save_filetype='pklz',
+            save_compression='zlib',
             debug_mode=False,
             seg_postproc_pars={},
             cache_filename='cache.yml',
@@ -204,6 +231,9 @@ class OrganSegmentation():
         working only if smoothing is turned on.
         :param seg_postproc_pars: Can be used for setting postprocessing
         parameters. For example
+        :param seg_preproc_pars: Preprocessing parameters. With
+        'roi_margin_mm' set to number only bounding box of seeds enlarged by
+        this margin is segmented.
         :param segmentation_alternative_params: dict of alternative params f,e.
         {'vs5: {'voxelsize_mm':[5,5,5]}, 'vs3: {'voxelsize_mm':[3,3,3]}}
         :param input_annotation_file: annotation input based on dwv json export (https://github.com/ivmartel/dwv)
@@ -260,6 +290,7 @@ class OrganSegmentation():
         self.organ_interactivity_counter = 0
         self.dcmfilelist = None
         self.save_filetype = save_filetype
+        self.save_compression = save_compression
         self.vessel_tree = {}
         self.debug_mode = debug_mode
         self.gui_update = None
@@ -290,6 +321,7 @@ class OrganSegmentation():
         self.seg_postproc_pars.update(seg_postproc_pars)
         self.seg_preproc_pars = {
             'use_automatic_segmentation': True,
+            'roi_margin_mm': None,
         }
         self.seg_preproc_pars.update(seg_preproc_pars)
         self.after_load_processing = {
@@ -297,6 +329,8 @@ class OrganSegmentation():
         }
         self.after_load_processing.update(after_load_processing)
         self.apriori = None
+        # region of data3d resampled for the current segmentation step
+        self._working_roi = None
         # seg_postproc_pars.update(seg_postproc_pars)
         # import ipdb; ipdb.set_trace() #  noqa BREAKPOINT
 
@@ -321,8 +355,7 @@ class OrganSegmentation():
             #     datapath = self.iparams['datapath']
 
             if datapath is not None:
-                reader = datareader.DataReader()
-                datap = reader.Get3DData(datapath, dataplus_format=True)
+                datap = read_dataplus(datapath)
                 # self.iparams['series_number'] = metadata['series_number']
                 # self.iparams['datapath'] = datapath
                 self.import_dataplus(datap)
@@ -421,11 +454,11 @@ class OrganSegmentation():
         # sseg.lungs_segmentation()
         # sseg.heart_segmentation()
 
-        # TODO remove hack - force remove number 1 from segmentation
-        # this sould be fixed in sss
-        sseg.segmentation[sseg.segmentation == 1] = 0
         self.segmentation = sseg.segmentation
         self.slab = sseg.slab
+        # TODO remove hack - force remove number 1 from segmentation
+        # this sould be fixed in sss
+        self.relabel_segmentation({1: 0})
 
     def __clean_oseg_input_params(self, oseg_params):
         """
@@ -475,10 +508,8 @@ class OrganSegmentation():
     def load_data(self, datapath):
         self.datapath = datapath
 
-        reader = datareader.DataReader()
-
         # seg.data3d, metadata =
-        datap = reader.Get3DData(self.datapath, dataplus_format=True)
+        datap = read_dataplus(self.datapath)
         # rint datap.keys()
         # self.iparams['series_number'] = self.metadata['series_number']
         # self.iparams['datapath'] = self.datapath
@@ -601,7 +632,7 @@ class OrganSegmentation():
         datap.update(dataplus)
 
         dpkeys = datap.keys()
-        self.data3d = datap['data3d']
+        self.data3d = np.asarray(datap['data3d'])
 
         if self.roi is not None:
             self.crop(self.roi)
@@ -620,14 +651,14 @@ class OrganSegmentation():
             self.slab = datap['slab']
 
         if ('segmentation' in dpkeys) and datap['segmentation'] is not None:
-            self.segmentation = datap['segmentation']
+            self.segmentation = np.asarray(qmisc.todense(datap['segmentation']))
         else:
             self.segmentation = np.zeros(self.data3d.shape, dtype=np.int8)
         if 'vessel_tree' in dpkeys:
             self.vessel_tree = datap['vessel_tree']
 
         if ('apriori' in dpkeys) and datap['apriori'] is not None:
-            self.apriori = datap['apriori']
+            self.apriori = np.asarray(qmisc.todense(datap['apriori']))
         else:
             self.apriori = None
 
@@ -658,8 +689,11 @@ class OrganSegmentation():
         :type self: seeds are changed
         """
         try:
-            self.seeds = datap['processing_information'][
-                'organ_segmentation']['seeds']
+            seeds = qmisc.todense(datap['processing_information'][
+                'organ_segmentation']['seeds'])
+            if seeds is not None:
+                seeds = np.asarray(seeds)
+            self.seeds = seeds
         except:
             logger.info('seeds not found in dataplus')
             # if dicomdir is readed after something with seeds, seeds needs to be reseted
@@ -753,22 +787,22 @@ class OrganSegmentation():
         if self.segmentation is None:
             self.segmentation = np.zeros_like(self.data3d, dtype=np.int8)
 
-        data3d_tmp = self.data3d
-        if self.seg_preproc_pars['use_automatic_segmentation']:
-            data3d_tmp = self.data3d.copy()
-            data3d_tmp[(self.segmentation > 0) & (self.segmentation != self.output_label)] = -1000
+        # only region of interest is resampled to working resolution
+        roi = self._get_working_roi()
+        self._working_roi = roi
+        data3d_roi = self.data3d[roi]
 
         # print 'zoom ', self.zoom
         # print 'svs_mm ', self.working_voxelsize_mm
         self.zoom = self.voxelsize_mm / (1.0 * self.working_voxelsize_mm)
-        import warnings
-        warnings.filterwarnings('ignore', '.*output shape of zoom.*')
-        data3d_res = scipy.ndimage.zoom(
-            self.data3d,
-            self.zoom,
-            mode='nearest',
-            order=1
+        shape_res = np.round(
+            np.asarray(data3d_roi.shape) * self.zoom).astype(int)
+        data3d_res = data_manipulation.resize_linear(
+            data3d_roi.astype(np.float32), shape_res
         ).astype(np.int16)
+        # seeds and apriori are resized on the same grid
+        resize_idx = np.ix_(*data_manipulation.resize_indexes(
+            data3d_roi.shape, shape_res))
 
         logger.debug('pycut segparams ' + str(self.segparams) +
                      '\nmodelparams ' + str(self.segmodelparams)
@@ -798,11 +832,7 @@ class OrganSegmentation():
                 voxelsize=self.working_voxelsize_mm,
             )
         if self.apriori is not None:
-            apriori_res = misc.resize_to_shape(
-                # seeds_res = scipy.ndimage.zoom(
-                self.apriori,
-                data3d_res.shape,
-            )
+            apriori_res = self.apriori[roi][resize_idx]
             igc.apriori = apriori_res
 
         # igc.modelparams = self.segmodelparams
@@ -813,14 +843,7 @@ class OrganSegmentation():
         #        }
         # if self.iparams['seeds'] is not None:
         if self.seeds is not None:
-            seeds_res = misc.resize_to_shape(
-                # seeds_res = scipy.ndimage.zoom(
-                self.seeds,
-                data3d_res.shape,
-                mode='nearest',
-                order=0
-            )
-            seeds_res = seeds_res.astype(np.int8)
+            seeds_res = self.seeds[roi][resize_idx].astype(np.int8)
             igc.set_seeds(seeds_res)
 
         # tohle je tu pro to, aby bylo možné přidávat nově objevené segmentace k těm starým
@@ -862,18 +885,45 @@ class OrganSegmentation():
         sftp.sync(localto, remoteto, download=False, exclude=exclude, delete=False, callback=callback)
         logger.info("Upload finished")
 
+    def _get_working_roi(self):
+        """
+        Region of interest for segmentation in working resolution. It is
+        bounding box of seeds and apriori with margin
+        seg_preproc_pars['roi_margin_mm']. Whole volume is used if margin is
+        None.
+
+        :return: tuple of slices
+        """
+        margin_mm = self.seg_preproc_pars.get('roi_margin_mm', None)
+        full = tuple([slice(None)] * self.data3d.ndim)
+        if margin_mm is None or self.seeds is None:
+            return full
+        mask = self.seeds > 0
+        if self.apriori is not None:
+            mask = mask | (self.apriori > 0)
+        margin = np.ceil(
+            np.asarray(margin_mm, dtype=float) /
+            np.asarray(self.voxelsize_mm, dtype=float)).astype(int)
+        return data_manipulation.bbox_slices(mask, margin)
+
     def __resize_to_orig(self, igc_seeds):
-        # @TODO remove old code in except part
-        self.segmentation = misc.resize_to_shape(
-            self.segmentation,
-            self.data3d.shape,
-            self.zoom
-        )
-        self.seeds = misc.resize_to_shape(
-            igc_seeds,
-            self.data3d.shape,
-            self.zoom
-        ).astype(np.uint8)
+        # segmentation and seeds are in working resolution of the region
+        # stored by _interactivity_begin()
+        roi = self._working_roi
+        roi_shape = self.data3d[roi].shape
+        resize_idx = np.ix_(*data_manipulation.resize_indexes(
+            igc_seeds.shape, roi_shape))
+
+        segmentation = np.zeros(self.data3d.shape, dtype=np.int8)
+        segmentation[roi] = self.segmentation[resize_idx]
+        self.segmentation = segmentation
+
+        if self.seeds is None or self.seeds.shape != self.data3d.shape:
+            self.seeds = np.zeros(self.data3d.shape, dtype=np.uint8)
+        else:
+            self.seeds = self.seeds.astype(np.uint8, copy=False)
+        self.seeds[roi] = igc_seeds[resize_idx]
+        self._working_roi = None
 
     #         try:
     #             # rint 'pred vyjimkou'
@@ -1151,10 +1201,13 @@ class OrganSegmentation():
         from imcut import pycut
         """Function for automatic (noninteractiv) mode."""
         # mport pdb; pdb.set_trace()
+        from . import organ_model
         igc = self._interactivity_begin()
         # gc.interactivity()
         # igc.make_gc()
-        igc.run()
+        # feature vectors are computed once for all graph cut steps
+        with organ_model.feature_cache():
+            igc.run()
         if 'method' not in self.segparams.keys() or \
  \
                 self.segparams['method'] in pycut.methods:
@@ -1177,7 +1230,8 @@ class OrganSegmentation():
         data['data3d'] = self.data3d
         data['crinfo'] = self.crinfo
         data['segmentation'] = self.segmentation
-        data['apriori'] = self.apriori
+        # seeds and apriori are mostly empty
+        data['apriori'] = qmisc.sparse_if_mostly_empty(self.apriori)
         data['slab'] = slab
         data['voxelsize_mm'] = self.voxelsize_mm
         data['orig_shape'] = self.orig_shape
@@ -1189,7 +1243,7 @@ class OrganSegmentation():
                 'oseg_input_params': self.oseg_input_params,
                 'organ_interactivity_counter':
                     self.organ_interactivity_counter,
-                'seeds': self.seeds  # qmisc.SparseMatrix(self.seeds)
+                'seeds': qmisc.sparse_if_mostly_empty(self.seeds)
             }
         }
         data['processing_information'] = processing_information
@@ -1272,9 +1326,61 @@ class OrganSegmentation():
         :param to_label: int or string
         :return:
         """
-        from_label = self.nlabels(from_label)
-        to_label = self.nlabels(to_label)
-        self.segmentation[self.segmentation == from_label] = to_label
+        self.relabel_segmentation({from_label: to_label})
+
+    def relabel_segmentation(self, mapping):
+        """
+        Relabel segmentation in one pass.
+
+        :param mapping: dict {from_label: to_label}, labels can be int or
+        string. New string labels are added into slab.
+        """
+        slab = dict(self.slab)
+        mapping = [
+            (_label_to_number(slab, from_label),
+             _label_to_number(slab, to_label))
+            for from_label, to_label in mapping.items()
+        ]
+        max_label = max([self.segmentation.max()] +
+                        [lab for pair in mapping for lab in pair])
+        self._prepare_segmentation_dtype(max_label)
+        lut = np.arange(max_label + 1)
+        for from_label, to_label in mapping:
+            lut[from_label] = to_label
+        data_manipulation.apply_label_lut(self.segmentation, lut)
+        self.slab.update(slab)
+
+    def write_label_image(self, label_image, label_map):
+        """
+        Write labels into segmentation in one pass. Only bounding box of
+        nonzero label_image is processed.
+
+        :param label_image: integer image with same shape as segmentation
+        :param label_map: dict {value in label_image: label}. Label can be int
+        or string. New labels are added into slab. Values of label_image
+        which are not in label_map are ignored. Negative values are not
+        supported.
+        """
+        slab = dict(self.slab)
+        keys = sorted(label_map.keys())
+        if len(keys) > 0 and keys[0] < 0:
+            raise ValueError("Negative value in label_map: " + str(keys[0]))
+        new_labels = [_label_to_number(slab, label_map[key]) for key in keys]
+        lut = -np.ones(max(keys + [np.max(label_image)]) + 1, dtype=int)
+        lut[keys] = new_labels
+        self._prepare_segmentation_dtype(max(new_labels + [0]))
+        data_manipulation.write_labels(self.segmentation, label_image, lut)
+        self.slab.update(slab)
+
+    def _prepare_segmentation_dtype(self, max_label):
+        """
+        Change dtype of segmentation if max_label does not fit into it.
+        """
+        dtype = self.segmentation.dtype
+        if max_label > np.iinfo(dtype).max:
+            dtype = np.promote_types(dtype, np.min_scalar_type(max_label))
+            logger.debug("segmentation dtype changed to " + str(dtype))
+            self.segmentation = self.segmentation.astype(dtype)
 
     def portalVeinSegmentation(self, inner_vessel_label="porta", organ_label="liver", outer_vessel_label=None,
                                forbidden_label=None, threshold=None, interactivity=True, seeds=None, **inparams):
@@ -1340,8 +1446,11 @@ class OrganSegmentation():
         # from PyQt4.QtCore import pyqtRemoveInputHook
         # pyqtRemoveInputHook()
         # import ipdb; ipdb.set_trace()
-        self.segmentation[(outputSegmentation == 1) & (target_segmentation == 1)] = self.nlabels(inner_vessel_label)
-        self.segmentation[(outputSegmentation == 1) & (target_segmentation == 0)] = self.nlabels(outer_vessel_label)
+        # 1 is inner vessel, 2 is outer vessel
+        vessel_labels = (outputSegmentation == 1).astype(np.int8)
+        vessel_labels[target_segmentation == 0] *= 2
+        self.write_label_image(
+            vessel_labels, {1: inner_vessel_label, 2: outer_vessel_label})
 
         # self.__vesselTree(outputSegmentation, 'porta')
 
@@ -1444,13 +1553,21 @@ class OrganSegmentation():
         # save renamed file too
         filename = '' + filename + suffix + '.' + filetype
         filepath = op.join(output_dir, filename)
-        filepath = misc.suggest_filename(filepath)
+        if filetype != "lisa":
+            # LISA container is updated in place, only changed chunks are
+            # rewritten
+            filepath = misc.suggest_filename(filepath)
 
         return filepath
 
     def save_outputs(self, filepath=None):
         """ Save input data, segmentation and all other metadata to file.
 
+        If filepath ends with ".lisa", LISA container is used. Saving into
+        existing container rewrites only changed chunks. Compression of
+        container is given by save_compression ("zlib" or None for
+        memory-mappable arrays).
+
         :param filepath:
         :return:
         """
@@ -1466,7 +1583,13 @@ class OrganSegmentation():
         # import ipdb; ipdb.set_trace()
         import io3d
         logger.debug("save outputs to file %s" % (filepath))
-        io3d.write(data, filepath)
+        if op.splitext(filepath)[1] == ".lisa":
+            compression = self.save_compression
+            if compression in ("none", "None", ""):
+                compression = None
+            lisa_container.write(data, filepath, compression=compression)
+        else:
+            io3d.write(data, filepath)
 
         if self.output_annotaion_file is not None:
             self.json_annotation_export()
@@ -1563,8 +1686,9 @@ class OrganSegmentation():
         # if split_label2 is None:
         #     split_label2 = self.nlabels(organ_label, return_mode="str") + "2"
         #     # split_label2 = self.nlabels(split_label2)
-        for i in range(len(split_labels)):
-            self.segmentation[split == (i + 1)] = self.nlabels(split_labels[i])
+        self.write_label_image(
+            split,
+            dict((i + 1, split_labels[i]) for i in range(len(split_labels))))
         # self.segmentation[split == 1] = self.nlabels(split_label1)
         # self.segmentation[split == 2] = self.nlabels(split_label2)
 
@@ -1724,8 +1848,11 @@ class OrganSegmentation():
         # segm = imtools.show_segmentation.select_labels(segmentation=self.segmentation, labels=labels)
         # self.
 
-    def make_run(self):
+    def make_run(self, output_filepath=None):
         """ Non-interactive mode
+
+        :param output_filepath: output file, standard output filename is used
+        if it is None
         :return:
         """
         if self.input_annotaion_file is not None:
@@ -1744,7 +1871,7 @@ class OrganSegmentation():
             data['slab'] = self.slab
             self.portalVeinSegmentation(**self.run_vessel_segmentation_params)
 
-        self.save_outputs()
+        self.save_outputs(output_filepath)
 
     def split_vessel(self, input_label=None, output_label1=1, output_label2=2, **kwargs):
         """
@@ -1810,6 +1937,7 @@ class OrganSegmentation():
             organ_label=organ_label,
             seed_label1=seed_label1,
             seed_label2=seed_label2,
+            return_distances=False,
             **kwargs)
         # import sed3
         # ed = sed3.sed3(segm)
@@ -2042,8 +2170,13 @@ config and user config.")
     )
     parser.add_argument(
         '--save_filetype', type=str,  # type=int,
-        help='File type of saving data. It can be pklz(default), pkl or mat',
+        help='File type of saving data. It can be pklz(default), pkl, mat or lisa',
         default=cfg["save_filetype"])
+    parser.add_argument(
+        '--save_compression', type=str,
+        help='Compression of LISA container. It can be zlib(default) or none' +
+        ' for memory-mappable data',
+        default=cfg["save_compression"])
 
     args_obj = parser.parse_args()
 
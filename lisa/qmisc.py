@@ -21,17 +21,42 @@ from imtools.image_manipulation import crinfo_from_specific_data, crop, uncrop,
 
 
 class SparseMatrix():
+    """
+    Compact storage of mostly empty volume. Nonzero voxels are stored as
+    runs of the same value in flattened (C order) array.
+    """
     def __init__(self, ndarray):
-        self.coordinates = ndarray.nonzero()
+        ndarray = np.asarray(ndarray)
         self.shape = ndarray.shape
-        self.values = ndarray[self.coordinates]
         self.dtype = ndarray.dtype
         self.sparse = True
+        flat = ndarray.ravel()
+        if flat.size == 0:
+            starts = np.zeros([0], dtype=np.int64)
+        else:
+            starts = np.concatenate(
+                [[0], np.flatnonzero(flat[1:] != flat[:-1]) + 1])
+        stops = np.append(starts[1:], flat.size)
+        values = flat[starts]
+        nonzero = values != 0
+        self.starts = starts[nonzero]
+        self.lengths = (stops - starts)[nonzero]
+        self.values = values[nonzero]
 
     def todense(self):
-        dense = np.zeros(self.shape, dtype=self.dtype)
-        dense[self.coordinates[:]] = self.values
-        return dense
+        if hasattr(self, "coordinates"):
+            # stored with older version
+            dense = np.zeros(self.shape, dtype=self.dtype)
+            dense[self.coordinates[:]] = self.values
+            return dense
+        dense = np.zeros(int(np.prod(self.shape)), dtype=self.dtype)
+        n = int(np.sum(self.lengths))
+        if n > 0:
+            run_starts = np.cumsum(self.lengths) - self.lengths
+            offsets = np.arange(n) - np.repeat(run_starts, self.lengths)
+            indexes = np.repeat(self.starts, self.lengths) + offsets
+            dense[indexes] = np.repeat(self.values, self.lengths)
+        return dense.reshape(self.shape)
 
 
 def isSparseMatrix(obj):
@@ -41,6 +66,28 @@ def isSparseMatrix(obj):
         return False
 
 
+def sparse_if_mostly_empty(ndarray, max_runs_ratio=0.05):
+    """
+    Return SparseMatrix if there are only few runs of nonzero values in
+    ndarray. Otherwise ndarray is returned.
+    """
+    if ndarray is None or np.isscalar(ndarray) or np.size(ndarray) == 0:
+        return ndarray
+    sparse = SparseMatrix(ndarray)
+    if len(sparse.starts) > max_runs_ratio * np.size(ndarray):
+        return ndarray
+    return sparse
+
+
+def todense(obj):
+    """
+    Dense array from SparseMatrix. Other objects are returned unchanged.
+    """
+    if isSparseMatrix(obj):
+        return obj.todense()
+    return obj
+
+
 # import sed3
 
 # def manualcrop(data):  # pragma: no cover
@@ -231,15 +278,10 @@ def max_area_index(labels, num):
     """
     Return index of maxmum labeled area
     """
-    mx = 0
-    mxi = -1
-    for l in range(1, num + 1):
-        mxtmp = np.sum(labels == l)
-        if mxtmp > mx:
-            mx = mxtmp
-            mxi = l
-
-    return mxi
+    counts = np.bincount(labels.ravel(), minlength=num + 1)[1:num + 1]
+    if len(counts) == 0 or np.max(counts) == 0:
+        return -1
+    return np.argmax(counts) + 1
 
 from io3d.misc import resize_to_mm, resize_to_shape
 
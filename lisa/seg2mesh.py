@@ -88,19 +88,15 @@ def smooth_mesh(points, elems, etype,
         Coordinates of mesh nodes.
     """
 
-    def laplacian(coors, weights):
-
-        n_nod = coors.shape[0]
-        displ = (weights - sps.identity(n_nod)) * coors
-
-        return displ
-
     def taubin(coors0, weights, lam, mu, n_iter):
 
         coors = coors0.copy()
+        # laplacian matrix is same for all iterations
+        n_nod = coors.shape[0]
+        laplacian = (weights - sps.identity(n_nod, format='csr')).tocsr()
 
         for ii in range(n_iter):
-            displ = laplacian(coors, weights)
+            displ = laplacian * coors
             if nm.mod(ii, 2) == 0:
                 coors += lam * displ
             else:
@@ -223,8 +219,11 @@ def gen_mesh_from_voxels(voxels, dims, etype='q', mtype='v'):
         Finite element mesh.
     """
 
-    dims = dims.squeeze()
+    dims = nm.asarray(dims).squeeze()
     dim = len(dims)
+    if dim == 3 and mtype == 's':
+        return gen_surface_mesh_from_voxels(voxels, dims, etype=etype)
+
     nddims = nm.array(voxels.shape) + 2
 
     nodemtx = nm.zeros(nddims, dtype=nm.int8)
@@ -383,6 +382,126 @@ def gen_mesh_from_voxels(voxels, dims, etype='q', mtype='v'):
     etype = '%d_%d' % (edim, nelnd)
     return coors, nm.ascontiguousarray(elems), etype
 
+# corners of quadrilateral face, face is in plane perpendicular to axis.
+# Voxel is in front of the face (its lower face). Voxel behind the face uses
+# reversed order [0, 3, 2, 1].
+_surface_face_corners = [
+    nm.array([[0, 0, 0], [0, 0, 1], [0, 1, 1], [0, 1, 0]]),
+    nm.array([[0, 0, 0], [1, 0, 0], [1, 0, 1], [0, 0, 1]]),
+    nm.array([[0, 0, 0], [0, 1, 0], [1, 1, 0], [1, 0, 0]]),
+]
+
+
+def gen_surface_mesh_from_voxels(voxels, dims, etype='q', chunk_size=32):
+    """
+    Generate surface FE mesh from 3D voxels.
+
+    Volume is processed by chunks of chunk_size slices along first axis, so
+    no full-size auxiliary arrays are allocated. Nodes are identified by
+    packed coordinates. The result is same as from
+    gen_mesh_from_voxels(voxels, dims, etype, mtype='s').
+
+    Parameters:
+
+    voxels : array
+        3D voxel matrix, 1=material.
+    dims : array
+        Size of one voxel.
+    etype : integer, optional
+        'q' - quadrilateral elements
+        't' - triangular elements
+    chunk_size : integer, optional
+        Number of slices processed at once.
+
+    Returns:
+
+    coors, elems, etype
+    """
+    dims = nm.asarray(dims).squeeze()
+    shape = nm.array(voxels.shape)
+    node_shape = shape + 1
+    felems = [[], [], []]
+
+    for start in range(0, shape[0] + 1, chunk_size):
+        stop = min(start + chunk_size, shape[0] + 1)
+        # slices start - 1 ... stop, out of volume slices are empty
+        chunk = nm.zeros(
+            [stop - start + 1, shape[1] + 2, shape[2] + 2], dtype=nm.bool)
+        lo = max(start - 1, 0)
+        hi = min(stop, shape[0])
+        chunk[lo - start + 1:hi - start + 1, 1:-1, 1:-1] = \
+            voxels[lo:hi] > 0
+
+        for axis in range(3):
+            if axis == 0:
+                front = chunk[1:, 1:-1, 1:-1]
+                back = chunk[:-1, 1:-1, 1:-1]
+            else:
+                # faces of last chunk are only in plane x = shape[0]
+                inner = chunk[1:, 1:-1, 1:-1][:max(hi - start, 0)]
+                front = nm.zeros(
+                    nm.array(inner.shape) + (nm.arange(3) == axis),
+                    dtype=nm.bool)
+                back = nm.zeros_like(front)
+                if axis == 1:
+                    front[:, :-1] = inner
+                    back[:, 1:] = inner
+                else:
+                    front[:, :, :-1] = inner
+                    back[:, :, 1:] = inner
+
+            face = front != back
+            positions = nm.array(nm.nonzero(face)).T
+            positions[:, 0] += start
+            corners = nm.where(
+                front[face][:, nm.newaxis, nm.newaxis],
+                _surface_face_corners[axis][nm.newaxis],
+                _surface_face_corners[axis][nm.newaxis, [0, 3, 2, 1]])
+            nodes = positions[:, nm.newaxis, :] + corners
+            felems[axis].append(
+                nm.ravel_multi_index(
+                    nodes.reshape(-1, 3).T, node_shape
+                ).astype(nm.int64).reshape(-1, 4))
+
+    keys = nm.concatenate([nm.concatenate(fe) for fe in felems])
+    node_keys, elems = nm.unique(keys, return_inverse=True)
+    elems = elems.reshape(-1, 4).astype(nm.int32)
+    coors = nm.array(nm.unravel_index(node_keys, node_shape)).T * dims
+
+    if etype == 't':
+        elems = elems_q2t(elems)
+
+    etype = '%d_%d' % (2, elems.shape[1])
+    return coors, nm.ascontiguousarray(elems), etype
+
+
+def write_stl(points, elems, filename):
+    """
+    Write triangular surface mesh into binary STL file.
+    """
+    if elems.shape[1] == 4:
+        elems = elems_q2t(elems)
+    triangles = points[elems].astype(nm.float32)
+    normals = nm.cross(triangles[:, 1] - triangles[:, 0],
+                       triangles[:, 2] - triangles[:, 0])
+    lengths = nm.sqrt(nm.sum(normals ** 2, axis=1, keepdims=True))
+    lengths[lengths == 0] = 1
+    normals = normals / lengths
+
+    record = nm.dtype([
+        ('normal', '<f4', (3,)),
+        ('vertices', '<f4', (3, 3)),
+        ('attribute', '<u2'),
+    ])
+    data = nm.zeros(len(triangles), dtype=record)
+    data['normal'] = normals
+    data['vertices'] = triangles
+    with open(filename, 'wb') as f:
+        f.write(nm.zeros(80, dtype=nm.uint8).tobytes())
+        f.write(nm.array([len(triangles)], dtype='<u4').tobytes())
+        f.write(data.tobytes())
+
+
 def mesh2vtk(points, elements, etype):
     import vtk
 
@@ -50,15 +50,18 @@ def segmentation_smoothing(segmentation, sigma_mm, labels=1, background_label=0,
     """
     Shape of output segmentation is smoothed with gaussian filter.
 
-    Sigma is computed in mm
+    Sigma is computed in mm. Filtration is done only in the bounding box of
+    selected labels padded by the gaussian kernel radius. Threshold is
+    chosen to keep volume_blowup * original volume. It is found directly
+    from sorted values of smoothed data, unless
+    volume_blowup_criterial_function is given. Then it is optimized with
+    scipy.optimize.fmin.
 
     """
     # import scipy.ndimage
     if voxelsize_mm is None:
         voxelsize_mm = np.asarray([1., 1., 1.])
 
-    if volume_blowup_criterial_function is None:
-        volume_blowup_criterial_function = __volume_blowup_criterial_function
     sigma = float(sigma_mm) / np.array(voxelsize_mm)
 
     # print sigma
@@ -66,40 +69,76 @@ def segmentation_smoothing(segmentation, sigma_mm, labels=1, background_label=0,
     # pyqtRemoveInputHook()
     segmentation_selection = ima.select_labels(segmentation, labels=labels, slab=slab)
     vol1 = np.sum(segmentation_selection)
+    if vol1 == 0:
+        logger.debug("nothing to smooth")
+        return
     wvol = vol1 * volume_blowup
     logger.debug('unique segm ' + str(np.unique(segmentation)))
+
+    # gaussian_filter kernel is truncated at 4 sigma
+    crop = _padded_bounding_box(
+        segmentation_selection, np.ceil(4.0 * sigma).astype(int) + 1)
+    segmentation_selection = segmentation_selection[crop]
     segsmooth = scipy.ndimage.filters.gaussian_filter(
         segmentation_selection.astype(np.float32), sigma)
-    logger.debug('unique segsmooth ' + str(np.unique(segsmooth)))
-    # import ipdb; ipdb.set_trace()
-    # import pdb; pdb.set_trace()
     # pyed = sed3.sed3(self.orig_scale_segmentation)
     # pyed.show()
     logger.debug('wanted volume ' + str(wvol))
     logger.debug('sigma ' + str(sigma))
 
-    critf = lambda x: volume_blowup_criterial_function(
-        x, wvol, segsmooth)
+    if volume_blowup_criterial_function is None:
+        thr = _threshold_for_volume(segsmooth, wvol)
+    else:
+        critf = lambda x: volume_blowup_criterial_function(
+            x, wvol, segsmooth)
 
-    thr = scipy.optimize.fmin(critf, x0=0.5, disp=False)[0]
+        thr = scipy.optimize.fmin(critf, x0=0.5, disp=False)[0]
     logger.debug('optimal threshold ' + str(thr))
-    logger.debug('segsmooth ' + str(np.nonzero(segsmooth)))
 
-    segmentation_selection = (1.0 *
-                              (segsmooth > thr)  # self.volume_blowup)
-                              ).astype(np.int8)
+    segmentation_selection = (segsmooth > thr).astype(np.int8)
     vol2 = np.sum(segmentation_selection)
     with np.errstate(divide="ignore", invalid="ignore"):
         logger.debug("volume ratio " + str(vol2 / float(vol1)))
-    # import ipdb; ipdb.set_trace()
+    # segmentation outside of the box is not changed, replacement is done
+    # in the view
     segmentation_replacement(
-        segmentation,
+        segmentation[crop],
         label=labels,
         segmentation_new=segmentation_selection,
         background_label=background_label,
         slab=slab,
     )
 
+
+def _padded_bounding_box(mask, margin):
+    """
+    Slices of bounding box of nonzero voxels extended by margin and clipped
+    by the shape of mask.
+    """
+    margin = np.asarray(margin) * np.ones(mask.ndim, dtype=int)
+    nz = np.nonzero(mask)
+    return tuple(
+        slice(max(int(np.min(nzi)) - mrg, 0), min(int(np.max(nzi)) + mrg + 1, shp))
+        for nzi, mrg, shp in zip(nz, margin, mask.shape)
+    )
+
+
+def _threshold_for_volume(data, wanted_volume):
+    """
+    Threshold t such that np.sum(data > t) is as close to wanted_volume as
+    possible. It is computed with one partition of data.
+    """
+    flat = data.reshape(-1)
+    n = flat.size
+    k = int(np.clip(np.round(wanted_volume), 0, n))
+    if k == 0:
+        return float(np.max(flat))
+    if k == n:
+        return float(np.min(flat)) - 1.0
+    # k-th largest and (k+1)-th largest values
+    part = np.partition(flat, [n - k - 1, n - k])
+    return (float(part[n - k - 1]) + float(part[n - k])) / 2.0
+
 def __volume_blowup_criterial_function(threshold, wanted_volume,
                                        segmentation_smooth
                                        ):
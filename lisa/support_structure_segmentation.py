@@ -43,6 +43,45 @@ from scipy.ndimage.measurements import label
 from scipy.ndimage import morphology
 
 
+def component_sizes(labeled, num):
+    """
+    Number of voxels of every label. Size of background (label 0) is 0.
+    """
+    counts = np.bincount(labeled.ravel(), minlength=num + 1)
+    counts[0] = 0
+    return counts
+
+
+def polynomial_surface_powers(degree):
+    return [(i, j) for i in range(degree + 1) for j in range(degree + 1 - i)]
+
+
+def fit_polynomial_surface(x, y, z, degree):
+    """
+    Least squares fit of polynomial surface z = f(x, y) of given degree.
+
+    :return: coefficients and powers of x and y
+    """
+    powers = polynomial_surface_powers(degree)
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    A = np.stack([x ** i * y ** j for i, j in powers], axis=1)
+    coefs = np.linalg.lstsq(A, np.asarray(z, dtype=float), rcond=None)[0]
+    return coefs, powers
+
+
+def eval_polynomial_surface(coefs, powers, x, y):
+    """
+    Evaluate polynomial surface in all points of x and y arrays.
+    """
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    z = np.zeros(np.broadcast(x, y).shape)
+    for coef, (i, j) in zip(coefs, powers):
+        z += coef * x ** i * y ** j
+    return z
+
+
 class SupportStructureSegmentation():
     def __init__(self,
             data3d = None,
@@ -125,13 +164,22 @@ class SupportStructureSegmentation():
 
 
     def convolve_structure_heart( self , size=9 ):
-        a = np.zeros(( size , size , size ))
+        k0, k1, k2 = self.convolve_structure_heart_1d(size)
+        return k0[:, None, None] * k1[None, :, None] * k2[None, None, :]
+
+    def convolve_structure_heart_1d(self, size=9):
+        """
+        Heart structure is separable. Return its three 1D kernels.
+        """
         c = int (np.floor( size / 2 ))
-        a[c,c,c]=1
-        structure = filters.gaussian_filter( a , self.voxelsize_mm )
-        structure[:c,:,:] *= -1
-        structure[c,:,:] = 0
-        return structure
+        kernels = []
+        for sigma in self.voxelsize_mm:
+            a = np.zeros(size)
+            a[c] = 1
+            kernels.append(filters.gaussian_filter1d(a, sigma))
+        kernels[0][:c] *= -1
+        kernels[0][c] = 0
+        return kernels
 
     
 
@@ -140,18 +188,22 @@ class SupportStructureSegmentation():
         return np.array(self.data3d > bone_threshold)#.astype(np.int8)*self.slab['bone']
 
     def convolve_structure_spine(self, velikost = [300 , 2, 2]):
-        structure = np.ones((int(velikost[0]/self.voxelsize_mm[0]),int(velikost[1]/self.voxelsize_mm[1]),int(velikost[2]/self.voxelsize_mm[2])))  
+        structure = np.ones(self.convolve_structure_spine_size(velikost))
         return structure
 
-    
+    def convolve_structure_spine_size(self, velikost = [300 , 2, 2]):
+        return [int(velikost[i] / self.voxelsize_mm[i]) for i in range(3)]
 
     def spine_segmentation(self, bone_threshold= 330):
-        seg_prub = filters.gaussian_filter(self.data3d, 5.0/np.asarray(self.voxelsize_mm))
-        structure = self.convolve_structure_spine()
-        
-        seg_prub = filters.convolve(seg_prub, structure)
-	
-	
+        seg_prub = filters.gaussian_filter(
+            self.data3d.astype(np.float32), 5.0/np.asarray(self.voxelsize_mm))
+        # box kernel of ones, separable running sum is used instead of dense
+        # convolution. Only the ratio to maximum is used so the mean is ok.
+        size = self.convolve_structure_spine_size()
+        # convolve is shifted by one for even size
+        origin = [-1 if sz % 2 == 0 else 0 for sz in size]
+        seg_prub = filters.uniform_filter(seg_prub, size, origin=origin)
+
 #seg_prub = scipy.signal.fftconvolve(seg_prub, self.convolve_structure_spine())
         maximum = np.amax(seg_prub)
         seg_prub = np.array(seg_prub > 0.55*maximum)
@@ -167,7 +219,6 @@ class SupportStructureSegmentation():
     #     return interpolate.bisplev(x,y, tck)
 
     def __above_diaphragm_calculation(self, seg_prub, internal_resize_shape=[20, 20, 20], data_degradation=4):
-        import multipolyfit as mpf
         # print seg_prub.dtype
         # seg_prub_tmp = misc.resize_to_shape(seg_prub, internal_resize_shape)
         # print seg_prub_tmp.dtype
@@ -181,46 +232,34 @@ class SupportStructureSegmentation():
         # PyQt4.QtCore.pyqtRemoveInputHook()
         # import ipdb; ipdb.set_trace() #  noqa BREAKPOINT
 
-        s = np.array([x , y]).T
-        h = np.array(z)
-        model = mpf.multipolyfit(s, h, self.rad_diaphragm, model_out = True)
+        coefs, powers = fit_polynomial_surface(x, y, z, self.rad_diaphragm)
         # tck = interpolate.bisplrep(x,y,z, s=10)
         ran = seg_prub.shape
-        x = np.arange( ran[1] )
-        y = np.arange( ran[2] )
-        x, y = np.meshgrid( x, y)
-        # sh = [len(x), len(y)]
-##x, y = np.meshgrid(x, y)
-        # z = np.asarray(map(self.__spl(x,y), x.reshape(-1), y.reshape(-1))).reshape(sh)
-
-
-        z = np.floor(np.asarray(map(model, x.reshape(-1), y.reshape(-1)))).astype(int)
-        x = x.reshape(z.shape)
-        y = y.reshape(z.shape)
-        cc = np.zeros(ran)
-        for a in range(z.shape[0]):
-            if (z[a] < ran[0]) and (z[a] >= 0):
-
-                #self.segmentation[z[a], x[a], y[a]] = self.slab['diaphragm']
-                if self.smer==0:
-                    cc[z[a]+1:, x[a], y[a]] = 1
-                else:
-                    cc[:z[a]-1, x[a], y[a]] = 1
-
-                # self.segmentation[z[a], x[a], y[a]] = self.slab['diaphragm']
-                for b in range(z[a]+1, ran[0]):
-                    cc[b, x[a], y[a]] = 1
+        x, y = np.meshgrid(np.arange(ran[1]), np.arange(ran[2]), indexing='ij')
+        z = np.floor(eval_polynomial_surface(coefs, powers, x, y)).astype(int)
+
+        # all voxels under surface
+        zi = np.arange(ran[0])[:, None, None]
+        valid = ((z < ran[0]) & (z >= 0))[None, :, :]
+        cc = zi > z[None, :, :]
+        if self.smer != 0:
+            # above surface, slice stop z - 1 is negative for z == 0
+            stop = z - 1
+            stop[stop < 0] += ran[0]
+            cc |= zi < stop[None, :, :]
+        cc = (cc & valid).astype(float)
 
         # cc = misc.resize_to_shape(cc, seg_prub.shape)
         return cc
 
     def heart_segmentation(self, heart_threshold = 0, top_threshold = 200):
-        a=self.convolve_structure_heart()
         seg_prub = np.array(self.segmentation == self.slab['rlung'])+np.array(self.segmentation == self.slab['llung'])
 
 
         logger.debug('pred konvoluci')
-        seg_prub = filters.convolve( (seg_prub-0.5) , a )
+        seg_prub = seg_prub - 0.5
+        for axis, kernel in enumerate(self.convolve_structure_heart_1d()):
+            seg_prub = filters.convolve1d(seg_prub, kernel, axis=axis)
         logger.debug('po konvoluci')
 
 
@@ -267,17 +306,14 @@ class SupportStructureSegmentation():
 
         bones = np.array(self.data3d >= top_threshold)
         aaa = np.array(self.data3d >= heart_threshold)
-        aaa = aaa - bones
+        aaa = aaa & ~bones
         logger.debug('pred binary opening')
         aaa=morphology.binary_opening(aaa , iterations=self.iteration()+2).astype(self.segmentation.dtype)
         aaa = morphology.binary_erosion(aaa, iterations=self.iteration())	
         aaa=cc * aaa * mp
 
         lab , num = label(aaa)
-        counts= [0]*(num+1)
-        for x in range(1, num+1):
-            a = np.sum(np.array(lab == x))
-            counts[x] = a
+        counts = component_sizes(lab, num)
         index= np.argmax(counts)
         aaa = np.array(lab==index)
         logger.debug('pred dilataci')
@@ -313,10 +349,7 @@ class SupportStructureSegmentation():
 
     def volume_count(self, seg_prub):
         labeled_seg , num_seg = label(seg_prub)
-        counts= [0]*(num_seg+1)
-        for x in range(1, num_seg+1):
-            a = np.sum(np.array(labeled_seg == x))
-            counts[x] = a
+        counts = component_sizes(labeled_seg, num_seg)
         z, x, y = labeled_seg.shape
         index=labeled_seg[self.iteration()+5,self.iteration()+5,self.iteration()+5]
         counts[index]=0
@@ -8,7 +8,6 @@ import numpy as np
 import skimage
 import skimage.filters
 import skimage.feature
-from scipy import ndimage as nd
 
 
 def feat_hist2(data3d_orig):
@@ -45,6 +44,26 @@ class FeaturesCombinedFeatures():
         return np.array(feats).reshape(-1)
 
 
+def _as_patch_stack(patches, full3d):
+    """
+    Make 4D array (n_patches, n_slices, rows, cols) from stack of patches.
+
+    patches: 3D array (n, rows, cols) with 2D patches or 4D array
+    (n, z, rows, cols) with 3D patches. Whole volume can be used as
+    volume[np.newaxis].
+    full3d: all axial slices of 3D patches are used, otherwise only first
+    slice is used.
+    """
+    patches = np.asarray(patches)
+    if patches.ndim == 3:
+        patches = patches[:, np.newaxis]
+    elif patches.ndim != 4:
+        raise ValueError("Patches should be 3D or 4D array")
+    if not full3d:
+        patches = patches[:, :1]
+    return patches
+
+
 # Gabor filters --------
 class GaborFeatures():
     def __init__(self):
@@ -59,48 +78,206 @@ class GaborFeatures():
                             frequency, theta=theta,
                             sigma_x=sigma, sigma_y=sigma))
                     self.kernels.append(kernel)
+        # fourier transforms of kernels for every image shape
+        self._kernels_fft = {}
 
     def feats_gabor(self, data3d):
         """
-        Compute features based on Gabor filters.
+        Compute features based on Gabor filters. Filtered image has dtype of
+        data3d, integer data are truncated.
         """
-        fv = self.__compute_gabor_feats(
-            data3d[:, :, 0], self.kernels).reshape(-1)
+        fv = self.feats_gabor_batch(
+            data3d[np.newaxis, :, :, 0], dtype=data3d.dtype).reshape(-1)
         return fv
 
-    def __compute_gabor_feats(self, image, kernels):
-        feats = np.zeros((len(kernels), 2), dtype=np.double)
-        for k, kernel in enumerate(kernels):
-            filtered = nd.convolve(image, kernel, mode='wrap')
-            feats[k, 0] = filtered.mean()
-            feats[k, 1] = filtered.var()
-        return feats
+    def feats_gabor_batch(self, patches, full3d=False, dtype=None):
+        """
+        Compute Gabor features for many patches at once.
+
+        Convolution is done with FFT. It is equal to
+        scipy.ndimage.convolve(image, kernel, mode='wrap', output=dtype).
+
+        patches: 3D array (n, rows, cols) or 4D array (n, z, rows, cols)
+        full3d: mean and variance are computed over all axial slices of
+        patch, otherwise only first slice is used
+        dtype: filtered patches are cast to dtype before mean and variance
+        are computed, no cast if None
+        :return: array (n, 2 * n_kernels) with mean and variance of every
+        filtered patch
+        """
+        patches = _as_patch_stack(patches, full3d)
+        image_shape = patches.shape[-2:]
+        images_fft = np.fft.rfft2(patches.astype(np.double))
+        kernels_fft = self._get_kernels_fft(image_shape)
+
+        feats = np.zeros(
+            [patches.shape[0], len(self.kernels), 2], dtype=np.double)
+        for k, kernel_fft in enumerate(kernels_fft):
+            filtered = np.fft.irfft2(images_fft * kernel_fft, s=image_shape)
+            filtered = filtered.reshape(filtered.shape[0], -1)
+            if dtype is not None:
+                filtered = filtered.astype(dtype)
+            feats[:, k, 0] = filtered.mean(axis=1)
+            feats[:, k, 1] = filtered.var(axis=1)
+        return feats.reshape(patches.shape[0], -1)
+
+    def _get_kernels_fft(self, image_shape):
+        image_shape = tuple(image_shape)
+        if image_shape not in self._kernels_fft:
+            self._kernels_fft[image_shape] = [
+                np.fft.rfft2(_wrap_kernel(kernel, image_shape))
+                for kernel in self.kernels
+            ]
+        return self._kernels_fft[image_shape]
+
+
+def _wrap_kernel(kernel, image_shape):
+    """
+    Kernel is placed to image with origin in [0, 0]. Parts out of image are
+    wrapped. Circular convolution with this image is same as
+    scipy.ndimage.convolve(mode='wrap').
+    """
+    wrapped = np.zeros(image_shape, dtype=np.double)
+    center = np.asarray(kernel.shape) // 2
+    rows = (np.arange(kernel.shape[0]) - center[0]) % image_shape[0]
+    cols = (np.arange(kernel.shape[1]) - center[1]) % image_shape[1]
+    np.add.at(wrapped, (rows[:, np.newaxis], cols[np.newaxis, :]), kernel)
+    return wrapped
 
 
 class GlcmFeatures():
+    """
+    Features based on grey-level co-occurrence matrix.
+
+    levels: number of grey levels after quantization
+    distances, angles: offsets of co-occurrence matrices
+    """
+    props = ['dissimilarity', 'correlation', 'contrast', 'ASM', 'energy']
+
+    def __init__(self, levels=256, distances=[5], angles=[0, np.pi / 2],
+                 w_center=100, w_width=250):
+        self.levels = levels
+        self.distances = distances
+        self.angles = angles
+        self.w_center = w_center
+        self.w_width = w_width
+
     def feats_glcm(self, data3d):
         # feats = np.zeros((len(kernels), 2), dtype=np.double)
-        # @TODO data are cast to uint8
-        feats = []
-        im = data3d[0, :, :]
-        w_center = 100
-        w_width = 250
-        im_uint8 = (1.0 /
-                    (1 + np.exp((w_center - im) / w_center))
-                    * w_width).astype(np.uint8)
-        glcm = skimage.feature.greycomatrix(
-            im_uint8,
-            distances=[5],
-            angles=[0, np.pi / 2],
-            levels=256,
-            symmetric=True,
-            normed=True)
-        feats.append(skimage.feature.greycoprops(glcm, 'dissimilarity'))
-        feats.append(skimage.feature.greycoprops(glcm, 'correlation'))
-        feats.append(skimage.feature.greycoprops(glcm, 'contrast'))
-        feats.append(skimage.feature.greycoprops(glcm, 'ASM'))
-        feats.append(skimage.feature.greycoprops(glcm, 'energy'))
-        return np.array(feats).reshape(-1)
+        return self.feats_glcm_batch(data3d[np.newaxis, 0]).reshape(-1)
+
+    def feats_glcm_batch(self, patches, full3d=False):
+        """
+        Compute GLCM features for many patches at once.
+
+        patches: 3D array (n, rows, cols) or 4D array (n, z, rows, cols)
+        full3d: co-occurrences from all axial slices of patch are put
+        together, otherwise only first slice is used
+        :return: array (n, len(props) * n_distances * n_angles)
+        """
+        patches = _as_patch_stack(patches, full3d)
+        glcm = self.glcm_batch(self.quantize(patches))
+        feats = [_glcm_property(glcm, prop) for prop in self.props]
+        return np.concatenate(
+            [feat.reshape(patches.shape[0], -1) for feat in feats], axis=1)
+
+    def quantize(self, data):
+        """
+        Data are windowed with sigmoid and quantized to self.levels.
+        """
+        im = (1.0 / (1 + np.exp((self.w_center - data) / float(self.w_center)))
+              * self.w_width * self.levels / 256.0)
+        return np.clip(im.astype(int), 0, self.levels - 1)
+
+    def glcm_batch(self, quantized):
+        """
+        Symmetric normed co-occurrence matrices of quantized patches.
+
+        quantized: 4D array (n, z, rows, cols) with values from
+        range(self.levels)
+        :return: array (n, levels, levels, n_distances, n_angles)
+        """
+        n = quantized.shape[0]
+        levels = self.levels
+        rows, cols = quantized.shape[-2:]
+        patch_offset = (np.arange(n) * levels * levels).reshape(-1, 1, 1, 1)
+        glcm = np.zeros(
+            [n, levels, levels, len(self.distances), len(self.angles)],
+            dtype=np.double)
+        for d, distance in enumerate(self.distances):
+            for a, angle in enumerate(self.angles):
+                # same offsets as in skimage.feature.greycomatrix
+                row = int(round(np.sin(angle) * distance))
+                col = int(round(np.cos(angle) * distance))
+                first = quantized[
+                    :, :,
+                    max(0, -row):rows - max(0, row),
+                    max(0, -col):cols - max(0, col)]
+                second = quantized[
+                    :, :,
+                    max(0, row):rows + min(0, row),
+                    max(0, col):cols + min(0, col)]
+                pairs = patch_offset + first * levels + second
+                counts = np.bincount(
+                    pairs.ravel(), minlength=n * levels * levels
+                ).reshape(n, levels, levels)
+                glcm[:, :, :, d, a] = counts + counts.transpose(0, 2, 1)
+
+        sums = glcm.sum(axis=(1, 2), keepdims=True)
+        sums[sums == 0] = 1
+        return glcm / sums
+
+
+def _glcm_property(glcm, prop):
+    """
+    Same as skimage.feature.greycoprops for stack of matrices.
+
+    glcm: array (n, levels, levels, n_distances, n_angles)
+    :return: array (n, n_distances, n_angles)
+    """
+    levels = glcm.shape[1]
+    i = np.arange(levels, dtype=np.double).reshape(1, -1, 1, 1, 1)
+    j = i.reshape(1, 1, -1, 1, 1)
+    if prop == 'contrast':
+        return np.sum(glcm * (i - j) ** 2, axis=(1, 2))
+    elif prop == 'dissimilarity':
+        return np.sum(glcm * np.abs(i - j), axis=(1, 2))
+    elif prop == 'ASM':
+        return np.sum(glcm ** 2, axis=(1, 2))
+    elif prop == 'energy':
+        return np.sqrt(np.sum(glcm ** 2, axis=(1, 2)))
+    elif prop == 'correlation':
+        mean_i = np.sum(glcm * i, axis=(1, 2), keepdims=True)
+        mean_j = np.sum(glcm * j, axis=(1, 2), keepdims=True)
+        diff_i = i - mean_i
+        diff_j = j - mean_j
+        std_i = np.sqrt(np.sum(glcm * diff_i ** 2, axis=(1, 2)))
+        std_j = np.sqrt(np.sum(glcm * diff_j ** 2, axis=(1, 2)))
+        cov = np.sum(glcm * diff_i * diff_j, axis=(1, 2))
+        result = np.ones(cov.shape)
+        mask = (std_i >= 1e-15) & (std_j >= 1e-15)
+        result[mask] = cov[mask] / (std_i[mask] * std_j[mask])
+        return result
+    else:
+        raise ValueError("Unknown GLCM property " + str(prop))
+
+
+def texture_feature_matrix(patches, full3d=False, gabor=None, glcm=None):
+    """
+    Gabor and GLCM features of all patches in one matrix.
+
+    patches: 3D array (n, rows, cols) or 4D array (n, z, rows, cols)
+    gabor: GaborFeatures object, it is created if None
+    glcm: GlcmFeatures object, it is created if None
+    :return: float32 array (n, n_features)
+    """
+    if gabor is None:
+        gabor = GaborFeatures()
+    if glcm is None:
+        glcm = GlcmFeatures(levels=32)
+    fv_gabor = gabor.feats_gabor_batch(patches, full3d=full3d)
+    fv_glcm = glcm.feats_glcm_batch(patches, full3d=full3d)
+    return np.concatenate((fv_gabor, fv_glcm), axis=1).astype(np.float32)
 
 
 class HaralickFeatures():
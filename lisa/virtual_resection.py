@@ -15,6 +15,8 @@ logger = logging.getLogger(__name__)
 
 import numpy as np
 import scipy.ndimage
+import scipy.sparse
+import scipy.sparse.csgraph
 # import vtk
 import argparse
 # @TODO remove logger debug message from the header
@@ -63,45 +65,63 @@ def resection(data, name=None, method='PV',
 
 
 def Rez_podle_roviny(plane, data, voxel):
+    """
+    Cut object in data (label 1) by vtk plane. Voxels on the side where the
+    plane normal points are kept.
 
-    a = plane.GetNormal()[0] * voxel[0]
-    b = plane.GetNormal()[1] * voxel[1]
-    c = plane.GetNormal()[2] * voxel[2]
-    xx = plane.GetOrigin()[0] / voxel[0]
-    yy = plane.GetOrigin()[1] / voxel[1]
-    zz = plane.GetOrigin()[2] / voxel[2]
-    d = -(a * xx) - (b * yy) - (c * zz)
-    mensi = 0
-    vetsi = 0
-    mensi_objekt = 0
-    vetsi_objekt = 0
-    print('x: ', a, ' y: ', b, ' z: ', c)
-    print('Pocitani rezu...')
-    prava_strana = np.ones((data.shape[0], data.shape[1], data.shape[2]))
-    leva_strana = np.ones((data.shape[0], data.shape[1], data.shape[2]))
-    dimension = data.shape
-    for x in range(dimension[0]):
-        for y in range(dimension[1]):
-            for z in range(dimension[2]):
-                rovnice = a * x + b * y + c * z + d
-                if((rovnice) <= 0):
-                    mensi = mensi + 1
-                    if(data[x][y][z] == 1):
-                        mensi_objekt = mensi_objekt + 1
-                    leva_strana[x][y][z] = 0
-                else:
-                    vetsi = vetsi + 1
-                    if(data[x][y][z] == 1):
-                        vetsi_objekt = vetsi_objekt + 1
-                    prava_strana[x][y][z] = 0
-    leva_strana = leva_strana * data
-    objekt = mensi_objekt + vetsi_objekt
-    odstraneni_procenta = ((100 * mensi_objekt) / objekt)
-    print(leva_strana)
-
+    :return: data with removed part set to zero and percent of removed
+    object
+    """
+    removed, bbox, resected_volume_mm3, organ_volume_mm3 = cut_by_planes(
+        data != 0, voxel, [(plane.GetOrigin(), plane.GetNormal())])
+    organ = data[bbox] == 1
+    objekt = np.sum(organ)
+    mensi_objekt = np.sum(removed & organ)
+    odstraneni_procenta = (100.0 * mensi_objekt) / objekt
+    leva_strana = data.astype(float)
+    leva_strana[bbox][removed] = 0
     return leva_strana, odstraneni_procenta
 
 
+def cut_by_planes(organ, voxelsize_mm, planes):
+    """
+    Resection of organ by one or more planes. Voxels with non-positive
+    signed distance to any plane are removed. Only bounding box of organ is
+    evaluated.
+
+    :param organ: boolean 3D ndarray
+    :param voxelsize_mm: voxel size
+    :param planes: list of (origin_mm, normal) tuples
+    :return: removed mask in bounding box, slices of bounding box, resected
+    volume in mm3, organ volume in mm3
+    """
+    voxelsize_mm = np.asarray(voxelsize_mm, dtype=np.double)
+    bbox = data_manipulation.bbox_slices(organ)
+    organ = organ[bbox]
+    # coordinates of voxels in mm as broadcastable vectors
+    coords = []
+    for axis, sl in enumerate(bbox):
+        index = (sl.start or 0) + np.arange(organ.shape[axis])
+        shape = [1, 1, 1]
+        shape[axis] = -1
+        coords.append((index * voxelsize_mm[axis]).reshape(shape))
+
+    removed = np.zeros(organ.shape, dtype=bool)
+    for origin, normal in planes:
+        origin = np.asarray(origin, dtype=np.double)
+        normal = np.asarray(normal, dtype=np.double)
+        d = -np.dot(normal, origin)
+        dist = normal[0] * coords[0] + normal[1] * coords[1] + \
+            normal[2] * coords[2] + d
+        removed |= dist <= 0
+    removed &= organ
+
+    voxel_volume_mm3 = np.prod(voxelsize_mm)
+    resected_volume_mm3 = np.sum(removed) * voxel_volume_mm3
+    organ_volume_mm3 = np.sum(organ) * voxel_volume_mm3
+    return removed, bbox, resected_volume_mm3, organ_volume_mm3
+
+
 # ----------------------------------------------------------
 def cut_editor_old(data, label=None):
     logger.debug("editor input label: " + str(label))
@@ -142,71 +162,71 @@ def split_vessel(datap, seeds, vessel_volume_threshold=0.95, dilatation_iteratio
     :return:
     """
     split_obj0 = (seeds == input_seeds_cut_label).astype(np.int8)
-    split_obj = split_obj0.copy()
-
 
     # numeric_label = imma.get_nlabel(datap["slab"], input_label)
     if method == "separate labels":
         input_label = np.max(datap["segmentation"][seeds == input_seeds_label2])
 
     vessels = ima.select_labels(datap["segmentation"], input_label, slab=datap["slab"])
-
-    # if type(input_label) is str:
-    #     numeric_label = datap['slab'][input_label]
-    # else:
-    #     numeric_label = input_label
-    # vessels = datap['segmentation'] == numeric_label
-
-    vesselstmp = vessels
     sumall = np.sum(vessels == 1)
 
-    # split_obj = scipy.ndimage.binary_dilation(split_obj, iterations = 5 )
-    # vesselstmp = vessels * (1 - split_obj)
-
-    lab, n_obj = scipy.ndimage.label(vesselstmp)
-    logger.debug("number of objects " + str(n_obj))
-
-    # while n_obj < 2 :
-# dokud neni z celkoveho objektu ustipnuto alespon 80 procent
-    not_complete = True
-    while not_complete:
+    # Cut is growing from the seed with city block distance (the same as
+    # iterated binary dilation). Only the box around the cut is relabeled in
+    # every step and it is connected with the rest of vessels by component
+    # graph.
+    cutter = _IncrementalVesselCut(vessels, split_obj0 > 0, dilatation_iterations)
+    separate_points = np.nonzero(seeds == input_seeds_separate_label)
+    if method == "separate labels":
+        label2_points = np.nonzero(seeds == input_seeds_label2)
+    elif method != "reach volume":
+        raise IOError("Unknown method " + str(method))
+
+    # dokud neni z celkoveho objektu ustipnuto alespon 80 procent
+    step = 0
+    while True:
+        cutter.set_step(step)
         if method == "reach volume":
-            not_complete = np.sum(lab == qmisc.max_area_index(lab, n_obj)) > (vessel_volume_threshold * sumall)
+            sizes = cutter.component_sizes()
+            biggest = np.max(sizes) if len(sizes) > 0 else 0
+            if biggest <= (vessel_volume_threshold * sumall):
+                break
         elif method == "separate labels":
-            # misc.
-            # imma.get_nlabel(datap["slab"], )
-            # imma.select_labels(seeds,input_seeds_separate_label)
-            seglab1 = np.max(lab[seeds == input_seeds_separate_label])
-            seglab2 = np.max(lab[seeds == input_seeds_label2])
+            seglab1 = np.max(cutter.labels_at(separate_points))
+            seglab2 = np.max(cutter.labels_at(label2_points))
             if (seglab1 > 0) and (seglab2 > 0) and (seglab1 != seglab2):
-                not_complete = False
-        else:
-            IOError("Unknown method " + str(method))
-
-        split_obj = scipy.ndimage.binary_dilation(split_obj, iterations=dilatation_iterations)
-        vesselstmp = vessels * (1 - split_obj)
-
-        lab, n_obj = scipy.ndimage.label(vesselstmp)
+                break
+        if cutter.all_removed():
+            logger.warning("vessel cannot be split")
+            break
+        step += 1
+    if method == "separate labels":
+        # components are selected on the step where the labels were separated
+        seglab1 = np.max(cutter.labels_at(separate_points))
+        seglab2 = np.max(cutter.labels_at(label2_points))
+        lab_separated = cutter.label_image()
+    # the cut is made one step bigger than necessary
+    cutter.set_step(step + 1)
+    lab = cutter.label_image()
 
     if method == "reach volume":
         # všechny objekty, na které se to rozpadlo
-        # pyed = sed3.sed3(lab)
-        # pyed.show()
-        obj1 = get_biggest_object(lab)
-
-    # vymaz nejvetsiho
-        lab[obj1 == 1] = 0
-        obj2 = get_biggest_object(lab)
+        sizes = cutter.component_sizes()
+        # components with equal size are ordered by their first voxel as
+        # scipy.ndimage.label() numbers them
+        flat = lab.ravel()
+        nonzero = np.flatnonzero(flat)
+        first_index = np.zeros(len(sizes), dtype=int)
+        component_labels, first = np.unique(flat[nonzero], return_index=True)
+        first_index[component_labels - 1] = nonzero[first]
+        order = np.lexsort((first_index, -sizes))
+        obj1 = lab == (order[0] + 1 if len(order) > 0 else -1)
+        obj2 = lab == (order[1] + 1 if len(order) > 1 else -1)
 
         pixel = 0
         pixels = obj1[seeds == input_seeds_separate_label]
         if len(pixels) > 0:
             pixel = pixels[0]
 
-        # from PyQt4.QtCore import pyqtRemoveInputHook
-        # pyqtRemoveInputHook()
-        # import ipdb; ipdb.set_trace() # BREAKPOINT
-
         if pixel > 0:
             ol1 = output_label1
             ol2 = output_label2
@@ -217,11 +237,127 @@ def split_vessel(datap, seeds, vessel_volume_threshold=0.95, dilatation_iteratio
         # first selected pixel with right button
         lab = ol1 * obj1 + ol2 * obj2
     elif method == "separate labels":
-        lab = (lab == seglab1) * output_label1 + (lab == seglab2) * output_label2
+        # bigger cut only splits the components, background is never selected
+        remaining = lab > 0
+        obj1 = remaining & (lab_separated == seglab1) & (seglab1 > 0)
+        obj2 = remaining & (lab_separated == seglab2) & (seglab2 > 0) & ~obj1
+        lab = obj1 * output_label1 + obj2 * output_label2
     cut_by_user = split_obj0
     return lab, cut_by_user
 
 
+class _IncrementalVesselCut():
+    """
+    Connected components of vessels without the cut growing from seed.
+
+    Vessels outside the box around the cut are labeled only once. In every
+    step only the box is labeled and its components are joined with
+    outside components through the faces of the box.
+    """
+    def __init__(self, vessels, cut_seed, dilatation_iterations=1):
+        self.vessels = vessels > 0
+        self.cut_seed = cut_seed
+        self.dilatation_iterations = dilatation_iterations
+        self.max_radius = np.sum(vessels.shape)
+        self.margin = None
+        self._set_box(max(8, 2 * dilatation_iterations))
+
+    def _set_box(self, margin):
+        self.margin = margin
+        if np.any(self.cut_seed):
+            self.box = data_manipulation.bbox_slices(self.cut_seed, margin=margin)
+            self.dist = scipy.ndimage.distance_transform_cdt(
+                ~self.cut_seed[self.box], metric="taxicab")
+        else:
+            # nothing is cut
+            self.box = tuple([slice(0, 0)] * self.vessels.ndim)
+            self.dist = np.zeros([0] * self.vessels.ndim)
+        self.box = tuple([
+            slice(*sl.indices(sh)[:2]) for sl, sh in zip(self.box, self.vessels.shape)])
+        outside = self.vessels.copy()
+        outside[self.box] = False
+        self.outside_lab, self.n_outside = scipy.ndimage.label(outside)
+        self.outside_sizes = np.bincount(
+            self.outside_lab.ravel(), minlength=self.n_outside + 1)[1:]
+
+    def all_removed(self):
+        return self.radius >= self.max_radius
+
+    def set_step(self, step):
+        """
+        Step 0 is without cut, step i removes voxels in distance
+        i * dilatation_iterations from seed.
+        """
+        self.radius = step * self.dilatation_iterations if step > 0 else -1
+        if self.radius > self.margin and self.margin < self.max_radius:
+            self._set_box(max(2 * self.margin, self.radius))
+
+        local = self.vessels[self.box] & (self.dist > self.radius)
+        self.local_lab, n_local = scipy.ndimage.label(local)
+        local_sizes = np.bincount(
+            self.local_lab.ravel(), minlength=n_local + 1)[1:]
+
+        # edges between local and outside components across box faces
+        edges = [np.zeros([0], dtype=int), np.zeros([0], dtype=int)]
+        for axis, sl in enumerate(self.box):
+            faces = []
+            if sl.start > 0:
+                faces.append((0, sl.start - 1))
+            if sl.stop < self.vessels.shape[axis] and sl.stop > sl.start:
+                faces.append((sl.stop - sl.start - 1, sl.stop))
+            for inner, outer in faces:
+                inner_sl = list(slice(None) for i in range(self.vessels.ndim))
+                inner_sl[axis] = inner
+                outer_sl = list(self.box)
+                outer_sl[axis] = outer
+                a = self.local_lab[tuple(inner_sl)].ravel()
+                b = self.outside_lab[tuple(outer_sl)].ravel()
+                touch = (a > 0) & (b > 0)
+                edges[0] = np.append(edges[0], a[touch] - 1)
+                edges[1] = np.append(edges[1], b[touch] - 1 + n_local)
+
+        n_nodes = n_local + self.n_outside
+        if n_nodes > 0:
+            graph = scipy.sparse.coo_matrix(
+                (np.ones(len(edges[0])), (edges[0], edges[1])),
+                shape=(n_nodes, n_nodes))
+            n_comp, comp = scipy.sparse.csgraph.connected_components(
+                graph, directed=False)
+        else:
+            n_comp, comp = 0, np.zeros([0], dtype=int)
+        self._sizes = np.bincount(
+            comp, weights=np.concatenate([local_sizes, self.outside_sizes]),
+            minlength=n_comp).astype(int)
+        # lookup tables from local and outside labels to component labels
+        self._local_lut = np.concatenate([[0], comp[:n_local] + 1])
+        self._outside_lut = np.concatenate([[0], comp[n_local:] + 1])
+
+    def component_sizes(self):
+        """
+        Sizes of components, component label i + 1 has size sizes[i].
+        """
+        return self._sizes
+
+    def labels_at(self, points):
+        """
+        Component labels of points given as tuple of index arrays.
+        """
+        points = [np.asarray(p) for p in points]
+        labels = self._outside_lut[self.outside_lab[tuple(points)]]
+        in_box = np.ones(len(points[0]), dtype=bool)
+        for p, sl in zip(points, self.box):
+            in_box &= (p >= sl.start) & (p < sl.stop)
+        local_points = tuple([
+            p[in_box] - sl.start for p, sl in zip(points, self.box)])
+        labels[in_box] = self._local_lut[self.local_lab[local_points]]
+        return labels
+
+    def label_image(self):
+        lab = self._outside_lut[self.outside_lab]
+        lab[self.box] = self._local_lut[self.local_lab]
+        return lab
+
+
 def Resekce_podle_bodu(data, seeds):
     lab, cut = split_vessel(data, seeds)
     segm, dist1, dist2 = split_organ_by_two_vessels(data, lab)
@@ -456,6 +592,130 @@ def split_organ_by_plane(data, seeds):
     return segm, dist1, dist2
 
 
+def _geodesic_voronoi(labels, sampling, domain):
+    """
+    Nearest seed label and distance measured along 6-connected paths inside
+    domain. Dijkstra is run from all seeds at once.
+    """
+    domain = domain | (labels != 0)
+    node_ids = np.full(labels.shape, -1, dtype=np.int32)
+    n_nodes = int(np.count_nonzero(domain))
+    node_ids[domain] = np.arange(n_nodes, dtype=np.int32)
+    rows = []
+    cols = []
+    weights = []
+    for axis in range(labels.ndim):
+        sl1 = [slice(None)] * labels.ndim
+        sl2 = [slice(None)] * labels.ndim
+        sl1[axis] = slice(None, -1)
+        sl2[axis] = slice(1, None)
+        edge = domain[tuple(sl1)] & domain[tuple(sl2)]
+        rows.append(node_ids[tuple(sl1)][edge])
+        cols.append(node_ids[tuple(sl2)][edge])
+        weights.append(np.full(len(rows[-1]), sampling[axis], dtype=np.float32))
+    graph = scipy.sparse.coo_matrix(
+        (np.concatenate(weights), (np.concatenate(rows), np.concatenate(cols))),
+        shape=[n_nodes, n_nodes]).tocsr()
+    node_labels = labels[domain]
+    seed_nodes = np.nonzero(node_labels)[0]
+
+    partition = np.zeros(labels.shape, dtype=labels.dtype)
+    distance = np.full(labels.shape, np.inf, dtype=np.float32)
+    if len(seed_nodes) == 0:
+        return partition, distance
+    dist, pred, sources = scipy.sparse.csgraph.dijkstra(
+        graph, directed=False, indices=seed_nodes, min_only=True,
+        return_predecessors=True)
+    reached = sources >= 0
+    node_partition = np.zeros(n_nodes, dtype=labels.dtype)
+    node_partition[reached] = node_labels[sources[reached]]
+    partition[domain] = node_partition
+    distance[domain] = dist
+    return partition, distance
+
+
+def _voronoi(labels, sampling, domain=None):
+    """
+    Nearest seed label and distance for every voxel. Euclidean distance
+    transform is used if domain is None.
+    """
+    if domain is not None:
+        return _geodesic_voronoi(labels, sampling, domain)
+    indices = np.empty((labels.ndim,) + labels.shape, dtype=np.int32)
+    distance = scipy.ndimage.distance_transform_edt(
+        labels == 0, sampling=sampling, return_indices=True, indices=indices)
+    partition = labels[tuple(indices)]
+    return partition, distance.astype(np.float32)
+
+
+def voronoi_partition(labels, voxelsize_mm=None, mask=None, weights=None,
+                      geodesic=False, return_distance=False):
+    """
+    Split space into regions nearest to labeled seeds. All seed labels are
+    processed together by one distance transform.
+
+    :param labels: ndarray with zeros for background and labeled seeds
+    :param voxelsize_mm: sampling of distance, isotropic if None
+    :param mask: ndarray, computation is restricted to bounding box of mask
+    and seeds and output is set to zero outside the mask
+    :param weights: dict {label: weight}, distance to seeds with label is
+    divided by weight. Every weighted label needs its own distance
+    transform.
+    :param geodesic: distance is measured only inside the mask (and seeds)
+    :param return_distance: return also float32 distance to nearest seed
+    :return: partition with labels of nearest seeds [, distance]
+    """
+    labels = np.asarray(labels)
+    if voxelsize_mm is None:
+        voxelsize_mm = [1.0] * labels.ndim
+    sampling = np.asarray(voxelsize_mm, dtype=np.float64)
+    if mask is None:
+        if geodesic:
+            raise ValueError("Geodesic partition needs mask")
+        sl = tuple([slice(None)] * labels.ndim)
+    else:
+        mask = np.asarray(mask).astype(bool)
+        sl = data_manipulation.bbox_slices(mask | (labels != 0))
+    sub_labels = labels[sl]
+    domain = mask[sl] if geodesic else None
+
+    weights = {} if weights is None else dict(
+        (label, weight) for label, weight in weights.items() if weight != 1)
+    weighted = [label for label in np.unique(sub_labels)
+                if label != 0 and label in weights]
+    if len(weighted) == 0:
+        sub_partition, sub_distance = _voronoi(sub_labels, sampling, domain)
+    else:
+        # weighted distances need one transform per weighted label
+        unweighted = np.where(np.isin(sub_labels, weighted), 0, sub_labels)
+        if np.any(unweighted):
+            sub_partition, sub_distance = _voronoi(unweighted, sampling, domain)
+        else:
+            sub_partition = np.zeros(sub_labels.shape, dtype=sub_labels.dtype)
+            sub_distance = np.full(sub_labels.shape, np.inf, dtype=np.float32)
+        for label in weighted:
+            if domain is None:
+                dist_l = scipy.ndimage.distance_transform_edt(
+                    sub_labels != label, sampling=sampling).astype(np.float32)
+            else:
+                seeds_l = np.where(sub_labels == label, sub_labels, 0)
+                dist_l = _geodesic_voronoi(seeds_l, sampling, domain)[1]
+            dist_l /= np.float32(weights[label])
+            closer = dist_l < sub_distance
+            sub_partition[closer] = label
+            sub_distance[closer] = dist_l[closer]
+
+    partition = np.zeros(labels.shape, dtype=labels.dtype)
+    partition[sl] = sub_partition
+    if mask is not None:
+        partition[~mask] = 0
+    if not return_distance:
+        return partition
+    distance = np.full(labels.shape, np.inf, dtype=np.float32)
+    distance[sl] = sub_distance
+    return partition, distance
+
+
 def split_tissue_on_bifurcation(labeled_branches,
                                 trunk_label, branch_labels,
                                 tissue_segmentation, neighbors_list=None,
@@ -478,7 +738,6 @@ def split_tissue_on_bifurcation(labeled_branches,
 
     import imma.measure
     import imma.image_manipulation
-    import imma.image_manipulation as ima
 
     if ignore_labels is None:
         ignore_labels = []
@@ -499,7 +758,6 @@ def split_tissue_on_bifurcation(labeled_branches,
     # ex
     # print(neighbors_list)
     # find whole branche
-    segmentations = [None] * len(branch_labels)
     connected = [None] * len(branch_labels)
 
     for i, branch_label in enumerate(branch_labels):
@@ -512,15 +770,18 @@ def split_tissue_on_bifurcation(labeled_branches,
         ignore_labels_i.extend(ignore_labels)
         connected_i = imma.measure.get_connected_labels(
             neighbors_list, branch_label, ignore_labels_i)
-        segmentations[i] = ima.select_labels(labeled_branches, connected_i).astype(np.int8)
         connected[i] = connected_i
 
-    if np.max(np.sum(segmentations, 0)) > 1:
-        ValueError("Missing one vessel")
-
-    for i, branch_label in enumerate(branch_labels):
-        segmentations[i] = segmentations[i] * (i + 1)
-    seg = np.sum(segmentations, 0)
+    # all branches are written into seeds by one lookup
+    max_label = max([np.max(labeled_branches)] + [
+        max(connected_i) for connected_i in connected if len(connected_i) > 0])
+    lut = np.zeros(int(max_label) + 1, dtype=np.int8)
+    for i, connected_i in enumerate(connected):
+        connected_i = np.asarray(list(connected_i), dtype=int)
+        if np.any(lut[connected_i] > 0):
+            logger.warning("Branches of vessel tree are connected")
+        lut[connected_i] = i + 1
+    seg = lut[labeled_branches]
 
     # ignore_labels1 = [0, trunk_label, branch_label2]
     # ignore_labels1.extend(ignore_labels)
@@ -538,9 +799,7 @@ def split_tissue_on_bifurcation(labeled_branches,
     # if np.max(seg) > 2:
     #     ValueError("Missing one vessel")
 
-    dseg = ima.distance_segmentation(seg)
-    # organseg = ima.select_labels(segmentation, organ_label, slab).astype(np.int8)
-    dseg[~tissue_segmentation.astype(np.bool)] = 0
+    dseg = voronoi_partition(seg, mask=tissue_segmentation)
 
     return dseg, connected
 
@@ -548,7 +807,7 @@ def split_tissue_on_bifurcation(labeled_branches,
 def split_organ_by_two_vessels(datap,
                                seeds, organ_label=1,
                                seed_label1=1, seed_label2=2,
-                               weight1=1, weight2=1):
+                               weight1=1, weight2=1, return_distances=True):
     """
 
     Input of function is ndarray with 2 labeled vessels and data.
@@ -564,6 +823,9 @@ def split_organ_by_two_vessels(datap,
             2: second part of portal vein (or defined in seed2_label)
     :param weight1: distance weight from seed_label1
     :param weight2: distance weight from seed_label2
+    :param return_distances: compute full volume distances dist1 and dist2,
+    they are None otherwise
+    :return: segm, dist1, dist2
 
     """
     weight1 = 1 if weight1 is None else weight1
@@ -574,39 +836,32 @@ def split_organ_by_two_vessels(datap,
         seed_label1 = [seed_label1]
     if type(seed_label2) != list:
         seed_label2 = [seed_label2]
+    seeds1 = ima.select_labels(seeds, seed_label1, slab)
+    seeds2 = ima.select_labels(seeds, seed_label2, slab)
+    target_organ_segmentation = ima.select_labels(segmentation, organ_label, slab)
+    if return_distances:
+        sl = tuple([slice(None)] * seeds.ndim)
+    else:
+        # nearest seed is always in bounding box of organ and seeds
+        sl = data_manipulation.bbox_slices(
+            target_organ_segmentation | seeds1 | seeds2)
     # dist se tady počítá od nul jenom v jedničkách
     dist1 = scipy.ndimage.distance_transform_edt(
-        1 - ima.select_labels(seeds, seed_label1, slab),
-        # seeds != seed_label1,
+        np.logical_not(seeds1[sl]),
         sampling=datap['voxelsize_mm']
     )
     dist2 = scipy.ndimage.distance_transform_edt(
-        1 - ima.select_labels(seeds, seed_label2, slab),
-        # seeds != seed_label2,
+        np.logical_not(seeds2[sl]),
         sampling=datap['voxelsize_mm']
     )
-    # import skfmm
-    # dist1 = skfmm.distance(
-    #     labeled != l1,
-    #     dx=datap['voxelsize_mm']
-    # )
-    # dist2 = skfmm.distance(
-    #     labeled != l2,
-    #     dx=datap['voxelsize_mm']
-    # )
-    # print 'skfmm'
-    # from PyQt4.QtCore import pyqtRemoveInputHook; pyqtRemoveInputHook()
-    # import ipdb; ipdb.set_trace()
-
-    # from PyQt4.QtCore import pyqtRemoveInputHook
-    # pyqtRemoveInputHook()
-    # import ipdb; ipdb.set_trace() # BREAKPOINT
-
-    # segm = (dist1 < dist2) * (data['segmentation'] != data['slab']['none'])
-    target_organ_segmentation = ima.select_labels(segmentation, organ_label, slab)
-    segm = ((target_organ_segmentation * ((dist1 / weight1) > (dist2 / weight2))).astype('int8') +
-            target_organ_segmentation.astype('int8'))
-
+    # voxels in the same weighted distance belong to seed_label1
+    organ = target_organ_segmentation[sl].astype('int8')
+    segm = np.zeros(seeds.shape, dtype=np.int8)
+    segm[sl] = organ * ((dist1 / weight1) > (dist2 / weight2)) + organ
+
+    if not return_distances:
+        dist1 = None
+        dist2 = None
     return segm, dist1, dist2
 
 
@@ -723,11 +978,11 @@ def label_volumetric_vessel_tree(oseg, vessel_label=None, write_to_oseg=True, ne
     bl = skan.get_branch_label()
     un = np.unique(bl)
     if write_to_oseg:
+        label_map = {}
         for lb in un:
             if lb != 0:
-                new_slabel = new_label_str_format.format(vessel_label, lb)
-                new_nlabel = oseg.nlabels(new_slabel)
-                oseg.segmentation[bl == lb] = new_nlabel
+                label_map[lb] = new_label_str_format.format(vessel_label, lb)
+        oseg.write_label_image(bl, label_map)
 
     # ima.distance_segmentation(oseg.select_label(vessel_label))
     return bl
@@ -38,7 +38,6 @@ logger = logging.getLogger(__name__)
 # apdb.set_trace();
 # import scipy.io
 import numpy as np
-import scipy
 # from scipy import sparse
 # import traceback
 
@@ -68,12 +67,17 @@ def evaluate_and_write_to_file(
         visualization,
         return_dir_lists=False,
         special_evaluation_function=None,
-        return_all_data=False
+        return_all_data=False,
+        n_jobs=1,
+        cache_dir=None
 ):
     """
     Function computes yaml file (if there are given input sliver and pklz
     directories). Based on yaml file are compared sliver segmentations and
     our pklz files.
+
+    :param n_jobs: number of processes used for evaluation
+    :param cache_dir: directory with per-case evaluation cache
     """
     dirlists = None
     if (directoryPklz is not None) and (directorySliver is not None):
@@ -90,15 +94,12 @@ def evaluate_and_write_to_file(
 
     evaluation_all = eval_all_from_dataset_metadata(
         inputdata, visualization,
-        special_evaluation_function=special_evaluation_function
+        special_evaluation_function=special_evaluation_function,
+        n_jobs=n_jobs,
+        cache_dir=cache_dir
     )
 
-    logger.debug(str(evaluation_all))
-    logger.debug('eval all')
-
-    logger.debug(make_sum(evaluation_all))
-    write_csv(evaluation_all, filename=outputfile + '.csv')
-    misc.obj_to_file(evaluation_all, outputfile + '.pkl', filetype='pkl')
+    write_evaluation(evaluation_all, outputfile)
 
     retval = []
 
@@ -133,10 +134,41 @@ def evaluate_and_write_to_file(
     # oseg.orig_segmentation)
 
 
+def write_evaluation(evaluation_all, outputfile):
+    """
+    Write evaluation to outputfile + '.csv' and outputfile + '.pkl'.
+    """
+    logger.debug(str(evaluation_all))
+    logger.debug('eval all')
+
+    logger.debug(make_sum(evaluation_all))
+    write_csv(evaluation_all, filename=outputfile + '.csv')
+    misc.obj_to_file(evaluation_all, outputfile + '.pkl', filetype='pkl')
+
+
 def eval_all_from_dataset_metadata(inputdata, visualization=False,
-                                   special_evaluation_function=None):
+                                   special_evaluation_function=None,
+                                   n_jobs=1, cache_dir=None):
     """
     set metadata
+
+    :param n_jobs: number of worker processes. Visualization is possible
+        only with n_jobs=1.
+    :param cache_dir: directory for per-case evaluation cache. Cases with
+        unchanged input files are not evaluated again.
+    """
+    records = [(inputdata['basedir'], record) for record in inputdata['data']]
+    evaluation_list = eval_records(
+        records, visualization=visualization,
+        special_evaluation_function=special_evaluation_function,
+        n_jobs=n_jobs, cache_dir=cache_dir)
+    return merge_evaluations(evaluation_list)
+
+
+def merge_evaluations(evaluation_list):
+    """
+    Join list of eval_one_from_dataset_metadata() outputs into one dict of
+    lists.
     """
     evaluation_all = {
         'file1': [],
@@ -156,88 +188,168 @@ def eval_all_from_dataset_metadata(inputdata, visualization=False,
         'maxd': []
 
     }
-    for i in range(0, len(inputdata['data'])):
+    for evaluation_one in evaluation_list:
+        for key in evaluation_one.keys():
+            if key not in evaluation_all.keys():
+                evaluation_all[key] = []
+
+            evaluation_all[key].append(evaluation_one[key])
+    return evaluation_all
+
 
-        reader = datareader.DataReader()
-        data3d_a_path = os.path.join(inputdata['basedir'],
-                                     inputdata['data'][i]['sliverseg'])
-        data3d_a, metadata_a = reader.Get3DData(data3d_a_path, dataplus_format=False)
-        print("inputdata ", list(inputdata['data'][i].values()))
+def eval_records(records, visualization=False,
+                 special_evaluation_function=None, n_jobs=1, cache_dir=None):
+    """
+    Evaluate list of (basedir, record) couples. Record is item of 'data' list
+    in dataset metadata.
+
+    :param n_jobs: if it is greater then 1, cases are evaluated in process
+        pool. special_evaluation_function has to be picklable then.
+    :param cache_dir: directory for per-case evaluation cache
+    :return: list of evaluations in the same order as records
+    """
+    tasks = [
+        (basedir, record, visualization, special_evaluation_function,
+         cache_dir)
+        for basedir, record in records
+    ]
+    if n_jobs is not None and n_jobs > 1 and len(tasks) > 1:
+        if visualization:
+            logger.warning("Visualization is not available with n_jobs > 1")
+        import multiprocessing
+        pool = multiprocessing.Pool(processes=n_jobs)
         try:
-            # if there is defined overlay
-            data3d_a = reader.get_overlay()[inputdata['data'][i][
-                'overlay_number']]
-            logger.info('overlay loaded')
-            print('overlay loaded')
-        except:
-            logger.debug("overlay not loaded")
-            pass
+            evaluation_list = pool.map(_eval_one_task, tasks, chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        evaluation_list = [_eval_one_task(task) for task in tasks]
+    return evaluation_list
 
-        logger.debug('data A shape ' + str(data3d_a.shape))
 
-        data3d_b_path = os.path.join(inputdata['basedir'],
-                                     inputdata['data'][i]['ourseg'])
-        obj_b = misc.obj_from_file(data3d_b_path, filetype='pickle')
-        # data_b, metadata_b = reader.Get3DData(data3d_b_path)
+def _eval_one_task(task):
+    basedir, record, visualization, special_evaluation_function, cache_dir = \
+        task
+    return eval_one_from_dataset_metadata(
+        basedir, record, visualization=visualization,
+        special_evaluation_function=special_evaluation_function,
+        cache_dir=cache_dir)
 
-        if 'crinfo' in obj_b.keys():
-            data3d_b = qmisc.uncrop(obj_b['segmentation'],
-                                    obj_b['crinfo'], data3d_a.shape)
-        else:
-            data3d_b = obj_b['segmentation']
 
-        # import pdb; pdb.set_trace()
-        # data3d_a = (data3d_a > 1024).astype(np.int8)
-        data3d_a = (data3d_a > 0).astype(np.int8)
-        data3d_b = (data3d_b > 0).astype(np.int8)
+def eval_one_from_dataset_metadata(basedir, record, visualization=False,
+                                   special_evaluation_function=None,
+                                   cache_dir=None):
+    """
+    Compare one reference segmentation with one pklz file.
 
-        if visualization:
-            pyed = sed3.sed3(data3d_a,  # + (4 * data3d_b)
-                             contour=data3d_b)
-            pyed.show()
-
-        evaluation_one = compare_volumes(data3d_a, data3d_b,
-                                         metadata_a['voxelsize_mm'])
-        if special_evaluation_function is not None:
-            evaluation_one.update(
-                special_evaluation_function(
-                    data3d_a, data3d_b, metadata_a['voxelsize_mm']
-                ))
-        evaluation_all['file1'].append(data3d_a_path)
-        evaluation_all['file2'].append(data3d_b_path)
-        for key in evaluation_one.keys():
-            if key not in evaluation_all.keys():
-                evaluation_all[key] = []
+    :param basedir: base directory of dataset metadata
+    :param record: dict with 'sliverseg', 'ourseg' and optionaly
+        'overlay_number' keys
+    :param cache_dir: if it is not None, evaluation is stored there and loaded
+        on next call if the input files are not changed
+    """
+    data3d_a_path = os.path.join(basedir, record['sliverseg'])
+    data3d_b_path = os.path.join(basedir, record['ourseg'])
+
+    cache_file = None
+    if cache_dir is not None:
+        cache_file = os.path.join(
+            cache_dir,
+            _evaluation_cache_key(
+                [data3d_a_path, data3d_b_path],
+                record.get('overlay_number', None),
+                special_evaluation_function) + '.pkl')
+        if os.path.isfile(cache_file):
+            logger.debug("evaluation loaded from cache " + cache_file)
+            return misc.obj_from_file(cache_file, filetype='pickle')
+
+    reader = datareader.DataReader()
+    data3d_a, metadata_a = reader.Get3DData(data3d_a_path, dataplus_format=False)
+    print("inputdata ", list(record.values()))
+    try:
+        # if there is defined overlay
+        data3d_a = reader.get_overlay()[record['overlay_number']]
+        logger.info('overlay loaded')
+        print('overlay loaded')
+    except:
+        logger.debug("overlay not loaded")
+        pass
 
-            evaluation_all[key].append(evaluation_one[key])
-        # evaluation_all['volume1_mm3'].append(evaluation_one['volume1_mm3'])
-        # evaluation_all['volume2_mm3'].append(evaluation_one['volume2_mm3'])
-        # evaluation_all['err1_mm3'].append(evaluation_one['err1_mm3'])
-        # evaluation_all['err2_mm3'].append(evaluation_one['err2_mm3'])
-        # evaluation_all['err1_percent'].append(evaluation_one['err1_percent'])
-        # evaluation_all['err2_percent'].append(evaluation_one['err2_percent'])
-        # evaluation_all['voe'].append(evaluation_one['voe'])
-        # evaluation_all['vd'].append(evaluation_one['vd'])
-        # evaluation_all['avgd'].append(evaluation_one['avgd'])
-        # evaluation_all['rmsd'].append(evaluation_one['rmsd'])
-        # evaluation_all['maxd'].append(evaluation_one['maxd'])
-        if 'processing_time' in obj_b.keys():
-            # this is only for compatibility with march2014 data
-            processing_time = obj_b['processing_time']
-            organ_interactivity_counter = obj_b['organ_interactivity_counter']
-        else:
-            try:
-                processing_time = obj_b['processing_information']['organ_segmentation']['processing_time']  # noqa
-                organ_interactivity_counter = obj_b['processing_information']['organ_segmentation'][
-                    'organ_interactivity_counter']  # noqa
-            except:
-                processing_time = 0
-                organ_interactivity_counter = 0
-        evaluation_all['processing_time'].append(processing_time)
-        evaluation_all['organ_interactivity_counter'].append(
-            organ_interactivity_counter)
+    logger.debug('data A shape ' + str(data3d_a.shape))
 
-    return evaluation_all
+    obj_b = misc.obj_from_file(data3d_b_path, filetype='pickle')
+    # data_b, metadata_b = reader.Get3DData(data3d_b_path)
+
+    if 'crinfo' in obj_b.keys():
+        data3d_b = qmisc.uncrop(obj_b['segmentation'],
+                                obj_b['crinfo'], data3d_a.shape)
+    else:
+        data3d_b = obj_b['segmentation']
+
+    # data3d_a = (data3d_a > 1024).astype(np.int8)
+    data3d_a = (data3d_a > 0).astype(np.int8)
+    data3d_b = (data3d_b > 0).astype(np.int8)
+
+    if visualization:
+        pyed = sed3.sed3(data3d_a,  # + (4 * data3d_b)
+                         contour=data3d_b)
+        pyed.show()
+
+    evaluation_one = {
+        'file1': data3d_a_path,
+        'file2': data3d_b_path,
+    }
+    evaluation_one.update(compare_volumes(data3d_a, data3d_b,
+                                          metadata_a['voxelsize_mm']))
+    if special_evaluation_function is not None:
+        evaluation_one.update(
+            special_evaluation_function(
+                data3d_a, data3d_b, metadata_a['voxelsize_mm']
+            ))
+    if 'processing_time' in obj_b.keys():
+        # this is only for compatibility with march2014 data
+        processing_time = obj_b['processing_time']
+        organ_interactivity_counter = obj_b['organ_interactivity_counter']
+    else:
+        try:
+            processing_time = obj_b['processing_information']['organ_segmentation']['processing_time']  # noqa
+            organ_interactivity_counter = obj_b['processing_information']['organ_segmentation'][
+                'organ_interactivity_counter']  # noqa
+        except:
+            processing_time = 0
+            organ_interactivity_counter = 0
+    evaluation_one['processing_time'] = processing_time
+    evaluation_one['organ_interactivity_counter'] = organ_interactivity_counter
+
+    if cache_file is not None:
+        if not os.path.exists(cache_dir):
+            os.makedirs(cache_dir)
+        misc.obj_to_file(evaluation_one, cache_file, filetype='pickle')
+
+    return evaluation_one
+
+
+def _evaluation_cache_key(paths, overlay_number, special_evaluation_function):
+    """
+    Key is constructed from absolute path, size and modification time of input
+    files and from the name of special evaluation function.
+    """
+    import hashlib
+
+    key_items = [str(overlay_number)]
+    if special_evaluation_function is not None:
+        key_items.append(
+            getattr(special_evaluation_function, '__module__', '') + '.' +
+            getattr(special_evaluation_function, '__name__', '')
+        )
+    for path in paths:
+        stat = os.stat(path)
+        key_items.extend([
+            os.path.abspath(path), str(stat.st_size), repr(stat.st_mtime)
+        ])
+
+    return hashlib.sha1("|".join(key_items).encode("utf8")).hexdigest()
 
 
 def compare_volumes_boundingbox(vol1, vol2, voxelsize_mm):
@@ -360,78 +472,92 @@ def compare_volumes(vol1, vol2, voxelsize_mm, use_logger=False):
     return evaluation
 
 
-def distance_matrics(vol1, vol2, voxelsize_mm):
+def distance_matrics(vol1, vol2, voxelsize_mm, percentiles=None):
+    """
+    Surface distance metrics of two binary volumes.
+
+    Border voxels of both volumes are taken as point clouds in millimeters
+    and nearest surface distances are obtained from KD-tree queries. No
+    distance transform over the whole volume is computed.
+
+    :param vol1: reference volume
+    :param vol2: segmentation
+    :param voxelsize_mm: voxel size in millimeters
+    :param percentiles: list of percentiles (f.e. [95]). If it is given,
+        list of percentile distances (f.e. HD95) is returned as fourth item.
+        Percentile is computed for both directions and bigger value is used.
+    :return: avgd, rmsd, maxd [, percentile_distances]
+    """
+    dst_12, dst_21 = surface_distances(vol1, vol2, voxelsize_mm)
+    dst_both = np.append(dst_12, dst_21)
+
+    if len(dst_12) == 0 or len(dst_21) == 0:
+        logger.warning("One of surfaces is empty. Distances are infinite.")
+        avgd = rmsd = maxd = np.inf
+        prc = [np.inf] * len(percentiles if percentiles is not None else [])
+    else:
+        avgd = np.average(dst_both)
+        # there is not clear what is correct
+        # rmsd = np.average(dst_both ** 2)**0.5
+        rmsd = np.average(dst_both ** 2)
+        maxd = max(np.max(dst_12), np.max(dst_21))
+        if percentiles is not None:
+            prc = [
+                max(np.percentile(dst_12, pc), np.percentile(dst_21, pc))
+                for pc in percentiles
+            ]
+
+    if percentiles is not None:
+        return avgd, rmsd, maxd, prc
+    return avgd, rmsd, maxd
+
+
+def surface_distances(vol1, vol2, voxelsize_mm):
+    """
+    Distances from surface voxels of one volume to the surface of the other.
+
+    :return: dst_12, dst_21 - distances [mm] from border of vol2 to border of
+        vol1 and from border of vol1 to border of vol2
+    """
+    import scipy.spatial
+
     # crop data to reduce comutation time
-    crinfo = qmisc.crinfo_from_specific_data(vol1 + vol2, CROP_MARGIN)
-    logger.debug(str(crinfo) + ' m1 ' + str(np.max(vol1)) +
-                 ' m2 ' + str(np.min(vol2)))
+    crinfo = qmisc.crinfo_from_specific_data(
+        (vol1 > 0) | (vol2 > 0), CROP_MARGIN)
     logger.debug("crinfo " + str(crinfo))
     vol1 = qmisc.crop(vol1, crinfo)
     vol2 = qmisc.crop(vol2, crinfo)
 
-    border1 = _get_border(vol1)
-    border2 = _get_border(vol2)
-
-    # pyed = sed3.sed3(vol1, contour=vol1)
-    # pyed.show()
-    b1dst = scipy.ndimage.morphology.distance_transform_edt(
-        1 - border1,
-        sampling=voxelsize_mm
-    )
-    b2dst = scipy.ndimage.morphology.distance_transform_edt(
-        1 - border2,
-        sampling=voxelsize_mm
-    )
+    pts1 = _get_border_points_mm(vol1, voxelsize_mm)
+    pts2 = _get_border_points_mm(vol2, voxelsize_mm)
+    if len(pts1) == 0 or len(pts2) == 0:
+        return np.array([]), np.array([])
 
-    dst_b1_to_b2 = border2 * b1dst
-    dst_b2_to_b1 = border1 * b2dst
-    dst_12 = dst_b1_to_b2[border2]
-    dst_21 = dst_b2_to_b1[border1]
-    dst_both = np.append(dst_12, dst_21)
+    dst_12, _ = scipy.spatial.cKDTree(pts1).query(pts2)
+    dst_21, _ = scipy.spatial.cKDTree(pts2).query(pts1)
+    return dst_12, dst_21
 
-    # sum_d12 = np.sum(dst_12)
-    # sum_d21 = np.sum(dst_21)
-    # len_d12 = len(dst_12)
-    # len_d21 = len(dst_21)
-    # import ipdb; ipdb.set_trace() # BREAKPOINT
-    # pyed = sed3.sed3(dst_b1_to_b2, contour=vol1)
-    # pyed.show()
-    # print np.nonzero(border1)
-    # avgd = np.average(dst_b1_to_b2[np.nonzero(border2)])
-    # import ipdb; ipdb.set_trace() #  noqa BREAKPOINT
-    # avgd = (sum_d21 + sum_d12)/float(len_d21 + len_d12)
-    # rmsd = ((np.sum(dst_12**2) + dst_21**2)/float(len_d21 + len_d12))**0.5
-    avgd = np.average(dst_both)
-
-    # there is not clear what is correct
-    # rmsd = np.average(dst_both ** 2)**0.5
-    # rmsd = (np.average(dst_12) + np.average(dst_21))**0.5
-    rmsd = np.average(dst_both ** 2)
-    # rmsd = np.average(dst_b1_to_b2[border2] ** 2)
-    maxd = max(np.max(dst_b1_to_b2), np.max(dst_b2_to_b1))
-    # old
-    # avgd = np.average(dst_b1_to_b2[border2])
-    # rmsd = np.average(dst_b1_to_b2[border2] ** 2)
-    # maxd = np.max(dst_b1_to_b2)
 
-    return avgd, rmsd, maxd
+def _get_border_points_mm(image3d, voxelsize_mm):
+    """
+    Coordinates of border voxels in millimeters as [n, 3] array.
+    """
+    border = _get_border(image3d)
+    return np.argwhere(border) * np.asarray(voxelsize_mm, dtype=np.float64)
 
 
 def _get_border(image3d):
+    """
+    Object voxels with at least one background voxel in 26-neighborhood.
+    Voxels outside of the image are considered to be object.
+    """
     import scipy.ndimage
 
-    kernel = np.ones([3, 3, 3])
-    conv = scipy.ndimage.convolve(image3d, kernel)
-    conv[conv == 27] = 0
-    conv = conv * image3d
-
-    conv = conv > 0
-
-    # pyed = sed3.sed3(conv, contour =
-    # image3d)
-    # pyed.show()
+    image3d = image3d > 0
+    eroded = scipy.ndimage.binary_erosion(
+        image3d, structure=np.ones([3, 3, 3]), border_value=1)
 
-    return conv
+    return image3d & ~eroded
 
 
 def write_csv(data, filename='20130812_liver_volumetry.csv'):
@@ -0,0 +1,81 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os.path
+import sys
+import json
+import shutil
+import tempfile
+import unittest
+
+path_to_script = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(path_to_script, "../lisa/"))
+
+from lisa import batch
+
+
+class BatchTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_read_jobs(self):
+        jobs = [
+            {"datapath": "a.pklz", "output_path": "a-out.pklz"},
+            {"datapath": "b.pklz", "config": {"working_voxelsize_mm": 2}},
+        ]
+        fn = os.path.join(self.tmpdir, "jobs.jsonl")
+        with open(fn, "w") as f:
+            for job in jobs:
+                f.write(json.dumps(job) + "\n")
+        self.assertEqual(batch.read_jobs(fn), jobs)
+
+        fn = os.path.join(self.tmpdir, "jobs.json")
+        with open(fn, "w") as f:
+            json.dump(jobs, f)
+        self.assertEqual(batch.read_jobs(fn), jobs)
+
+    def test_failed_job_is_reported(self):
+        spool = os.path.join(self.tmpdir, "spool")
+        os.makedirs(spool)
+        fn = os.path.join(spool, "job.json")
+        with open(fn, "w") as f:
+            json.dump({"datapath": os.path.join(self.tmpdir, "missing")}, f)
+
+        service = batch.BatchSegmentation(n_jobs=1, params={}, preload=False)
+        service.serve(spool, poll_interval=0, max_polls=1)
+        self.assertTrue(os.path.exists(fn + ".done"))
+        reports = batch.read_jobs(fn + ".report")
+        self.assertEqual(len(reports), 1)
+        self.assertEqual(reports[0]["status"], "failed")
+        self.assertIsNotNone(reports[0]["error"])
+
+    def test_malformed_job_files(self):
+        spool = os.path.join(self.tmpdir, "spool")
+        os.makedirs(spool)
+        fn_broken = os.path.join(spool, "a.json")
+        with open(fn_broken, "w") as f:
+            f.write('{"datapath": "a.pk')
+        fn_not_dict = os.path.join(spool, "b.json")
+        with open(fn_not_dict, "w") as f:
+            json.dump(["b.pklz"], f)
+
+        service = batch.BatchSegmentation(n_jobs=1, params={}, preload=False)
+        service.serve(spool, poll_interval=0, max_polls=2)
+        self.assertTrue(os.path.exists(fn_broken + ".failed"))
+        reports = batch.read_jobs(fn_broken + ".report")
+        self.assertEqual(reports[0]["status"], "failed")
+        self.assertIsNotNone(reports[0]["error"])
+
+        # job which is not dict is reported, other jobs are processed
+        self.assertTrue(os.path.exists(fn_not_dict + ".done"))
+        reports = batch.read_jobs(fn_not_dict + ".report")
+        self.assertEqual(len(reports), 1)
+        self.assertEqual(reports[0]["status"], "failed")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,78 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import unittest
+import numpy as np
+import scipy.ndimage
+
+from lisa import body_navigation
+
+
+class BodyNavigationTest(unittest.TestCase):
+
+    def symmetric_image(self, angle, pivot, shape=(200, 220)):
+        """
+        Random blobs in ellipse mirrored over line given by angle and pivot.
+        """
+        np.random.seed(1)
+        img = scipy.ndimage.filters.gaussian_filter(np.random.rand(*shape), 3)
+        img = (img > np.mean(img) + 0.02).astype(np.double)
+        yy, xx = np.mgrid[:shape[0], :shape[1]]
+        img *= ((yy - pivot[0]) ** 2 / 70. ** 2 +
+                (xx - pivot[1]) ** 2 / 90. ** 2) < 1
+
+        normal = body_navigation._line_normal(angle)
+        reflection = np.eye(2) - 2 * np.outer(normal, normal)
+        reflected = scipy.ndimage.affine_transform(
+            img, reflection, offset=np.asarray(pivot) - reflection.dot(pivot),
+            order=1)
+        return img + reflected
+
+    def test_find_symmetry(self):
+        for angle, pivot in [(90, (100, 110)), (80, (95, 120))]:
+            img = self.symmetric_image(angle, pivot)
+            tr0, tr1, found_angle = body_navigation.find_symmetry(img, degrad=2)
+
+            self.assertAlmostEqual(found_angle, angle, delta=1.0)
+            # true pivot lies on found line
+            normal = body_navigation._line_normal(found_angle)
+            dist = np.abs(normal.dot(np.asarray(pivot) - [tr0, tr1]))
+            self.assertLess(dist, 2.0)
+
+    def synthetic_body(self):
+        shape = [40, 60, 70]
+        data3d = np.full(shape, -1000, dtype=np.int16)
+        zz, yy, xx = np.mgrid[:shape[0], :shape[1], :shape[2]]
+        body = ((yy - 30) ** 2 / 25. ** 2 + (xx - 35) ** 2 / 30. ** 2) < 1
+        data3d[body] = 40
+        for center in [20, 50]:
+            lung = ((yy - 25) ** 2 / 12. ** 2 + (xx - center) ** 2 / 9. ** 2) < 1
+            data3d[(zz < 15) & lung] = -800
+        data3d[((yy - 48) ** 2 + (xx - 35) ** 2) < 25] = 1200
+        return data3d
+
+    def test_distance_maps_are_memoized(self):
+        data3d = self.synthetic_body()
+        ss = body_navigation.BodyNavigation(data3d, [1.5, 1.5, 1.5])
+
+        dl = ss.dist_to_lungs(resize=False)
+        self.assertEqual(dl.dtype, np.float32)
+        self.assertIs(dl, ss.dist_to_lungs(resize=False))
+        self.assertEqual(ss.dist_to_lungs().shape, data3d.shape)
+        self.assertEqual(ss.dist_to_spine().shape, data3d.shape)
+        # lungs and spine are not in the same place
+        self.assertGreater(np.max(dl[ss.get_spine(resize=False)]), 0)
+
+    def test_get_features(self):
+        data3d = self.synthetic_body()
+        ss = body_navigation.BodyNavigation(data3d, [1.5, 1.5, 1.5])
+        fv = ss.get_features(['dist_to_lungs', 'dist_to_surface'])
+
+        self.assertEqual(fv.shape, (data3d.size, 2))
+        self.assertEqual(fv.dtype, np.float32)
+        np.testing.assert_almost_equal(
+            fv[:, 1], ss.dist_to_surface().reshape(-1))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -70,8 +70,86 @@ class DataManipulationTest(unittest.TestCase):
         logger.debug("suma " + str(suma))
         # import ipdb; ipdb.set_trace() #  noqa BREAKPOINT
 
+    def test_keep_and_remove_what_is_in_touch_with_mask(self):
+        data = np.random.rand(20, 21, 22) > 0.7
+        imlab, num_features = scipy.ndimage.measurements.label(data)
+        mask = np.zeros(data.shape, dtype=np.uint8)
+        mask[5:10, 3:15, 8:12] = 1
+        touching = np.unique(imlab[mask > 0])
+        touching = touching[touching > 0]
+        self.assertGreater(len(touching), 1)
+
+        kept = dama.keep_what_is_in_touch_with_mask(
+            imlab.copy(), mask, max_label=num_features)
+        self.assertEqual(kept.dtype, imlab.dtype)
+        np.testing.assert_array_equal(
+            kept, np.where(np.isin(imlab, touching),
+                           imlab, 0))
+
+        imlab16 = imlab.astype(np.uint16)
+        removed = dama.remove_what_is_in_touch_with_mask(imlab16, mask)
+        # image is changed in place
+        self.assertIs(removed, imlab16)
+        np.testing.assert_array_equal(
+            removed, np.where(np.isin(imlab, touching),
+                              0, imlab))
+
 
         
+    def test_add_seeds_mm(self):
+        seeds = np.zeros([10, 40, 50], dtype=np.int8)
+        dama.add_seeds_mm(seeds, [2.0, 1.0, 1.0], [8.5], [10, 30], [20, 25],
+                          label=2, radius=5, width=1)
+        # 8.5 mm and 9.5 mm are both in slice 4
+        self.assertEqual(np.sum(seeds[:4]), 0)
+        self.assertEqual(np.sum(seeds[5:]), 0)
+        xx, yy = np.mgrid[:40, :50]
+        circles = (((xx - 10) ** 2 + (yy - 20) ** 2) < 25) | \
+            (((xx - 30) ** 2 + (yy - 25) ** 2) < 25)
+        np.testing.assert_array_equal(seeds[4] == 2, circles)
+
+    def test_stamp_seeds_mm_sphere(self):
+        seeds = np.zeros([30, 40, 50], dtype=np.int8)
+        dama.stamp_seeds_mm(seeds, [2.0, 1.0, 1.0], [20, 58], [20, 10],
+                            [25, 48], radius_mm=[6, 4], label=[1, 2],
+                            sphere=True)
+        zz, xx, yy = np.indices(seeds.shape)
+        sphere = ((zz * 2 - 20) ** 2 + (xx - 20) ** 2 + (yy - 25) ** 2) < 36
+        np.testing.assert_array_equal(seeds == 1, sphere)
+        # second sphere is cropped by border
+        self.assertGreater(np.sum(seeds == 2), 0)
+        self.assertEqual(seeds[29, 10, 48], 2)
+
+    def test_resize_indexes_and_bbox_slices(self):
+        data = np.random.randint(0, 5, [10, 12, 7])
+        idx = dama.resize_indexes(data.shape, [5, 24, 7])
+        resized = data[np.ix_(*idx)]
+        self.assertEqual(resized.shape, (5, 24, 7))
+        np.testing.assert_array_equal(resized[:, ::2], data[1::2])
+
+        mask = np.zeros([10, 12, 7], dtype=bool)
+        mask[3:5, 6, 1:3] = True
+        self.assertEqual(dama.bbox_slices(mask, margin=[1, 2, 3]),
+                         (slice(2, 6), slice(4, 9), slice(0, 6)))
+        self.assertEqual(dama.bbox_slices(mask * 0),
+                         (slice(None), slice(None), slice(None)))
+
+    def test_write_labels(self):
+        segmentation = np.ones([6, 7, 8], dtype=np.uint8)
+        label_image = np.zeros([6, 7, 8], dtype=int)
+        label_image[1:3, 2:4, 3:5] = 1
+        label_image[2, 3, 4] = 2
+        label_image[4, 5, 6] = 3
+        dama.write_labels(segmentation, label_image, [-1, 5, 7, -1])
+        self.assertEqual(segmentation[1, 2, 3], 5)
+        self.assertEqual(segmentation[2, 3, 4], 7)
+        self.assertEqual(segmentation[4, 5, 6], 1)
+        self.assertEqual(np.sum(segmentation == 1), 6 * 7 * 8 - 8)
+
+        label_image[4, 5, 6] = -1
+        with self.assertRaises(ValueError):
+            dama.write_labels(segmentation, label_image, [-1, 5, 7, -1])
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -5,13 +5,76 @@ import logging
 logger = logging.getLogger(__name__)
 import unittest
 import os.path as op
+import json
+import shutil
+import tempfile
 
+import numpy as np
 import lisa
+import lisa.json_decoder
 import io3d.datasets
 
 path_to_script = op.dirname(op.abspath(__file__))
 
 class DicomWebViewJsonTest(unittest.TestCase):
+    def test_get_segdata_concave_polygon(self):
+        jd = lisa.json_decoder
+        json_data = jd.initJson(3)
+        # L shape, points are x, y
+        str_points = "2,2,12,2,12,6,6,6,6,16,2,16"
+        json_data["drawings"][1][0]["0"] = jd.get_str_drawings(
+            "a1", "liver", str_points, "#00ff40", [150, 10])
+        json_data["drawings"][1][0]["length"] = 1
+        json_data["drawingsDetails"][1][0].append(
+            {"id": "a1", "textExpr": "liver", "longText": "", "quant": None})
+        data = {
+            "segmentation": np.zeros([3, 20, 20], dtype=np.int8),
+            "slab": {"none": 0, "liver": 1},
+        }
+        jd.get_segdata(json_data, data)
+
+        seg = data["segmentation"][1]
+        self.assertEqual(seg[4, 4], 1)
+        self.assertEqual(seg[14, 4], 1)
+        self.assertEqual(seg[4, 10], 1)
+        # concave part is not filled
+        self.assertEqual(seg[12, 12], 0)
+        self.assertEqual(np.sum(data["segmentation"][[0, 2]]), 0)
+        self.assertEqual(jd.description["liver"]["g"], 255)
+
+    def test_write_to_json_and_read(self):
+        jd = lisa.json_decoder
+        segmentation = np.zeros([4, 30, 40], dtype=np.int8)
+        z, x, y = np.mgrid[:4, :30, :40]
+        segmentation[((x - 15) / 10.) ** 2 + ((y - 20) / 15.) ** 2 < 1] = 7
+        segmentation[0] = 0
+        # squares touching only by corner
+        segmentation[0, 10:16, 10:16] = 7
+        segmentation[0, 16:22, 16:22] = 7
+        segmentation[2, 13:17, 18:22] = 2
+        segmentation[3, 1, 1] = 2
+        slab = {"none": 0, "liver": 7, "porta": 2}
+        tmpdir = tempfile.mkdtemp()
+        try:
+            output_file = op.join(tmpdir, "output.json")
+            jd.write_to_json(
+                {"segmentation": segmentation, "slab": slab},
+                output_name=output_file, tolerance=0)
+            with open(output_file) as f:
+                json_data = json.load(f)
+        finally:
+            shutil.rmtree(tmpdir)
+
+        self.assertEqual(len(json_data["drawings"]), 4)
+        self.assertEqual(json_data["drawings"][3][0]["length"], 2)
+        self.assertEqual(json_data["drawings"][1][0]["length"], 2)
+        data = {
+            "segmentation": np.zeros_like(segmentation),
+            "slab": dict(slab),
+        }
+        jd.get_segdata(json_data, data)
+        np.testing.assert_array_equal(data["segmentation"], segmentation)
+
     @unittest.skip("waiting for finishing the import function")
     def test_json_ircad_import(self):
         input_annotation_file = op.join(path_to_script, "test_dwv_3Dircadb1.12.json")
@@ -376,6 +376,24 @@ class ExperimentsTest(unittest.TestCase):
         eval1 = ve.distance_matrics(vol1, vol2, [0.5, 0.5, 0.5])
         self.assertAlmostEquals(eval1[2], np.sqrt(2))
 
+    def test_eval_sliver_distance_percentile(self):
+        """
+        Hausdorff distance percentile is not greater then maximal distance.
+        """
+
+        vol1 = np.zeros([20, 21, 22], dtype=np.int8)
+        vol1[10:15, 10:15, 10:15] = 1
+
+        vol2 = np.zeros([20, 21, 22], dtype=np.int8)
+        vol2[8:17, 8:17, 8:17] = 1
+
+        avgd, rmsd, maxd, prc = ve.distance_matrics(
+            vol1, vol2, [1, 1, 1], percentiles=[95, 100])
+
+        self.assertAlmostEqual(maxd, 3 ** (0.5) * 2)
+        self.assertLessEqual(prc[0], maxd)
+        self.assertAlmostEqual(prc[1], maxd)
+
     @attr("incomplete")
     def test_compare_eval_sliver_distance(self):
         """
@@ -478,6 +496,42 @@ class ExperimentsTest(unittest.TestCase):
         # if os.path.exists(d):
         shutil.rmtree(pklz_dir)
 
+    def test_volumetry_evaluation_cache_key(self):
+        """
+        Cache key is stable for unchanged files and it is changed when the
+        file is modified.
+        """
+        import tempfile
+
+        tmpdir = tempfile.mkdtemp()
+        fn1 = os.path.join(tmpdir, 'liver-seg001.mhd')
+        fn2 = os.path.join(tmpdir, 'soubor_seg001.pklz')
+        for fn in [fn1, fn2]:
+            with open(fn, 'w') as f:
+                f.write('a')
+
+        key1 = ve._evaluation_cache_key([fn1, fn2], None, None)
+        key2 = ve._evaluation_cache_key([fn1, fn2], None, None)
+        key_special = ve._evaluation_cache_key([fn1, fn2], None, speceval)
+        with open(fn2, 'w') as f:
+            f.write('changed')
+        key3 = ve._evaluation_cache_key([fn1, fn2], None, None)
+
+        self.assertEqual(key1, key2)
+        self.assertNotEqual(key1, key_special)
+        self.assertNotEqual(key1, key3)
+        shutil.rmtree(tmpdir)
+
+    def test_volumetry_evaluation_merge_evaluations(self):
+        evaluation_list = [
+            {'file1': 'a1', 'file2': 'b1', 'avgd': 1.0, 'one': 1},
+            {'file1': 'a2', 'file2': 'b2', 'avgd': 2.0, 'one': 1},
+        ]
+        evaluation_all = ve.merge_evaluations(evaluation_list)
+        self.assertEqual(evaluation_all['file1'], ['a1', 'a2'])
+        self.assertEqual(evaluation_all['avgd'], [1.0, 2.0])
+        self.assertEqual(evaluation_all['one'], [1, 1])
+
     def test_volumetry_evaluation_sliver_score(self):
         """
         Testing Volume Difference score. Score for negative values must be
@@ -135,6 +135,25 @@ class LesionsTest(unittest.TestCase):
 
         self.assertLess(errorrate,0.1)
 
+    def test_region_properties(self):
+        """
+        Compact cube and flat plate. Plate is less compact.
+        """
+        from lisa import lesions
+        labels = np.zeros([30, 30, 30], dtype=np.int32)
+        labels[2:8, 2:8, 2:8] = 1
+        labels[15:25, 10:12, 3:28] = 2
+
+        props = lesions.get_region_properties(labels)
+
+        self.assertEqual(len(props), 2)
+        self.assertEqual(props['size'][0], 216)
+        self.assertEqual(props['size'][1], 500)
+        self.assertGreater(props['compactness'][0], 0.9)
+        self.assertLess(props['compactness'][1], props['compactness'][0])
+        np.testing.assert_almost_equal(props['centroid'][0], [4.5, 4.5, 4.5])
+        np.testing.assert_equal(props['bbox'][1], [[15, 25], [10, 12], [3, 28]])
+
 
 
 
@@ -0,0 +1,122 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os.path
+import sys
+import shutil
+import tempfile
+import unittest
+import numpy as np
+
+path_to_script = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(path_to_script, "../lisa/"))
+
+from lisa import lisa_container
+
+
+class LisaContainerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def generate_dataplus(self):
+        data3d = np.random.randint(-1000, 1000, [20, 30, 40]).astype(np.int16)
+        segmentation = np.zeros([20, 30, 40], dtype=np.uint8)
+        segmentation[5:10, 10:20, 10:30] = 1
+        return {
+            'data3d': data3d,
+            'segmentation': segmentation,
+            'voxelsize_mm': [1.0, 0.5, 0.5],
+            'slab': {'none': 0, 'liver': 1},
+            'processing_information': {
+                'organ_segmentation': {
+                    'seeds': segmentation * 2,
+                    'processing_time': 3.5,
+                }
+            },
+        }
+
+    def test_write_and_read(self):
+        datap = self.generate_dataplus()
+        path = os.path.join(self.tmpdir, "case.lisa")
+        lisa_container.write(datap, path, chunks=[4, 16, 16])
+        self.assertTrue(lisa_container.is_container(path))
+
+        loaded = lisa_container.read(path)
+        np.testing.assert_array_equal(loaded['data3d'], datap['data3d'])
+        np.testing.assert_array_equal(
+            loaded['segmentation'], datap['segmentation'])
+        np.testing.assert_array_equal(
+            loaded['processing_information']['organ_segmentation']['seeds'],
+            datap['processing_information']['organ_segmentation']['seeds'])
+        self.assertEqual(loaded['slab'], datap['slab'])
+        self.assertEqual(
+            loaded['processing_information']['organ_segmentation']
+            ['processing_time'], 3.5)
+
+    def test_lazy_read(self):
+        datap = self.generate_dataplus()
+        path = os.path.join(self.tmpdir, "case.lisa")
+        for compression in ["zlib", None]:
+            lisa_container.write(
+                datap, path, compression=compression, chunks=[4, 16, 16])
+            loaded = lisa_container.read(path, lazy=True)
+            data3d = loaded['data3d']
+            self.assertEqual(data3d.shape, (20, 30, 40))
+            np.testing.assert_array_equal(data3d[7], datap['data3d'][7])
+            np.testing.assert_array_equal(
+                data3d[3:11, -5:, 2:37:3], datap['data3d'][3:11, -5:, 2:37:3])
+            np.testing.assert_array_equal(
+                data3d[..., 5], datap['data3d'][..., 5])
+            np.testing.assert_array_equal(
+                np.asarray(loaded['segmentation']), datap['segmentation'])
+
+    def test_incremental_write(self):
+        datap = self.generate_dataplus()
+        path = os.path.join(self.tmpdir, "case.lisa")
+        lisa_container.write(datap, path, chunks=[4, 16, 16])
+        # zero chunks are not stored
+        n_seg_files = len(os.listdir(os.path.join(path, "segmentation")))
+        self.assertEqual(n_seg_files, 1 + 2 * 2 * 2)
+
+        n_written = lisa_container.write(datap, path, chunks=[4, 16, 16])
+        self.assertEqual(n_written, 0)
+
+        datap['segmentation'][17, 25, 35] = 2
+        n_written = lisa_container.write(datap, path, chunks=[4, 16, 16])
+        self.assertEqual(n_written, 1)
+        loaded = lisa_container.read(path)
+        np.testing.assert_array_equal(
+            loaded['segmentation'], datap['segmentation'])
+
+    def test_uncompressed_memmap(self):
+        datap = self.generate_dataplus()
+        path = os.path.join(self.tmpdir, "case.lisa")
+        lisa_container.write(datap, path, compression=None)
+        loaded = lisa_container.read(path, lazy=True)
+        data3d = np.asarray(loaded['data3d'])
+        segmentation = np.asarray(loaded['segmentation'])
+        self.assertIsInstance(data3d.base, np.memmap)
+        np.testing.assert_array_equal(data3d, datap['data3d'])
+
+        # memory-mapped data are copy-on-write
+        segmentation[17, 25, 35] = 2
+        self.assertEqual(
+            np.asarray(loaded['segmentation'])[17, 25, 35], 0)
+
+        # container can be rewritten while its arrays are memory-mapped
+        n_written = lisa_container.write(
+            {'data3d': data3d, 'segmentation': segmentation,
+             'voxelsize_mm': datap['voxelsize_mm']},
+            path, compression=None)
+        self.assertEqual(n_written, 1)
+        np.testing.assert_array_equal(data3d, datap['data3d'])
+        loaded = lisa_container.read(path)
+        np.testing.assert_array_equal(loaded['segmentation'], segmentation)
+
+
+if __name__ == "__main__":
+    unittest.main()
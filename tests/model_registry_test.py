@@ -0,0 +1,57 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os.path
+import sys
+import shutil
+import tempfile
+import unittest
+
+path_to_script = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(path_to_script, "../lisa/"))
+
+from lisa import model_registry
+
+
+class ModelRegistryTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tmpdir, "model.txt")
+        with open(self.filename, "w") as f:
+            f.write("first")
+        self.n_loads = 0
+        model_registry.clear()
+
+    def tearDown(self):
+        model_registry.clear()
+        shutil.rmtree(self.tmpdir)
+
+    def loader(self, filename):
+        self.n_loads += 1
+        with open(filename) as f:
+            return [f.read()]
+
+    def test_model_is_loaded_once(self):
+        mdl1 = model_registry.get(self.filename, self.loader, kind="txt")
+        mdl2 = model_registry.get(self.filename, self.loader, kind="txt")
+        self.assertIs(mdl1, mdl2)
+        self.assertEqual(self.n_loads, 1)
+
+        # modified file is loaded again
+        with open(self.filename, "w") as f:
+            f.write("second model")
+        mdl3 = model_registry.get(self.filename, self.loader, kind="txt")
+        self.assertEqual(mdl3, ["second model"])
+        self.assertEqual(self.n_loads, 2)
+
+        with model_registry.measure(self.filename):
+            pass
+        stats = model_registry.get_stats()[os.path.abspath(self.filename)]
+        self.assertEqual(stats["n_loads"], 2)
+        self.assertEqual(stats["n_requests"], 3)
+        self.assertEqual(stats["n_inferences"], 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
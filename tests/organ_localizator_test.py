@@ -75,5 +75,57 @@ class LocalizationTests(unittest.TestCase):
         # less then 10% error expected
         self.assertGreater(np.prod(seg.shape)*0.1, err)
 
+    def test_feature_vector_pipeline_gaussian_cache(self):
+        import scipy.ndimage
+        data3d = (np.random.rand(20, 25, 30) * 500).astype(np.int16)
+        pipeline = organ_model.FeatureVectorPipeline()
+        g05 = pipeline.gaussian(data3d, [1.5, 1.5, 1.5], 0.5)
+        g3 = pipeline.gaussian(data3d, [1.5, 1.5, 1.5], 3)
+
+        self.assertIs(g05, pipeline.gaussian(data3d, [1.5, 1.5, 1.5], 0.5))
+        self.assertIs(g3, pipeline.gaussian(data3d, [1.5, 1.5, 1.5], 3))
+        # the same features as computed without pipeline, bigger sigma is
+        # not computed from cached smaller one
+        np.testing.assert_array_equal(
+            g05, scipy.ndimage.filters.gaussian_filter(data3d, sigma=0.5))
+        g3_direct = scipy.ndimage.filters.gaussian_filter(data3d, sigma=3)
+        self.assertEqual(g3.dtype, g3_direct.dtype)
+        np.testing.assert_array_equal(g3, g3_direct)
+
+        # other volume is not taken from cache
+        data3d_other = data3d.copy()
+        data3d_other[5, 5, 5] += 100
+        g3_other = pipeline.gaussian(data3d_other, [1.5, 1.5, 1.5], 3)
+        self.assertIsNot(g3_other, g3)
+
+    def test_feature_cache_is_released(self):
+        data3d = (np.random.rand(20, 25, 30) * 500).astype(np.int16)
+        with organ_model.feature_cache() as pipeline:
+            self.assertIs(organ_model.get_feature_vector_pipeline(), pipeline)
+            pipeline.gaussian(data3d, [1.5, 1.5, 1.5], 3)
+            self.assertEqual(len(pipeline._gaussians), 1)
+        self.assertEqual(len(pipeline._gaussians), 0)
+        self.assertIsNone(pipeline._data)
+        self.assertIsNot(organ_model.get_feature_vector_pipeline(), pipeline)
+
+    def test_feature_vector_pipeline_seeds_selection(self):
+        data3d = (np.random.rand(20, 25, 30) * 500).astype(np.int16)
+        seeds = np.zeros(data3d.shape, dtype=np.int8)
+        seeds[5, 5, 5:10] = 1
+        seeds[10, 10, 10] = 2
+        pipeline = organ_model.FeatureVectorPipeline()
+        g05 = pipeline.gaussian(data3d, [1.5, 1.5, 1.5], 0.5)
+        columns = [g05, 7.0]
+
+        fv = pipeline._fill_feature_matrix(columns)
+        self.assertEqual(fv.shape, (data3d.size, 2))
+
+        fv, sd = pipeline._fill_feature_matrix(columns, seeds, [1, 2])
+        self.assertEqual(fv.shape, (6, 2))
+        self.assertEqual(fv.dtype, np.float32)
+        self.assertTrue(np.all(fv[:, 1] == 7.0))
+        self.assertEqual(list(sd.reshape(-1)), [1, 1, 1, 1, 1, 2])
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,50 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import unittest
+import numpy as np
+
+from lisa import organ_seeds
+
+
+class OrganSeedsTest(unittest.TestCase):
+
+    def test_negative_train_seeds_blobs(self):
+        mask = np.zeros([10, 60, 80], dtype=bool)
+        # big square and small square in slice 5
+        mask[5, 5:45, 5:45] = True
+        mask[5, 10:40, 48:78] = True
+        seeds = np.zeros(mask.shape, dtype=np.int8)
+
+        organ_seeds.add_negative_train_seeds_blobs(
+            mask, seeds, [1.0, 1.0, 1.0], [1.0, 1.0, 1.0], 5.0,
+            n_seed_blob=2)
+
+        self.assertEqual(np.sum(seeds[:5]), 0)
+        self.assertEqual(np.sum(seeds[7:]), 0)
+        # one blob in the middle of each square
+        self.assertEqual(seeds[5, 25, 8], 2)
+        self.assertEqual(seeds[5, 25, 75], 2)
+
+    def test_likelihoods_from_image_computes_features_once(self):
+        class ModelStub(object):
+            n_fv = 0
+
+            def features_from_image(self, data, voxelsize):
+                self.n_fv += 1
+                return data.reshape(-1, 1)
+
+            def likelihood(self, fv, cl):
+                return fv[:, 0] * (cl + 1)
+
+        mdl = ModelStub()
+        data = np.random.rand(3, 4, 5)
+        lik1, lik2 = organ_seeds.likelihoods_from_image(
+            mdl, data, [1, 1, 1], [0, 1])
+        self.assertEqual(mdl.n_fv, 1)
+        np.testing.assert_array_equal(lik1, data)
+        np.testing.assert_array_equal(lik2, 2 * data)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -5,6 +5,8 @@
 # import funkcí z jiného adresáře
 import sys
 import os.path
+import shutil
+import tempfile
 
 # imcut_path =  os.path.join(path_to_script, "../../imcut/")
 # sys.path.insert(0, imcut_path)
@@ -296,6 +298,16 @@ and background")
         self.box_segmentation_template(params, noise_sigma=4)
         # dcmdir = os.path.join(path_to_script,'./../sample_data/matlab/examples/sample_data/DICOM/digest_article/') # noqa
 
+    def test_box_segmentation_in_roi(self):
+        """
+        Only bounding box of seeds with margin is resampled and segmented.
+        """
+        params = {
+            'segmentation_smoothing': False,
+            'seg_preproc_pars': {'roi_margin_mm': 60},
+        }
+        self.box_segmentation_template(params)
+
     def box_segmentation_template(self, params, noise_sigma=3):
         """
         Function uses organ_segmentation  for synthetic box object
@@ -486,5 +498,58 @@ and background")
         self.assertNotEqual(orig_shape[1], oseg.data3d.shape[1])
         self.assertNotEqual(orig_shape[2], oseg.data3d.shape[2])
 
+    def test_save_and_load_lisa_container(self):
+        img3d, metadata, seeds, segmentation = self.generate_data()
+        tmpdir = tempfile.mkdtemp()
+        oseg = organ_segmentation.OrganSegmentation(
+            None, data3d=img3d, metadata=metadata, output_datapath=tmpdir,
+            experiment_caption="case", save_filetype="lisa",
+            save_compression=None, autocrop=False)
+        oseg.segmentation = segmentation.copy()
+        oseg.seeds = None
+        oseg.save_outputs()
+        oseg.segmentation[3, 3, 3] = 2
+        # existing container is updated
+        oseg.save_outputs()
+        path = oseg.get_standard_ouptut_filename()
+        self.assertEqual(os.path.basename(path), "case.lisa")
+
+        oseg2 = organ_segmentation.OrganSegmentation(
+            None, metadata=metadata, autocrop=False)
+        oseg2.load_data(path)
+        # uncompressed data are memory-mapped
+        self.assertIsInstance(oseg2.data3d.base, np.memmap)
+        np.testing.assert_array_equal(oseg2.data3d, img3d)
+        self.assertEqual(oseg2.segmentation[3, 3, 3], 2)
+        # missing seeds are generated
+        self.assertEqual(oseg2.seeds.shape, img3d.shape)
+        shutil.rmtree(tmpdir)
+
+    def test_write_label_image_and_relabel(self):
+        oseg = organ_segmentation.OrganSegmentation()
+        oseg.segmentation = np.zeros([5, 6, 7], dtype=np.uint8)
+        oseg.segmentation[1:4, 1:5, 1:6] = 1
+        oseg.slab = {"none": 0, "liver": 1}
+        label_image = np.zeros([5, 6, 7], dtype=np.int8)
+        label_image[2, 2:4, 2:4] = 1
+        label_image[3, 3, 3] = 2
+        oseg.write_label_image(label_image, {1: "porta", 2: 300})
+        self.assertIn("porta", oseg.slab)
+        self.assertEqual(oseg.segmentation[2, 2, 2], oseg.slab["porta"])
+        self.assertEqual(oseg.segmentation[3, 3, 3], 300)
+        self.assertEqual(oseg.segmentation[1, 1, 1], 1)
+        # unknown numeric label is added as by nlabels()
+        self.assertEqual(oseg.slab["300"], 300)
+
+        oseg.relabel_segmentation({"liver": 0, 300: "liver"})
+        self.assertEqual(oseg.segmentation[1, 1, 1], 0)
+        self.assertEqual(oseg.segmentation[3, 3, 3], 1)
+        self.assertEqual(oseg.segmentation[2, 2, 2], oseg.slab["porta"])
+
+        with self.assertRaises(ValueError):
+            oseg.write_label_image(label_image, {1: -1})
+        with self.assertRaises(ValueError):
+            oseg.write_label_image(-label_image, {-1: "porta"})
+
 if __name__ == "__main__":
     unittest.main()
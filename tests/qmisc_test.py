@@ -41,6 +41,25 @@ class QmiscTest(unittest.TestCase):
         data2 = dataSM.todense()
         self.assertTrue(np.all(data == data2))
 
+    def test_sparse_matrix_runs(self):
+        data = np.zeros([20, 30, 40], dtype=np.int8)
+        data[5:10, 10:20, 3:30] = 1
+        data[7, 12, 5:8] = 2
+        data[-1, -1, -1] = 3
+
+        dataSM = qmisc.SparseMatrix(data)
+        self.assertEqual(len(dataSM.starts), 5 * 10 + 2 + 1)
+        data2 = dataSM.todense()
+        self.assertEqual(data2.dtype, data.dtype)
+        np.testing.assert_array_equal(data, data2)
+
+        self.assertTrue(
+            qmisc.isSparseMatrix(qmisc.sparse_if_mostly_empty(data)))
+        noise = np.random.randint(0, 2, [10, 10, 10])
+        self.assertIs(qmisc.sparse_if_mostly_empty(noise), noise)
+        np.testing.assert_array_equal(
+            qmisc.todense(qmisc.sparse_if_mostly_empty(data)), data)
+
     def test_obj_to_and_from_file_yaml(self):
         testdata = np.random.random([4, 4, 3])
         test_object = {'a': 1, 'data': testdata}
@@ -31,6 +31,129 @@ class ResectionTest(unittest.TestCase):
     def test_nothing(self):
         self.fail("shouldn't happen")
 
+    def test_cut_by_planes(self):
+        organ = np.zeros([20, 21, 22], dtype=bool)
+        organ[5:15, 3:18, 4:12] = True
+        voxelsize_mm = [2.0, 1.0, 0.5]
+        # plane x = 20 mm and plane z = 3 mm
+        planes = [([20.0, 0, 0], [1, 0, 0]), ([0, 0, 3.0], [0, 0, 1])]
+        removed, bbox, resected_volume_mm3, organ_volume_mm3 = \
+            lisa.virtual_resection.cut_by_planes(organ, voxelsize_mm, planes)
+        self.assertEqual(removed.shape, (10, 15, 8))
+        expected = np.zeros([20, 21, 22], dtype=bool)
+        expected[:11] = True
+        expected[:, :, :7] = True
+        expected &= organ
+        np.testing.assert_array_equal(removed, expected[bbox])
+        self.assertAlmostEqual(organ_volume_mm3, 10 * 15 * 8)
+        self.assertAlmostEqual(resected_volume_mm3, np.sum(expected))
+
+    def test_voronoi_partition(self):
+        # two halves connected only by top rows
+        mask = np.zeros([20, 40], dtype=bool)
+        mask[:, :18] = True
+        mask[:, 22:] = True
+        mask[0:3, :] = True
+        seeds = np.zeros([20, 40], dtype=np.int8)
+        seeds[19, 17] = 1
+        seeds[19, 35] = 2
+
+        partition = lisa.virtual_resection.voronoi_partition(seeds, mask=mask)
+        self.assertEqual(partition[19, 23], 1)
+        self.assertEqual(partition[19, 20], 0)
+
+        partition, distance = lisa.virtual_resection.voronoi_partition(
+            seeds, mask=mask, geodesic=True, return_distance=True)
+        self.assertEqual(partition[19, 23], 2)
+        self.assertEqual(partition[19, 10], 1)
+        self.assertAlmostEqual(distance[19, 30], 5.0)
+
+        partition = lisa.virtual_resection.voronoi_partition(
+            seeds, mask=mask, weights={1: 3.0})
+        self.assertEqual(partition[19, 30], 1)
+
+    def test_split_organ_by_two_vessels_equal_distance(self):
+        segmentation = np.zeros([5, 10, 11], dtype=np.int8)
+        segmentation[1:4, 2:8, 1:10] = 1
+        seeds = np.zeros([5, 10, 11], dtype=np.int8)
+        seeds[2, 5, 2] = 1
+        seeds[2, 5, 8] = 2
+        datap = {
+            'segmentation': segmentation,
+            'slab': {'none': 0, 'liver': 1},
+            'voxelsize_mm': [1.0, 1.0, 1.0],
+        }
+        segm, dist1, dist2 = lisa.virtual_resection.split_organ_by_two_vessels(
+            datap, seeds, return_distances=False)
+        # voxels in the middle belong to the first vessel
+        self.assertEqual(segm[2, 3, 5], 1)
+        self.assertEqual(segm[2, 3, 6], 2)
+        self.assertEqual(segm[0, 3, 5], 0)
+        self.assertIsNone(dist1)
+
+    def test_split_vessel(self):
+        segmentation = np.zeros([30, 35, 40], dtype=np.int8)
+        # trunk and two branches
+        segmentation[15:17, 15:17, 2:38] = 1
+        segmentation[5:15, 15:17, 20:22] = 1
+        segmentation[17:28, 15:17, 10:12] = 1
+        datap = {
+            'segmentation': segmentation,
+            'data3d': segmentation,
+            'slab': {'none': 0, 'porta': 1},
+        }
+        seeds = np.zeros([30, 35, 40], dtype=np.int8)
+        # cut the trunk between branches, label 3 marks the part with
+        # output label 1
+        seeds[16, 16, 15] = 1
+        seeds[16, 16, 35] = 3
+        lab, cut = lisa.virtual_resection.split_vessel(
+            datap, seeds, dilatation_iterations=1, vessel_volume_threshold=0.95)
+        self.assertEqual(lab[16, 16, 35], 1)
+        self.assertEqual(lab[10, 16, 21], 1)
+        self.assertEqual(lab[16, 16, 3], 2)
+        self.assertEqual(lab[25, 16, 11], 2)
+        self.assertEqual(lab[16, 16, 15], 0)
+
+    def test_split_vessel_separate_labels(self):
+        segmentation = np.zeros([30, 35, 40], dtype=np.int8)
+        segmentation[15:17, 15:17, 2:38] = 1
+        datap = {
+            'segmentation': segmentation,
+            'data3d': segmentation,
+            'slab': {'none': 0, 'porta': 1},
+        }
+        seeds = np.zeros([30, 35, 40], dtype=np.int8)
+        seeds[16, 16, 20] = 1
+        # seeds close to the cut are removed by the last dilatation
+        seeds[16, 16, 23] = 3
+        seeds[16, 16, 17] = 2
+        lab, cut = lisa.virtual_resection.split_vessel(
+            datap, seeds, method="separate labels", input_seeds_label2=2)
+        self.assertEqual(np.sum((lab > 0) & (segmentation == 0)), 0)
+        self.assertEqual(lab[16, 16, 35], 1)
+        self.assertEqual(lab[16, 16, 3], 2)
+        self.assertEqual(lab[16, 16, 20], 0)
+
+    def test_split_vessel_equal_parts(self):
+        segmentation = np.zeros([26, 26, 26], dtype=np.int8)
+        segmentation[12, 2:23, 12] = 1
+        segmentation[0:12, 22, 12] = 1
+        segmentation[13:25, 2, 12] = 1
+        datap = {
+            'segmentation': segmentation,
+            'data3d': segmentation,
+            'slab': {'none': 0, 'porta': 1},
+        }
+        seeds = np.zeros([26, 26, 26], dtype=np.int8)
+        seeds[12, 12, 12] = 1
+        lab, cut = lisa.virtual_resection.split_vessel(datap, seeds)
+        self.assertEqual(np.sum(lab == 1), np.sum(lab == 2))
+        # parts with equal size are ordered by the first voxel, without
+        # separate seed the first part gets output_label2
+        self.assertEqual(lab[0, 22, 12], 2)
+        self.assertEqual(lab[20, 2, 12], 1)
+
     @attr('interactive')
     def test_planar_resection(self):
         """
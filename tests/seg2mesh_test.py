@@ -0,0 +1,56 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os.path
+import sys
+import unittest
+import numpy as np
+
+path_to_script = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(path_to_script, "../lisa/"))
+
+from lisa import seg2mesh
+
+
+class Seg2MeshTest(unittest.TestCase):
+
+    def test_surface_mesh_of_box(self):
+        voxels = np.zeros([10, 11, 12], dtype=np.int8)
+        voxels[2:6, 3:8, 0:4] = 1
+        dims = np.array([1.0, 2.0, 0.5])
+
+        coors, elems, etype = seg2mesh.gen_mesh_from_voxels(
+            voxels, dims, etype='q', mtype='s')
+        self.assertEqual(etype, '2_4')
+        self.assertEqual(len(elems), 2 * (4 * 5 + 5 * 4 + 4 * 4))
+        # nodes on surface of 5 x 6 x 5 lattice
+        self.assertEqual(len(coors), 5 * 6 * 5 - 3 * 4 * 3)
+        np.testing.assert_array_equal(coors.min(axis=0), [2, 6, 0])
+        np.testing.assert_array_equal(coors.max(axis=0), [6, 16, 2])
+
+        # every edge is shared by two faces
+        edges = np.sort(
+            np.concatenate([elems[:, [0, 1]], elems[:, [1, 2]],
+                            elems[:, [2, 3]], elems[:, [3, 0]]]), axis=1)
+        _, counts = np.unique(edges[:, 0] * len(coors) + edges[:, 1],
+                              return_counts=True)
+        self.assertTrue(np.all(counts == 2))
+
+    def test_surface_mesh_does_not_depend_on_chunks(self):
+        voxels = np.random.rand(15, 9, 8) > 0.6
+        dims = np.array([1.0, 1.0, 1.0])
+        coors, elems, etype = seg2mesh.gen_surface_mesh_from_voxels(
+            voxels, dims, etype='t', chunk_size=100)
+        for chunk_size in [1, 4]:
+            coors_ch, elems_ch, etype_ch = \
+                seg2mesh.gen_surface_mesh_from_voxels(
+                    voxels, dims, etype='t', chunk_size=chunk_size)
+            np.testing.assert_array_equal(coors, coors_ch)
+            np.testing.assert_array_equal(elems, elems_ch)
+
+        smoothed = seg2mesh.smooth_mesh(coors, elems, etype)
+        self.assertEqual(smoothed.shape, coors.shape)
+
+
+if __name__ == "__main__":
+    unittest.main()
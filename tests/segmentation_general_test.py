@@ -0,0 +1,38 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import unittest
+import numpy as np
+
+from lisa import segmentation_general
+
+
+class SegmentationGeneralTest(unittest.TestCase):
+
+    def test_segmentation_smoothing_keeps_volume(self):
+        slab = {'none': 0, 'liver': 1, 'porta': 2}
+        segmentation = np.zeros([60, 70, 80], dtype=np.int8)
+        segmentation[10:30, 20:50, 30:45] = 1
+        segmentation[40:45, 10:15, 10:15] = 2
+        segmentation_orig = segmentation.copy()
+
+        segmentation_general.segmentation_smoothing(
+            segmentation, 3, labels=1, voxelsize_mm=[1, 1.5, 2], slab=slab)
+
+        self.assertEqual(np.sum(segmentation == 1),
+                         np.sum(segmentation_orig == 1))
+        # other labels are not touched
+        self.assertTrue(np.array_equal(
+            segmentation == 2, segmentation_orig == 2))
+        # corners of box are rounded
+        self.assertEqual(segmentation[10, 20, 30], 0)
+
+    def test_threshold_for_volume(self):
+        data = np.random.rand(10, 11, 12)
+        for volume in [0, 1, 100, 500, data.size]:
+            thr = segmentation_general._threshold_for_volume(data, volume)
+            self.assertEqual(np.sum(data > thr), volume)
+
+
+if __name__ == "__main__":
+    unittest.main()
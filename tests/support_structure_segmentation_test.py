@@ -95,6 +95,37 @@ class SupportStructureSegmentationTest(unittest.TestCase):
         # import pdb; pdb.set_trace()
 
 
+class SupportStructureSegmentationToolsTest(unittest.TestCase):
+
+    def test_polynomial_surface(self):
+        x = np.random.randint(0, 20, 300)
+        y = np.random.randint(0, 22, 300)
+        z = 3 + 0.5 * x - 0.02 * y ** 2 + 0.01 * x * y
+        coefs, powers = \
+            lisa.support_structure_segmentation.fit_polynomial_surface(
+                x, y, z, 2)
+        z2 = lisa.support_structure_segmentation.eval_polynomial_surface(
+            coefs, powers, x, y)
+        np.testing.assert_allclose(z2, z, atol=1e-8)
+
+    def test_separable_heart_structure(self):
+        import scipy.ndimage.filters as filters
+        data3d = np.zeros([20, 15, 16], dtype=np.int16)
+        sss = lisa.support_structure_segmentation.SupportStructureSegmentation(
+            data3d=data3d, voxelsize_mm=[2.0, 2.0, 2.0])
+        a = np.zeros([9, 9, 9])
+        a[4, 4, 4] = 1
+        structure = filters.gaussian_filter(a, sss.voxelsize_mm)
+        structure[:4] *= -1
+        structure[4] = 0
+        np.testing.assert_allclose(
+            sss.convolve_structure_heart(), structure, atol=1e-12)
+
+        sizes = lisa.support_structure_segmentation.component_sizes(
+            np.array([0, 1, 1, 3, 0, 3, 3]), 3)
+        np.testing.assert_array_equal(sizes, [0, 2, 0, 3])
+
+
 #    def test_synthetic_data_lesions_automatic_localization(self):
 #        """
 #        Function uses lesions  automatic localization in synthetic data.
@@ -20,6 +20,42 @@ class TextureFeaturesExperimentTest(unittest.TestCase):
 
     # @unittest.skip("comment after implementation")
 
+    def test_features_in_tiles(self):
+        """
+        Tile views and feature matrix are compared with tiles cutted one by
+        one.
+        """
+        import numpy as np
+        data3d = np.random.randint(-200, 200, [21, 30, 32]).astype(np.int16)
+        segmentation = np.zeros(data3d.shape, dtype=np.int8)
+        segmentation[:10, 5:20, :] = 1
+        tile_shape = [5, 10, 10]
+
+        cindexes, features, cover = tls.get_features_in_tiles(
+            data3d, segmentation, tile_shape, tls.feat_hist, [])
+        self.assertEqual(features.dtype, np.float32)
+        self.assertEqual(features.shape[0], len(cindexes))
+        for i, cindex in enumerate(cindexes):
+            tile = tls.cut_tile(data3d, cindex, tile_shape)
+            tile_seg = tls.cut_tile(segmentation, cindex, tile_shape)
+            np.testing.assert_array_equal(features[i], tls.feat_hist(tile))
+            self.assertAlmostEqual(
+                cover[i],
+                np.sum(tile_seg > 0) / float(np.prod(tile_shape)))
+
+        cindexes, features_skip, cover_skip = tls.get_features_in_tiles(
+            data3d, segmentation, tile_shape, tls.feat_hist, [],
+            skip_empty=True, n_jobs=2)
+        np.testing.assert_array_equal(features_skip[cover > 0],
+                                      features[cover > 0])
+        self.assertTrue(np.all(features_skip[cover == 0] == 0))
+
+        labels = tls.arrange_to_tiled_data(cindexes, tile_shape,
+                                           data3d.shape, cover > 0)
+        for i, cindex in enumerate(cindexes):
+            tile = tls.cut_tile(labels, cindex, tile_shape)
+            self.assertTrue(np.all(tile == (cover[i] > 0)))
+
     @attr('slow')
     def test_run_experiments(self):
         """
@@ -0,0 +1,85 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import unittest
+import numpy as np
+from scipy import ndimage as nd
+
+from lisa import texture_features as tfeat
+
+
+class TextureFeaturesTest(unittest.TestCase):
+
+    def test_gabor_batch_same_as_convolution(self):
+        gf = tfeat.GaborFeatures()
+        patches = np.random.randint(-100, 200, [3, 2, 20, 25])
+
+        fv = gf.feats_gabor_batch(patches)
+        self.assertEqual(fv.shape, (3, 2 * len(gf.kernels)))
+        for i in range(patches.shape[0]):
+            for k, kernel in enumerate(gf.kernels):
+                filtered = nd.convolve(patches[i, 0].astype(np.double),
+                                       kernel, mode='wrap')
+                self.assertAlmostEqual(fv[i, 2 * k], filtered.mean())
+                self.assertAlmostEqual(
+                    fv[i, 2 * k + 1] / filtered.var(), 1.0)
+
+        fv3d = gf.feats_gabor_batch(patches, full3d=True)
+        filtered = nd.convolve(patches[1].astype(np.double),
+                               gf.kernels[3][np.newaxis], mode='wrap')
+        self.assertAlmostEqual(fv3d[1, 6], filtered.mean())
+        self.assertAlmostEqual(fv3d[1, 7] / filtered.var(), 1.0)
+
+    def test_gabor_integer_data(self):
+        gf = tfeat.GaborFeatures()
+        data3d = np.random.randint(-100, 200, [20, 25, 2]).astype(np.int16)
+        fv = gf.feats_gabor(data3d)
+        for k, kernel in enumerate(gf.kernels):
+            # output of convolution has dtype of input
+            filtered = nd.convolve(data3d[:, :, 0], kernel, mode='wrap')
+            self.assertAlmostEqual(fv[2 * k], filtered.mean())
+            self.assertAlmostEqual(fv[2 * k + 1] / filtered.var(), 1.0)
+
+    def test_glcm_batch(self):
+        glcmf = tfeat.GlcmFeatures(levels=16, distances=[1, 3],
+                                   angles=[0, np.pi / 4, np.pi / 2])
+        patches = np.random.randint(-100, 300, [4, 3, 15, 12])
+        quantized = glcmf.quantize(patches)
+        self.assertEqual(quantized.max() < 16, True)
+
+        glcm = glcmf.glcm_batch(quantized[:, :1])
+        glcm3d = glcmf.glcm_batch(quantized)
+        for i in range(patches.shape[0]):
+            for d, distance in enumerate(glcmf.distances):
+                for a, angle in enumerate(glcmf.angles):
+                    row = int(round(np.sin(angle) * distance))
+                    col = int(round(np.cos(angle) * distance))
+                    expected = np.zeros([16, 16])
+                    for z in range(quantized.shape[1]):
+                        for r in range(15 - row):
+                            for c in range(12 - col):
+                                expected[quantized[i, z, r, c],
+                                         quantized[i, z, r + row,
+                                                   c + col]] += 1
+                        if z == 0:
+                            expected0 = expected + expected.T
+                    expected = expected + expected.T
+                    np.testing.assert_almost_equal(
+                        glcm[i, :, :, d, a], expected0 / expected0.sum())
+                    np.testing.assert_almost_equal(
+                        glcm3d[i, :, :, d, a], expected / expected.sum())
+
+        fv = glcmf.feats_glcm_batch(patches, full3d=True)
+        self.assertEqual(fv.shape, (4, 5 * 2 * 3))
+        # ASM and energy
+        np.testing.assert_almost_equal(fv[:, 18:24], fv[:, 24:30] ** 2)
+
+    def test_texture_feature_matrix(self):
+        patches = np.random.randint(-100, 300, [5, 10, 10])
+        fv = tfeat.texture_feature_matrix(patches)
+        self.assertEqual(fv.dtype, np.float32)
+        self.assertEqual(fv.shape, (5, 32 + 10))
+
+
+if __name__ == "__main__":
+    unittest.main()